@@ -0,0 +1,98 @@
+import argparse
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, BENCH_DIR)
+
+from loadgen import get_paths, run_load
+
+FLASK_SERVER = f"""
+import sys
+sys.path.insert(0, {SRC_DIR!r})
+from werkzeug.serving import run_simple
+import server
+server.limiter.enabled = False
+server.ensure_tables()
+run_simple('127.0.0.1', int(sys.argv[1]), server.app, threaded=True)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def seed(workdir, links):
+    sys.path.insert(0, SRC_DIR)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import server
+        server.ensure_tables()
+        server.db.close()
+    finally:
+        os.chdir(cwd)
+
+    conn = sqlite3.connect(os.path.join(workdir, "shortener.db"))
+    with conn:
+        conn.executemany(
+            "INSERT INTO urls (original_url, shortcode) VALUES (?, ?)",
+            ((f"https://example.com/{i}", f"bench{i}") for i in range(links))
+        )
+    conn.close()
+    return [f"/bench{i}" for i in range(links)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redirect throughput and latency: Flask view vs ASGI fast path.")
+    parser.add_argument("--links", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    paths = seed(workdir, args.links)
+    env = dict(os.environ, SHORTENER_QR_CACHE_DIR=os.path.join(workdir, "qr_cache"))
+
+    targets = {
+        "flask": [sys.executable, "-c", FLASK_SERVER],
+        "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--app-dir", SRC_DIR,
+                 "--log-level", "warning", "--no-access-log", "--port"]
+    }
+
+    print(f"{'path':6} {'req/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, command in targets.items():
+        port = free_port()
+        process = subprocess.Popen(command + [str(port)], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port)
+            result = run_load("127.0.0.1", port, get_paths(paths), args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{name:6} {result['rps']:>10.0f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
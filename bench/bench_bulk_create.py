@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-link and batch link creation throughput.")
+    parser.add_argument("--links", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    import server
+
+    server.limiter.enabled = False
+    server.ensure_tables()
+    client = server.app.test_client()
+
+    start = time.perf_counter()
+    for i in range(args.links):
+        response = client.post('/api/links', json={"url": f"https://example.com/single/{i}"})
+        assert response.status_code == 201, response.json
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for offset in range(0, args.links, args.batch_size):
+        count = min(args.batch_size, args.links - offset)
+        items = [{"url": f"https://example.com/batch/{offset + i}"} for i in range(count)]
+        response = client.post('/api/links/batch', json=items)
+        assert response.json["created"] == count, response.json
+    batch = time.perf_counter() - start
+
+    print(f"links:          {args.links}")
+    print(f"single create:  {args.links / single:10.0f} links/s ({single:.2f}s)")
+    print(f"batch create:   {args.links / batch:10.0f} links/s ({batch:.2f}s, {args.batch_size} per request)")
+    print(f"speedup:        {single / batch:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def seed(server, count, length):
+    from codes import base62_encode
+
+    with server.db.writer() as conn:
+        conn.executemany(f'''
+            INSERT OR IGNORE INTO {server.TABLE_URLS} (original_url, shortcode)
+            VALUES (?, ?)
+        ''', ((f"https://example.com/seed/{i}", base62_encode(secrets.randbelow(62 ** length), length))
+              for i in range(count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create throughput per code strategy at several table fill levels.")
+    parser.add_argument("--length", type=int, default=4, help="starting code length; small values make collisions visible")
+    parser.add_argument("--fill", type=int, nargs="+", default=[0, 10000, 100000, 500000])
+    parser.add_argument("--creates", type=int, default=2000)
+    args = parser.parse_args()
+
+    from codes import create_code_generator
+
+    print(f"{'strategy':10} {'fill':>10} {'links/s':>10} {'collisions':>11} {'length':>7}")
+    for strategy in ("random", "counter"):
+        for fill in args.fill:
+            os.chdir(tempfile.mkdtemp())
+            sys.modules.pop("server", None)
+            import server
+
+            server.limiter.enabled = False
+            server.ensure_tables()
+            seed(server, fill, args.length)
+            server.code_generator = server.storage.code_generator = create_code_generator(
+                strategy, server.TABLE_COUNTERS, length=args.length
+            )
+            client = server.app.test_client()
+
+            start = time.perf_counter()
+            for i in range(args.creates):
+                response = client.post('/api/links', json={"url": f"https://example.com/{i}"})
+                assert response.status_code == 201, response.json
+                code = response.json["shortcode"]
+            elapsed = time.perf_counter() - start
+
+            stats = server.code_generator.stats()
+            print(f"{strategy:10} {fill:>10} {args.creates / elapsed:>10.0f} {stats['collisions']:>11} {len(code):>7}")
+            server.click_queue.stop()
+            server.db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from codes import create_code_generator
+from db import Database
+from loadgen import percentile
+from rollups import Rollups
+from storage import SQLiteStorage
+
+# Latency of storage.search_links() at a given number of links:
+#
+#     python bench/bench_search.py --links 10000000
+#     python bench/bench_search.py --links 1000000 --queries 500 --budget-ms 5
+#
+# The seed (bench/data/search-<links>) is built once: links are inserted
+# with search off, as an existing database would be, and the FTS index is
+# then built by the same create_tables() a server runs on start. Destination
+# URLs mix a few thousand hosts and a few hundred path words, so common
+# words match a large share of the table.
+
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+
+WORDS = """
+about account admin article assets author backup banner beta billing blog board book booking
+branch build calendar campaign cart catalog category chapter chart checkout city class cloud
+code comment community compare config contact content course create customer dashboard data
+deal demo design detail developer device discount docs domain download draft edit editor
+email event export faq feature feed file filter finance forum gallery game garden gift guide
+health help history home hotel image import index info insight invoice item job journal
+kitchen label landing language launch learn legal library license link list live login
+market media meeting member menu message mobile model money movie music network news
+newsletter note offer office order page partner payment people photo plan player podcast
+policy portal post press pricing privacy product profile program project promo python
+question quiz radio recipe record release report request research resource review reward
+sale sample schedule school science search season security service settings share shop
+signup site sport stats status store story student study summary support survey team tech
+terms test theme ticket timeline tool topic tour track training travel trial tutorial
+update upload user video view vote wallet watch weather webinar wiki winter work workshop
+""".split()
+HOSTS = 5000
+TLDS = ["com", "org", "net", "io", "dev"]
+SUBDOMAINS = ["www", "blog", "shop", "docs", "app"]
+
+
+def seed_dir(links):
+    return os.path.join(DATA_DIR, f"search-{links}")
+
+
+def open_storage(directory, search=True):
+    database = Database(os.path.join(directory, "shortener.db"), pool_size=4)
+    storage = SQLiteStorage(database, "urls", "analytics", "counters",
+                            create_code_generator("random", "counters"), Rollups("analytics"), search=search)
+    return storage, database
+
+
+def seed(directory, links):
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    started = time.perf_counter()
+
+    storage, database = open_storage(directory, search=False)
+    storage.create_tables()
+    database.close()
+
+    conn = sqlite3.connect(os.path.join(directory, "shortener.db"), isolation_level=None)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("CREATE TEMP TABLE seed_words (idx INTEGER PRIMARY KEY, word TEXT)")
+    conn.executemany("INSERT INTO seed_words VALUES (?, ?)", enumerate(WORDS))
+    conn.execute("CREATE TEMP TABLE seed_tlds (idx INTEGER PRIMARY KEY, tld TEXT)")
+    conn.executemany("INSERT INTO seed_tlds VALUES (?, ?)", enumerate(TLDS))
+    conn.execute("CREATE TEMP TABLE seed_subdomains (idx INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO seed_subdomains VALUES (?, ?)", enumerate(SUBDOMAINS))
+
+    # Codes are a bijection of the row number onto 32 bits, so they are
+    # unique and spread over the whole hex range.
+    conn.execute("BEGIN")
+    conn.execute('''
+        INSERT INTO urls (original_url, shortcode, created_at)
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < :links)
+        SELECT 'https://' || s.name || '.site' || ((i * 2246822519) % 4294967279 % :hosts) || '.' || t.tld
+                   || '/' || a.word || '/' || b.word || '-' || c.word || '-' || i
+                   || CASE WHEN i % 4 = 0 THEN '?utm_source=' || c.word ELSE '' END,
+               printf('%08x', (i * 2654435761) % 4294967296),
+               datetime('now', '-' || (:links - i) || ' seconds')
+        FROM n
+        JOIN temp.seed_subdomains s ON s.idx = i % 5
+        JOIN temp.seed_tlds t ON t.idx = (i * 2246822519) % 4294967279 % :hosts % 5
+        JOIN temp.seed_words a ON a.idx = (i * 48271) % 2147483647 % :words
+        JOIN temp.seed_words b ON b.idx = (i * 69621) % 2147483647 % :words
+        JOIN temp.seed_words c ON c.idx = (i * 16807) % 2147483647 % :words
+    ''', {"links": links, "hosts": HOSTS, "words": len(WORDS)})
+    conn.execute("COMMIT")
+    conn.close()
+    print(f"  {links} links ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    indexed = time.perf_counter()
+    storage, database = open_storage(directory)
+    storage.create_tables()
+    database.close()
+    print(f"  search index ({time.perf_counter() - indexed:.0f}s)", flush=True)
+
+    with open(os.path.join(directory, "seed.json"), "w") as f:
+        json.dump({"links": links, "seconds": round(time.perf_counter() - started, 1)}, f)
+
+
+def make_queries(conn, links, rng):
+    # One generator per kind, each drawing from a random seeded link.
+    def sample():
+        return conn.execute("SELECT shortcode, original_url FROM urls WHERE id = ?",
+                            (rng.randrange(links) + 1,)).fetchone()
+
+    def host(url):
+        return url.split("/")[2]
+
+    def two_words(url):
+        path = url.split("/")
+        return f"{path[3]} {path[4].split('-')[0]}"
+
+    return {
+        "code": lambda: (sample()[0], 0),
+        "code_prefix": lambda: (sample()[0][:3], 0),
+        "domain": lambda: (host(sample()[1]).split(".", 1)[1], 0),
+        "host": lambda: (host(sample()[1]), 0),
+        "word": lambda: (rng.choice(WORDS), 0),
+        "word_prefix": lambda: (rng.choice(WORDS)[:4], 0),
+        "two_words": lambda: (two_words(sample()[1]), 0),
+        "common": lambda: (rng.choice(["https", "com", "www"]), 0),
+        "page_3": lambda: (rng.choice(WORDS), 40),
+    }
+
+
+def run(directory, queries, limit, budget_ms, rng):
+    storage, database = open_storage(directory)
+    storage.create_tables()
+    with open(os.path.join(directory, "seed.json")) as f:
+        links = json.load(f)["links"]
+
+    conn = sqlite3.connect(f"file:{os.path.join(directory, 'shortener.db')}?mode=ro", uri=True)
+    kinds = make_queries(conn, links, rng)
+    print(f"{'query':<12} {'example':<28} {'results':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8}", flush=True)
+
+    failed = []
+    for kind, make in kinds.items():
+        latencies = []
+        found = 0
+        example = None
+        for _ in range(queries):
+            query, offset = make()
+            example = example or query
+            start = time.perf_counter()
+            results, _ = storage.search_links(query, limit, offset)
+            latencies.append(time.perf_counter() - start)
+            found += len(results)
+        p99 = percentile(latencies, 99) * 1000
+        if p99 > budget_ms:
+            failed.append(kind)
+        print(f"{kind:<12} {example[:28]:<28} {found / queries:>8.1f} {percentile(latencies, 50) * 1000:>8.2f} "
+              f"{percentile(latencies, 95) * 1000:>8.2f} {p99:>8.2f} {max(latencies) * 1000:>8.2f}"
+              f"{'  over budget' if p99 > budget_ms else ''}", flush=True)
+
+    conn.close()
+    database.close()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure link search latency on a seeded database.")
+    parser.add_argument("--links", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--limit", type=int, default=20, help="results per page")
+    parser.add_argument("--budget-ms", type=float, default=10.0, help="p99 each kind must stay under")
+    parser.add_argument("--reseed", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    directory = seed_dir(args.links)
+    if args.reseed or not os.path.exists(os.path.join(directory, "seed.json")):
+        print(f"seeding {directory}", flush=True)
+        seed(directory, args.links)
+
+    failed = run(directory, args.queries, args.limit, args.budget_ms, random.Random(args.seed))
+    print(f"p99 over {args.budget_ms:g} ms: {', '.join(failed)}" if failed else f"all under {args.budget_ms:g} ms")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from bench_asgi import FLASK_SERVER, free_port, wait_for
+from loadgen import run_load
+from rollups import Rollups, agent_family, referrer_host
+
+# Mixed-workload benchmark for the web endpoints. A database is seeded once
+# per size and copied for every run, then each workload is replayed both
+# in-process (werkzeug test client, no HTTP server) and over loopback HTTP,
+# recording throughput and p50/p95/p99 latency per route. Results are saved
+# as JSON keyed by commit, and a run can be compared against an earlier one:
+#
+#     python bench/bench_workloads.py seed --links 1000000 --clicks 100000000
+#     python bench/bench_workloads.py run --links 1000000 --clicks 100000000
+#     python bench/bench_workloads.py run --compare bench/results/<commit>.json
+#     python bench/bench_workloads.py compare old.json new.json
+
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Route weights per workload.
+WORKLOADS = {
+    "redirect": {"redirect": 95, "redirect_miss": 5},
+    "create": {"create": 90, "create_batch": 10},
+    "analytics": {"analytics": 30, "timeseries": 30, "get_link": 10, "list_links": 20, "dashboard": 10},
+    "mixed": {"redirect": 80, "redirect_miss": 2, "create": 4, "get_link": 3, "list_links": 5, "dashboard": 2,
+              "analytics": 2, "timeseries": 2},
+}
+# Writes go last so the read workloads see the seeded database as is.
+WORKLOAD_ORDER = ("redirect", "analytics", "mixed", "create")
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+BATCH_SIZE = 100
+
+SEED_REFERRERS = [None, "https://www.google.com/search?q=link", "https://twitter.com/someone/status/1",
+                  "https://news.ycombinator.com/item?id=1", "https://www.reddit.com/r/programming/"]
+SEED_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "Version/17.0 Mobile/15E148 Safari/604.1",
+    "curl/8.4.0",
+    "Googlebot/2.1 (+http://www.google.com/bot.html)",
+]
+
+INIT_SCHEMA = f"""
+import sys
+sys.path.insert(0, {SRC_DIR!r})
+import server
+server.ensure_tables()
+"""
+
+INPROCESS_RUNNER = f"""
+import json, sys
+sys.path.insert(0, {SRC_DIR!r})
+sys.path.insert(0, {BENCH_DIR!r})
+import server
+from bench_workloads import run_inprocess
+server.limiter.enabled = False
+server.ensure_tables()
+results = run_inprocess(server.app, json.loads(sys.argv[1]))
+server.click_queue.stop()
+print(json.dumps(results))
+"""
+
+UVICORN_SERVER = f"""
+import sys
+sys.path.insert(0, {SRC_DIR!r})
+import uvicorn
+import asgi, server
+server.limiter.enabled = False
+uvicorn.run(asgi.app, host='127.0.0.1', port=int(sys.argv[1]), log_level='warning', access_log=False)
+"""
+
+HTTP_SERVERS = {"werkzeug": FLASK_SERVER, "uvicorn": UVICORN_SERVER}
+
+
+def app_env(workdir):
+    # Background jobs would archive the seeded clicks mid-run.
+    return dict(os.environ, SHORTENER_BACKGROUND_JOBS="0",
+                SHORTENER_QR_CACHE_DIR=os.path.join(workdir, "qr_cache"))
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(dirty)
+
+
+def seed_dir(links, clicks):
+    return os.path.join(DATA_DIR, f"{links}-links-{clicks}-clicks")
+
+
+def read_seed(directory):
+    try:
+        with open(os.path.join(directory, "seed.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def seed(directory, links, clicks, days=30, chunk_size=1000000):
+    # Rows are generated inside SQLite from multiplicative hashes of the row
+    # number, so a seed is the same every time. Link popularity is skewed
+    # toward low numbers (the minimum of two uniform picks), like the
+    # requests. Raw clicks, per-link counts and rollups are all filled in, as
+    # if the clicks had gone through ClickQueue.
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    subprocess.run([sys.executable, "-c", INIT_SCHEMA], cwd=directory, env=app_env(directory), check=True)
+
+    rollups = Rollups("analytics")
+    conn = sqlite3.connect(os.path.join(directory, "shortener.db"), isolation_level=None)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = FILE")
+    started = time.perf_counter()
+
+    conn.execute("DROP INDEX IF EXISTS idx_analytics_shortcode")
+    conn.execute("CREATE TEMP TABLE seed_referrers (idx INTEGER PRIMARY KEY, value TEXT, host TEXT)")
+    conn.executemany("INSERT INTO seed_referrers VALUES (?, ?, ?)",
+                     [(i, value, referrer_host(value)) for i, value in enumerate(SEED_REFERRERS)])
+    conn.execute("CREATE TEMP TABLE seed_agents (idx INTEGER PRIMARY KEY, value TEXT, family TEXT)")
+    conn.executemany("INSERT INTO seed_agents VALUES (?, ?, ?)",
+                     [(i, value, agent_family(value)) for i, value in enumerate(SEED_AGENTS)])
+
+    # 10% of links expire, a year out so the sweeper leaves them alone.
+    conn.execute("BEGIN")
+    conn.execute('''
+        INSERT INTO urls (original_url, shortcode, created_at, expires_at)
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < :links)
+        SELECT 'https://example.com/' || i,
+               'b' || i,
+               datetime('now', '-' || ((i * 2654435761) % (:days * 86400)) || ' seconds'),
+               CASE WHEN i % 10 = 0 THEN datetime('now', 'localtime', '+365 days') END
+        FROM n
+    ''', {"links": links, "days": days})
+    conn.execute("COMMIT")
+    print(f"  {links} links ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    for start in range(0, clicks, chunk_size):
+        conn.execute("BEGIN")
+        conn.execute('''
+            INSERT INTO analytics (shortcode, ip_address, user_agent, referrer, timestamp)
+            WITH RECURSIVE n(i) AS (SELECT :start UNION ALL SELECT i + 1 FROM n WHERE i + 1 < :end)
+            SELECT 'b' || min((i * 2654435761) % 4294967291 % :links, (i * 2246822519 + 7) % 4294967279 % :links),
+                   '10.' || ((i * 48271) % 16777213 / 65536) || '.' || ((i * 48271) % 16777213 / 256 % 256)
+                        || '.' || ((i * 48271) % 16777213 % 256),
+                   a.value,
+                   r.value,
+                   datetime('now', '-' || ((i * 69621) % (:days * 86400)) || ' seconds')
+            FROM n
+            JOIN temp.seed_agents a ON a.idx = i % 5
+            JOIN temp.seed_referrers r ON r.idx = (i / 7) % 5
+        ''', {"start": start, "end": min(clicks, start + chunk_size), "links": links, "days": days})
+        conn.execute("COMMIT")
+        print(f"  {min(clicks, start + chunk_size)} clicks ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    visitors_since = (datetime.now(timezone.utc) - timedelta(days=2)).strftime('%Y-%m-%d')
+    conn.execute("BEGIN")
+    conn.execute('''
+        CREATE TEMP TABLE seed_counts AS
+        SELECT shortcode, COUNT(*) AS clicks FROM analytics GROUP BY shortcode
+    ''')
+    conn.execute('''
+        UPDATE urls SET clicks = seed_counts.clicks
+        FROM temp.seed_counts
+        WHERE urls.shortcode = seed_counts.shortcode
+    ''')
+    for granularity, bucket in (("day", "substr(timestamp, 1, 10)"),
+                                ("hour", "substr(timestamp, 1, 13) || ':00:00'")):
+        conn.execute(f'''
+            INSERT INTO {rollups.table_buckets} (shortcode, granularity, bucket, clicks, unique_ips)
+            SELECT shortcode, '{granularity}', {bucket}, COUNT(*), COUNT(DISTINCT ip_address)
+            FROM analytics
+            GROUP BY shortcode, {bucket}
+        ''')
+        # Only buckets that can still get clicks keep their visitor sets;
+        # retention compacts the rest the same way.
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {rollups.table_visitors} (shortcode, granularity, bucket, ip_address)
+            SELECT shortcode, '{granularity}', {bucket}, ip_address
+            FROM analytics
+            WHERE timestamp >= ?
+        ''', (visitors_since,))
+    conn.execute(f'''
+        INSERT INTO {rollups.table_referrers} (shortcode, day, referrer, clicks)
+        SELECT a.shortcode, substr(a.timestamp, 1, 10), r.host, COUNT(*)
+        FROM analytics a JOIN temp.seed_referrers r ON r.value IS a.referrer
+        GROUP BY 1, 2, 3
+    ''')
+    conn.execute(f'''
+        INSERT INTO {rollups.table_agents} (shortcode, day, family, clicks)
+        SELECT a.shortcode, substr(a.timestamp, 1, 10), g.family, COUNT(*)
+        FROM analytics a JOIN temp.seed_agents g ON g.value = a.user_agent
+        GROUP BY 1, 2, 3
+    ''')
+    conn.execute("COMMIT")
+    print(f"  counts and rollups ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    # Visitor sketches go through the same code as live clicks, sorted so
+    # each sketch is read and written about once.
+    conn.execute("BEGIN")
+    cursor = conn.execute("SELECT shortcode, ip_address, user_agent, referrer, timestamp FROM analytics "
+                          "ORDER BY shortcode")
+    while True:
+        rows = cursor.fetchmany(50000)
+        if not rows:
+            break
+        rollups.apply_sketches(conn, rows)
+    conn.execute("COMMIT")
+    print(f"  visitor sketches ({time.perf_counter() - started:.0f}s)", flush=True)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+    # Puts back the indexes dropped for the bulk load.
+    subprocess.run([sys.executable, "-c", INIT_SCHEMA], cwd=directory, env=app_env(directory), check=True)
+    commit, _ = git_commit()
+    with open(os.path.join(directory, "seed.json"), "w") as f:
+        json.dump({"links": links, "clicks": clicks, "days": days, "commit": commit,
+                   "seconds": round(time.perf_counter() - started, 1)}, f)
+
+
+def make_requests(workload, links, seed=1):
+    rng = random.Random(seed)
+    sequence = itertools.count()
+
+    def code():
+        return f"b{min(rng.randrange(links), rng.randrange(links))}"
+
+    def create_batch():
+        start = next(sequence) * BATCH_SIZE
+        items = [{"url": f"https://example.org/batch/{seed}/{start + i}"} for i in range(BATCH_SIZE)]
+        return "POST", "/api/links/batch", json.dumps(items).encode(), JSON_HEADERS
+
+    builders = {
+        "redirect": lambda: ("GET", f"/{code()}", None, None),
+        "redirect_miss": lambda: ("GET", f"/missing{next(sequence)}", None, None),
+        "create": lambda: ("POST", "/api/links",
+                           json.dumps({"url": f"https://example.org/{seed}/{next(sequence)}"}).encode(),
+                           JSON_HEADERS),
+        "create_batch": create_batch,
+        "get_link": lambda: ("GET", f"/api/links/{code()}", None, None),
+        "list_links": lambda: ("GET", "/api/links?limit=50", None, None),
+        "dashboard": lambda: ("GET", "/", None, None),
+        "analytics": lambda: ("GET", f"/api/analytics/{code()}", None, None),
+        "timeseries": lambda: ("GET", f"/api/analytics/{code()}/timeseries?granularity=day", None, None),
+    }
+    labels = list(WORKLOADS[workload])
+    weights = list(WORKLOADS[workload].values())
+
+    def make_request():
+        label = rng.choices(labels, weights)[0]
+        return (*builders[label](), label)
+
+    return make_request
+
+
+def run_workloads(run_one, config):
+    results = {}
+    for workload in config["workloads"]:
+        if config["warmup"]:
+            run_one(make_requests(workload, config["links"], config["seed"] + 1000), config["warmup"])
+        results[workload] = run_one(make_requests(workload, config["links"], config["seed"]), config["duration"])
+    return results
+
+
+def run_inprocess(app, config):
+    # Called in a child process that has imported the app.
+    from loadgen import run_wsgi
+
+    return run_workloads(
+        lambda make_request, duration: run_wsgi(app, make_request, config["concurrency"], duration, (404,)),
+        config
+    )
+
+
+def copy_seed(directory):
+    workdir = tempfile.mkdtemp(prefix="shortener-bench-")
+    shutil.copy(os.path.join(directory, "shortener.db"), workdir)
+    return workdir
+
+
+def bench_inprocess(directory, config):
+    workdir = copy_seed(directory)
+    try:
+        output = subprocess.run([sys.executable, "-c", INPROCESS_RUNNER, json.dumps(config)], cwd=workdir,
+                                env=app_env(workdir), capture_output=True, text=True)
+        if output.returncode != 0:
+            raise RuntimeError(f"in-process run failed:\n{output.stderr}")
+        return json.loads(output.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_http(directory, config, server):
+    workdir = copy_seed(directory)
+    port = free_port()
+    process = subprocess.Popen([sys.executable, "-c", HTTP_SERVERS[server], str(port)], cwd=workdir,
+                               env=app_env(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port, timeout=120)
+        return run_workloads(
+            lambda make_request, duration: run_load("127.0.0.1", port, make_request, config["concurrency"],
+                                                    duration, (404,)),
+            config
+        )
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results):
+    print(f"{'run':24} {'route':14} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for key, result in results.items():
+        rows = [("(all)", result)] + sorted(result.get("routes", {}).items())
+        for route, stats in rows:
+            print(f"{key:24} {route:14} {stats['rps']:>9.0f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                  f"{stats['p99_ms']:>8.2f} {stats['errors']:>7}")
+
+
+def compare(baseline, current, threshold):
+    # Flags routes whose throughput fell or whose p95 rose by more than
+    # threshold. p99 is shown but not judged; it is too noisy on short runs.
+    print(f"{baseline.get('commit')} -> {current.get('commit')}")
+    print(f"{'run':24} {'route':14} {'req/s':>16} {'p95 ms':>18} {'p99 ms':>18}")
+    regressions = []
+    for key, result in current["results"].items():
+        old_result = baseline["results"].get(key)
+        if not old_result:
+            continue
+        for route, stats in sorted(result.get("routes", {}).items()):
+            old = old_result.get("routes", {}).get(route)
+            if not old or not old["requests"] or not stats["requests"]:
+                continue
+            rps = stats["rps"] / old["rps"] - 1
+            p95 = stats["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+            p99 = stats["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+            flag = rps < -threshold or p95 > threshold
+            if flag:
+                regressions.append(f"{key} {route}")
+            print(f"{key:24} {route:14} {stats['rps']:>9.0f} {rps:>+6.0%} {stats['p95_ms']:>10.2f} {p95:>+7.0%} "
+                  f"{stats['p99_ms']:>10.2f} {p99:>+7.0%}{'  REGRESSION' if flag else ''}")
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def cmd_seed(args):
+    directory = args.data or seed_dir(args.links, args.clicks)
+    print(f"seeding {directory}")
+    seed(directory, args.links, args.clicks, args.days)
+
+
+def cmd_run(args):
+    directory = args.data or seed_dir(args.links, args.clicks)
+    seeded = read_seed(directory)
+    if seeded is None:
+        print(f"seeding {directory}")
+        seed(directory, args.links, args.clicks, args.days)
+        seeded = read_seed(directory)
+
+    config = {
+        "links": seeded["links"],
+        "workloads": [name for name in WORKLOAD_ORDER if name in args.workload],
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "seed": args.seed
+    }
+    results = {}
+    if args.mode in ("inprocess", "both"):
+        for workload, result in bench_inprocess(directory, config).items():
+            results[f"inprocess/{workload}"] = result
+    if args.mode in ("http", "both"):
+        for workload, result in bench_http(directory, config, args.server).items():
+            results[f"http-{args.server}/{workload}"] = result
+
+    commit, dirty = git_commit()
+    report = {
+        "commit": f"{commit}-dirty" if dirty else commit,
+        "date": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "data": {"links": seeded["links"], "clicks": seeded["clicks"]},
+        "config": config,
+        "results": results
+    }
+    print_results(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        if baseline["data"] != report["data"] or baseline["config"] != report["config"]:
+            print("warning: baseline was run with different data or settings")
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+            sys.exit(1)
+
+
+def cmd_compare(args):
+    regressions = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed, replay and compare mixed endpoint workloads.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_data_options(command):
+        command.add_argument("--links", type=int, default=100000)
+        command.add_argument("--clicks", type=int, default=1000000)
+        command.add_argument("--days", type=int, default=30, help="spread seeded clicks over this many days")
+        command.add_argument("--data", help="seed directory (default: bench/data/<links>-links-<clicks>-clicks)")
+
+    seed_command = commands.add_parser("seed", help="(re)create a seeded database")
+    add_data_options(seed_command)
+    seed_command.set_defaults(func=cmd_seed)
+
+    run_command = commands.add_parser("run", help="replay workloads against a copy of the seed")
+    add_data_options(run_command)
+    run_command.add_argument("--workload", nargs="+", choices=sorted(WORKLOADS), default=list(WORKLOAD_ORDER))
+    run_command.add_argument("--mode", choices=("inprocess", "http", "both"), default="both")
+    run_command.add_argument("--server", choices=sorted(HTTP_SERVERS), default="werkzeug")
+    run_command.add_argument("--concurrency", type=int, default=16)
+    run_command.add_argument("--duration", type=float, default=10.0, help="seconds per workload")
+    run_command.add_argument("--warmup", type=float, default=2.0, help="unrecorded seconds before each workload")
+    run_command.add_argument("--seed", type=int, default=1)
+    run_command.add_argument("--output", help="results file (default: bench/results/<commit>.json)")
+    run_command.add_argument("--compare", help="earlier results file to check for regressions")
+    run_command.add_argument("--threshold", type=float, default=0.10)
+    run_command.set_defaults(func=cmd_run)
+
+    compare_command = commands.add_parser("compare", help="compare two results files")
+    compare_command.add_argument("baseline")
+    compare_command.add_argument("current")
+    compare_command.add_argument("--threshold", type=float, default=0.10)
+    compare_command.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000
+    }
+
+
+async def _request(reader, writer, host, method, path, body=None, headers=None):
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: keep-alive"]
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    if body is not None:
+        lines.append(f"Content-Length: {len(body)}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    keep_alive = status_line.startswith(b"HTTP/1.1")
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value.strip())
+        elif name == "connection":
+            keep_alive = value.strip().lower() != "close"
+    if length:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+class _Recorder:
+    # Latencies and errors, overall and per route label. make_request() may
+    # return a fifth item naming the route; unlabelled requests only count
+    # towards the totals.
+    def __init__(self, expected_errors):
+        self.expected_errors = expected_errors
+        self.latencies = []
+        self.errors = 0
+        self.routes = defaultdict(list)
+        self.route_errors = defaultdict(int)
+
+    def record(self, label, status, latency):
+        self.latencies.append(latency)
+        if label is not None:
+            self.routes[label].append(latency)
+        if status is None or (status >= 400 and status not in self.expected_errors):
+            self.error(label)
+
+    def error(self, label):
+        self.errors += 1
+        if label is not None:
+            self.route_errors[label] += 1
+
+    def summarize(self, elapsed):
+        result = summarize(self.latencies, elapsed, self.errors)
+        if self.routes or self.route_errors:
+            result["routes"] = {
+                label: summarize(self.routes.get(label, []), elapsed, self.route_errors.get(label, 0))
+                for label in sorted(set(self.routes) | set(self.route_errors))
+            }
+        return result
+
+
+def _unpack(request):
+    method, path, body, headers = request[:4]
+    return method, path, body, headers, request[4] if len(request) > 4 else None
+
+
+async def _worker(host, port, make_request, deadline, recorder):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        method, path, body, headers, label = _unpack(make_request())
+        start = time.perf_counter()
+        try:
+            status, keep_alive = await _request(reader, writer, host, method, path, body, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            recorder.error(label)
+            writer.close()
+            writer = None
+            continue
+        recorder.record(label, status, time.perf_counter() - start)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _run(host, port, make_request, concurrency, duration, expected_errors):
+    recorder = _Recorder(expected_errors)
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(
+        _worker(host, port, make_request, deadline, recorder)
+        for _ in range(concurrency)
+    ))
+    return recorder.summarize(time.perf_counter() - start)
+
+
+def run_load(host, port, make_request, concurrency=32, duration=10.0, expected_errors=()):
+    # make_request() returns (method, path, body or None, headers or None),
+    # optionally followed by a route label for per-route results. Any 4xx/5xx
+    # status not listed in expected_errors counts as an error.
+    return asyncio.run(_run(host, port, make_request, concurrency, duration, set(expected_errors)))
+
+
+def run_wsgi(app, make_request, concurrency=8, duration=10.0, expected_errors=()):
+    # The same load driven in-process through werkzeug's test client, one
+    # thread per concurrent client, so the numbers leave out the HTTP server.
+    from werkzeug.test import Client
+
+    recorder = _Recorder(set(expected_errors))
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker():
+        client = Client(app)
+        while time.perf_counter() < deadline:
+            method, path, body, headers, label = _unpack(make_request())
+            began = time.perf_counter()
+            try:
+                response = client.open(path, method=method, data=body, headers=headers)
+                status = response.status_code
+                response.close()
+            except Exception:
+                status = None
+            latency = time.perf_counter() - began
+            with lock:
+                recorder.record(label, status, latency)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summarize(time.perf_counter() - start)
+
+
+def get_paths(paths):
+    def make_request():
+        return "GET", random.choice(paths), None, None
+    return make_request
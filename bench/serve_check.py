@@ -0,0 +1,118 @@
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from miniredis import RespServer
+
+# Starts serve.py with several workers and checks that an update or delete
+# made through one worker reaches the redirects of all of them, for each way
+# workers can share link changes:
+#
+#     python bench/serve_check.py --workers 4
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status, response.getheader("Location")
+    finally:
+        conn.close()
+
+
+def redirects(port, code, count):
+    # A fresh connection per request, so the kernel spreads them over workers.
+    return [request(port, "GET", f"/{code}") for _ in range(count)]
+
+
+def run_server(workdir, workers, env):
+    port = free_port()
+    env = dict(os.environ, SHORTENER_RATELIMIT_STORAGE="memory://", **env)
+    proc = subprocess.Popen([sys.executable, os.path.join(SRC, "serve.py"), "--port", str(port),
+                             "--workers", str(workers), "--graceful-timeout", "5"],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            request(port, "GET", "/api/stats")
+            return proc, port
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise AssertionError("server did not start")
+            time.sleep(0.2)
+
+
+def check_changes_reach_every_worker(port, requests):
+    status, _ = request(port, "POST", "/api/links", {"url": "https://example.com/old", "code": "stale1"})
+    assert status == 201
+    # Every worker caches the old target.
+    assert set(redirects(port, "stale1", requests)) == {(302, "https://example.com/old")}
+
+    status, _ = request(port, "PUT", "/api/links/stale1", {"new_url": "https://example.com/new"})
+    assert status == 200
+    seen = redirects(port, "stale1", requests)
+    assert set(seen) == {(302, "https://example.com/new")}, seen
+
+    status, _ = request(port, "DELETE", "/api/links/stale1")
+    assert status == 200
+    seen = [status for status, _ in redirects(port, "stale1", requests)]
+    assert set(seen) == {404}, seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that link changes reach every serve.py worker.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40)
+    args = parser.parse_args()
+
+    redis = RespServer(("127.0.0.1", 0)).start()
+    modes = [
+        ("link index (default)", {}),
+        ("no link index", {"SHORTENER_LINK_INDEX_DIR": ""}),
+        ("shared cache", {"SHORTENER_SHARED_CACHE": f"redis://127.0.0.1:{redis.server_address[1]}/0"})
+    ]
+
+    failures = 0
+    print(f"serve.py with {args.workers} workers")
+    for label, env in modes:
+        proc = None
+        try:
+            proc, port = run_server(tempfile.mkdtemp(), args.workers, env)
+            check_changes_reach_every_worker(port, args.requests)
+            status = "ok"
+        except Exception:
+            failures += 1
+            status = "FAIL\n" + traceback.format_exc()
+        finally:
+            if proc is not None:
+                proc.send_signal(signal.SIGTERM)
+                proc.wait(30)
+        print(f"  {label:32} {status}")
+    redis.shutdown()
+    redis.server_close()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
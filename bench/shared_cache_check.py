@@ -0,0 +1,144 @@
+import argparse
+import os
+import socket
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from cache import MISSING
+from miniredis import RespServer
+from shared_cache import INVALIDATION_CHANNEL, RedisSharedCache
+
+# Runs RedisSharedCache over a real socket against the miniredis stand-in,
+# one fresh server per check:
+#
+#     python bench/shared_cache_check.py
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for condition")
+        time.sleep(0.01)
+
+
+def check_set_and_get(server, url):
+    cache = RedisSharedCache(url)
+    assert cache.get("alpha") is MISSING
+    cache.set("alpha", ("https://example.com/a", None, None), 60)
+    cache.set("beta", ("https://example.com/b", "2030-01-01 00:00:00", 308), 60)
+    assert cache.get("alpha") == ("https://example.com/a", None, None)
+    assert cache.get("beta") == ("https://example.com/b", "2030-01-01 00:00:00", 308)
+    assert server.store.get(b"shortener:link:alpha") is not None
+
+    # Another client, i.e. another node, sees the same entries.
+    other = RedisSharedCache(url)
+    assert other.get("beta")[2] == 308
+    cache.delete("alpha", "beta")
+    assert other.get("alpha") is MISSING and other.get("beta") is MISSING
+
+    stats = cache.stats()
+    assert stats["backend"] == "redis" and stats["errors"] == 0
+    assert stats["hits"] == 2 and stats["misses"] == 1
+
+    cache.set("short", ("https://example.com/s", None, None), 1)
+    wait_for(lambda: cache.get("short") is MISSING, timeout=3.0)
+
+
+def check_negative_cache(server, url):
+    cache = RedisSharedCache(url)
+    cache.set("gone", None, 1)
+    # A cached 404 is None, which callers must tell apart from a miss.
+    assert cache.get("gone") is None
+    assert RedisSharedCache(url).get("gone") is None
+    wait_for(lambda: cache.get("gone") is MISSING, timeout=3.0)
+
+    cache.set("gone", None, 60)
+    cache.set("gone", ("https://example.com/back", None, None), 60)
+    assert cache.get("gone") == ("https://example.com/back", None, None)
+
+
+def check_invalidation(server, url):
+    writer = RedisSharedCache(url)
+    reader = RedisSharedCache(url)
+    received = []
+    reader.subscribe(received.append)
+    reader.start()
+    try:
+        wait_for(lambda: server.store.channels.get(INVALIDATION_CHANNEL.encode()))
+        writer.set("alpha", ("https://example.com/a", None, None), 60)
+        writer.set("beta", ("https://example.com/b", None, None), 60)
+        assert reader.get("alpha") is not MISSING
+
+        writer.invalidate("alpha", None, "beta")
+        wait_for(lambda: received)
+        assert received == [["alpha", "beta"]]
+        assert reader.get("alpha") is MISSING and reader.get("beta") is MISSING
+
+        # Nothing is published for an empty invalidation.
+        writer.invalidate(None, "")
+        writer.invalidate("gamma")
+        wait_for(lambda: len(received) == 2)
+        assert received[1] == ["gamma"]
+    finally:
+        reader.close()
+
+
+def check_server_down(server, url):
+    # A port nobody listens on: every call degrades to a miss or a no-op.
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    cache = RedisSharedCache(f"redis://127.0.0.1:{port}/0")
+    cache.set("alpha", ("https://example.com/a", None, None), 60)
+    cache.invalidate("alpha")
+    assert cache.get("alpha") is MISSING
+    assert cache.errors >= 1 and cache.hits == 0
+
+    received = []
+    cache.subscribe(received.append)
+    cache.start()
+    try:
+        # The listener tells subscribers to drop everything while it can't connect.
+        wait_for(lambda: received)
+        assert received[0] is None
+    finally:
+        cache.close()
+
+
+CHECKS = [
+    check_set_and_get,
+    check_negative_cache,
+    check_invalidation,
+    check_server_down
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check RedisSharedCache against the miniredis server.")
+    parser.parse_args()
+
+    failures = 0
+    print("redis shared cache: conformance")
+    for check in CHECKS:
+        server = RespServer(("127.0.0.1", 0)).start()
+        url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+        try:
+            check(server, url)
+            status = "ok"
+        except Exception:
+            failures += 1
+            status = "FAIL\n" + traceback.format_exc()
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(f"  {check.__name__:32} {status}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,547 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from codes import create_code_generator
+from db import Database
+from linkindex import LinkIndex
+from rollups import Rollups
+from storage import STORAGE_BACKENDS, CodeUnavailable, DuplicateLink, ShortcodeTaken, create_storage
+
+# Conformance checks and a small write/read benchmark that every storage
+# backend runs against a fresh database:
+#
+#     python bench/storage_suite.py                 # all backends
+#     python bench/storage_suite.py --backend log --links 50000 --clicks 500000
+#     python bench/storage_suite.py --link-index   # resolve through the mmap index
+
+
+def open_storage(backend, workdir, with_index=False):
+    os.chdir(workdir)
+    database = Database("shortener.db", pool_size=4)
+    generator = create_code_generator("random", "counters")
+    options = {"log_dir": os.path.join(workdir, "click_log")} if backend == "log" else {}
+    if with_index:
+        options["link_index"] = LinkIndex(os.path.join(workdir, "link_index"), max_delta=100)
+    storage = create_storage(backend, database, "urls", "analytics", "counters",
+                             generator, Rollups("analytics"), **options)
+    storage.create_tables()
+    return storage, database
+
+
+def link(url, code=None, expires_at=None, redirect=None):
+    return {"url": url, "code": code, "expires_at": expires_at, "redirect": redirect}
+
+
+def click(code, timestamp, ip="10.0.0.1", agent="Mozilla/5.0 Firefox/120.0", referrer=None):
+    return (code, ip, agent, referrer, timestamp)
+
+
+def check_create_and_resolve(storage):
+    assert storage.create_link(link("https://example.com/a", "alpha")) == "alpha"
+    assert storage.resolve("alpha") == ("https://example.com/a", None, None)
+    assert storage.resolve("missing") is None
+
+    generated = storage.create_link(link("https://example.com/b"))
+    assert generated and storage.resolve(generated)[0] == "https://example.com/b"
+
+    try:
+        storage.create_link(link("https://example.com/c", "alpha"))
+    except ShortcodeTaken:
+        pass
+    else:
+        raise AssertionError("duplicate custom code was accepted")
+
+    found = storage.get_link("alpha")
+    assert found["original_url"] == "https://example.com/a"
+    assert found["clicks"] == 0 and found["expires_at"] is None
+    assert storage.count_links() == 2
+
+
+def check_generator_exhaustion(storage):
+    original = storage.code_generator
+
+    class Stuck:
+        collisions = 0
+
+        def generate(self, conn):
+            return "alpha"
+
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.code_generator = Stuck()
+    try:
+        storage.create_link(link("https://example.com/x"))
+    except CodeUnavailable:
+        pass
+    else:
+        raise AssertionError("expected CodeUnavailable")
+    finally:
+        storage.code_generator = original
+
+
+def check_batch_create(storage):
+    storage.create_link(link("https://example.com/taken", "taken"))
+    links = [
+        (0, link("https://example.com/0", "one")),
+        (1, link("https://example.com/1", "taken")),
+        (2, link("https://example.com/2")),
+        (3, link("https://example.com/3", "one")),
+    ]
+    assigned, failed = storage.create_links(links)
+    assert sorted(index for index, _ in assigned) == [0, 2]
+    assert sorted(failed) == [(1, "taken"), (3, "one")]
+    for _, created in assigned:
+        assert storage.resolve(created["code"])[0] == created["url"]
+    assert storage.count_links() == 3
+
+
+def check_dedup(storage):
+    first = storage.create_link(link("https://Example.com:443/page/?utm_source=mail&id=7"), dedup=True)
+    try:
+        storage.create_link(link("https://example.com/page?id=7&fbclid=x"), dedup=True)
+    except DuplicateLink as e:
+        assert e.link["code"] == first and e.link["existing"]
+        assert e.link["url"] == "https://Example.com:443/page/?utm_source=mail&id=7"
+    else:
+        raise AssertionError("duplicate URL was not reused")
+
+    # Different destination, redirect or expiry, a custom code or dedup off
+    # all create a new link.
+    assert storage.create_link(link("https://example.com/page?id=8"), dedup=True) != first
+    assert storage.create_link(link("https://example.com/page?id=7", redirect=301), dedup=True) != first
+    expiring = storage.create_link(link("https://example.com/page?id=7", expires_at="2030-01-01 00:00:00"), dedup=True)
+    assert storage.create_link(link("https://example.com/page?id=7", "mine"), dedup=True) == "mine"
+    assert storage.create_link(link("https://example.com/page?id=7")) != first
+
+    links = [
+        (0, link("https://example.com/page?id=7")),
+        (1, link("https://example.com/new")),
+        (2, link("https://EXAMPLE.com/new/")),
+        (3, link("https://example.com/page?id=7", expires_at="2029-01-01 00:00:00")),
+        (4, link("https://example.com/page?id=7", expires_at="2031-01-01 00:00:00")),
+    ]
+    assigned, failed = storage.create_links(links, dedup=True)
+    assigned = dict(assigned)
+    assert not failed and sorted(assigned) == [0, 1, 2, 3, 4]
+    assert assigned[0]["code"] == first and assigned[0]["existing"]
+    assert assigned[2]["code"] == assigned[1]["code"] and assigned[2]["existing"]
+    assert not assigned[1].get("existing")
+    assert assigned[3]["code"] == expiring and assigned[4]["code"] != expiring
+    assert storage.count_links() == 8
+
+    # A changed destination is found under its new URL.
+    storage.update_link(assigned[1]["code"], new_url="https://example.com/moved")
+    try:
+        storage.create_link(link("https://example.com/moved/"), dedup=True)
+    except DuplicateLink as e:
+        assert e.link["code"] == assigned[1]["code"]
+    else:
+        raise AssertionError("updated URL was not reused")
+
+
+def check_search(storage):
+    storage.create_link(link("https://docs.python.org/3/library/sqlite3.html", "py3"))
+    storage.create_link(link("https://www.example.com/blog/search-engines", "blog"))
+    storage.create_link(link("https://example.org/about", "py3x"))
+    storage.create_link(link("https://shop.example.com/cart?item=python-book", "shop"))
+
+    codes = lambda query, limit=10, offset=0: [found["shortcode"] for found in storage.search_links(query, limit, offset)[0]]
+    assert codes("py3") == ["py3", "py3x"]
+    # Terms of three characters or more also match as prefixes.
+    assert codes("py") == ["py3", "py3x"]
+    assert set(codes("pyth")) == {"py3", "shop"}
+    assert set(codes("example.com")) == {"blog", "shop"}
+    assert codes("sqlite3") == ["py3"]
+    assert codes("searc") == ["blog"]
+    assert codes("nothing-here") == []
+
+    links, more = storage.search_links("example", 1)
+    assert len(links) == 1 and more
+    assert len(codes("example", 10, 1)) == 2
+
+    # The index follows updates, renames and deletes.
+    storage.update_link("blog", new_url="https://www.example.com/news", new_code="news")
+    assert codes("searc") == [] and codes("news") == ["news"]
+    storage.delete_link("shop")
+    assert codes("python") == ["py3"]
+
+
+def check_update(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.create_link(link("https://example.com/b", "beta"))
+
+    assert storage.update_link("alpha", "https://example.com/a2")
+    assert storage.resolve("alpha")[0] == "https://example.com/a2"
+
+    assert storage.update_link("alpha", None, "gamma")
+    assert storage.resolve("alpha") is None
+    assert storage.resolve("gamma")[0] == "https://example.com/a2"
+
+    try:
+        storage.update_link("gamma", None, "beta")
+    except ShortcodeTaken:
+        pass
+    else:
+        raise AssertionError("rename onto an existing code was accepted")
+
+    assert not storage.update_link("missing", "https://example.com/x")
+
+
+def check_redirect_status(storage):
+    storage.create_link(link("https://example.com/a", "alpha", "2030-01-01 00:00:00", 308))
+    storage.create_links([(0, link("https://example.com/b", "beta", redirect=301))])
+    assert storage.resolve("alpha") == ("https://example.com/a", "2030-01-01 00:00:00", 308)
+    assert storage.resolve("beta")[2] == 301
+    assert storage.update_link("beta", None, None, 307)
+    assert storage.resolve("beta")[2] == 307
+    assert storage.update_link("beta", "https://example.com/c")
+    assert storage.resolve("beta") == ("https://example.com/c", None, 307)
+    assert storage.get_link("alpha")["redirect_status"] == 308
+
+
+def check_delete(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    assert storage.delete_link("alpha")
+    assert not storage.delete_link("alpha")
+    assert storage.resolve("alpha") is None
+    assert storage.count_links() == 0
+
+
+def check_list_links(storage):
+    storage.create_links([(i, link(f"https://example.com/{i}", f"code{i:02d}")) for i in range(25)])
+    seen = []
+    cursor = None
+    while True:
+        links, cursor = storage.list_links(10, cursor)
+        seen.extend(item["shortcode"] for item in links)
+        if not cursor:
+            break
+    assert len(seen) == 25 and len(set(seen)) == 25
+    exported = list(storage.iter_links(chunk_size=7))
+    assert len(exported) == 25 and exported[0][0] == "code00"
+
+
+def check_clicks(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.create_link(link("https://example.com/b", "beta"))
+    hooked = []
+    storage.record_clicks([
+        click("alpha", "2026-01-31 23:59:59"),
+        click("alpha", "2026-02-01 00:00:01", ip="10.0.0.2"),
+        click("beta", "2026-02-01 10:00:00"),
+        click("alpha", "2026-02-02 12:00:00", referrer="https://news.example/"),
+    ], hooks=[lambda conn, batch: hooked.append(len(batch))])
+    assert hooked == [4]
+
+    assert storage.get_link("alpha")["clicks"] == 3
+    assert storage.get_link("beta")["clicks"] == 1
+
+    recent = storage.recent_clicks("alpha", limit=2)
+    assert [item["timestamp"] for item in recent] == ["2026-02-02 12:00:00", "2026-02-01 00:00:01"]
+    assert recent[0]["referrer"] == "https://news.example/"
+
+    everything = list(storage.iter_clicks())
+    assert len(everything) == 4
+    february = list(storage.iter_clicks("alpha", since="2026-02-01 00:00:00", until="2026-02-02 00:00:00"))
+    assert february == [("alpha", "2026-02-01 00:00:01", "10.0.0.2", "Mozilla/5.0 Firefox/120.0", None)]
+
+
+def check_delete_hides_clicks(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    old = (datetime.now(timezone.utc) - timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S')
+    storage.record_clicks([click("alpha", old)])
+    storage.delete_link("alpha")
+    storage.create_link(link("https://example.com/new", "alpha"))
+    assert storage.recent_clicks("alpha") == []
+    assert list(storage.iter_clicks("alpha")) == []
+
+
+def check_rename_moves_clicks(storage):
+    before = (datetime.now(timezone.utc) - timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S')
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.create_link(link("https://example.com/b", "beta"))
+    storage.record_clicks([click("alpha", before), click("alpha", before, ip="10.0.0.2"),
+                           click("beta", before, ip="10.0.0.3")], hooks=[storage.rollups.apply])
+    # beta's clicks must not end up on the link renamed into its code.
+    storage.delete_link("beta")
+
+    assert storage.update_link("alpha", None, "beta")
+    assert storage.get_link("beta")["clicks"] == 2
+    assert sorted(item["ip_address"] for item in storage.recent_clicks("beta")) == ["10.0.0.1", "10.0.0.2"]
+    assert [event[0] for event in storage.iter_clicks("beta")] == ["beta", "beta"]
+    since, until = before[:10] + " 00:00:00", "2100-01-01 00:00:00"
+    series, _ = storage.timeseries("beta", "day", since, until)
+    assert sum(point["clicks"] for point in series) == 2
+
+    storage.create_link(link("https://example.com/new", "alpha"))
+    assert storage.recent_clicks("alpha") == [] and list(storage.iter_clicks("alpha")) == []
+    assert storage.timeseries("alpha", "day", since, until)[0] == []
+
+    assert storage.update_link("beta", None, "gamma")
+    assert len(storage.recent_clicks("gamma")) == 2 and storage.recent_clicks("beta") == []
+
+
+def check_recent_clicks_across_batches(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.create_link(link("https://example.com/b", "beta"))
+    for minute in range(30):
+        storage.record_clicks([click("alpha", f"2026-03-01 10:{minute:02d}:00"),
+                               click("beta", f"2026-03-01 10:{minute:02d}:30", ip=f"10.0.1.{minute}")])
+    storage.record_clicks([click("alpha", "2026-04-01 09:00:00")])
+    assert storage.update_link("alpha", None, "gamma")
+    storage.record_clicks([click("gamma", "2026-04-01 10:00:00")])
+    recent = [item["timestamp"] for item in storage.recent_clicks("gamma", limit=5)]
+    assert recent == ["2026-04-01 10:00:00", "2026-04-01 09:00:00", "2026-03-01 10:29:00",
+                      "2026-03-01 10:28:00", "2026-03-01 10:27:00"]
+    assert len(storage.recent_clicks("beta")) == 30 and storage.recent_clicks("alpha") == []
+    if storage.name == "log":
+        # Segments written before spans were recorded are indexed once.
+        with storage.database.writer() as conn:
+            conn.execute(f"DROP TABLE {storage.table_spans}")
+        storage.create_tables()
+        assert [item["timestamp"] for item in storage.recent_clicks("gamma", limit=5)] == recent
+        assert len(storage.recent_clicks("beta")) == 30
+
+
+def check_change_events(storage):
+    events = []
+    storage.subscribe(lambda changes: events.append([(c.code, c.url, c.renamed_from) for c in changes]))
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.create_links([(0, link("https://example.com/b", "beta"))])
+    storage.update_link("alpha", "https://example.com/a2")
+    storage.update_link("alpha", None, "gamma")
+    try:
+        storage.update_link("gamma", None, "beta")
+    except ShortcodeTaken:
+        pass
+    storage.delete_link("beta")
+    storage.delete_link("missing")
+    assert events == [
+        [("alpha", "https://example.com/a", None)],
+        [("beta", "https://example.com/b", None)],
+        [("alpha", "https://example.com/a2", None)],
+        [("alpha", None, None), ("gamma", "https://example.com/a2", "alpha")],
+        [("beta", None, None)],
+    ], events
+
+
+def check_expire_links(storage):
+    past = (datetime.now() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    future = (datetime.now() + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    storage.create_link(link("https://example.com/a", "alpha", expires_at=past))
+    storage.create_link(link("https://example.com/b", "beta", expires_at=future))
+    storage.create_link(link("https://example.com/c", "gamma"))
+    storage.record_clicks([click("alpha", datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))])
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    assert storage.expiring(now, 10) == [(past, "alpha")]
+    assert storage.count_expiring(future) == 2
+    events = []
+    storage.subscribe(lambda changes: events.extend(c.code for c in changes))
+    # Only codes that are still expired at the cutoff are removed.
+    assert storage.expire_links(["alpha", "beta", "gamma", "missing"], now, archive=True) == ["alpha"]
+    assert events == ["alpha"]
+    assert storage.resolve("alpha") is None
+    assert storage.resolve("beta") is not None
+    assert storage.count_links() == 2
+    with storage.database.reader() as conn:
+        archived = conn.execute(f'SELECT shortcode, clicks FROM {storage.table_expired}').fetchall()
+    assert archived == [("alpha", 1)], archived
+    # A reused code does not inherit the expired link's clicks.
+    storage.create_link(link("https://example.com/new", "alpha"))
+    assert list(storage.iter_clicks("alpha")) == []
+
+
+def check_visitors(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    now = datetime.now(timezone.utc)
+    today = now.strftime('%Y-%m-%d')
+    yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    batch = [click("alpha", now.strftime('%Y-%m-%d %H:%M:%S'), ip=f"10.0.0.{i % 50}") for i in range(200)]
+    batch += [click("alpha", yesterday, ip=f"10.0.1.{i}") for i in range(20)]
+    batch += [click("alpha", yesterday, ip="10.0.2.1", agent="Googlebot/2.1 (+http://www.google.com/bot.html)"),
+              click("alpha", yesterday, ip="10.0.2.2", agent=None)]
+    storage.record_clicks(batch, hooks=[storage.rollups.apply])
+    storage.record_clicks([click("alpha", now.strftime('%Y-%m-%d %H:%M:%S'), ip="10.0.0.1")],
+                          hooks=[storage.rollups.apply])
+    # Estimates, so within a few percent.
+    visitors = storage.visitors("alpha", today)
+    assert abs(visitors.pop("unique_visitors") - 70) <= 2, visitors
+    assert abs(visitors.pop("unique_visitors_today") - 50) <= 2, visitors
+    assert visitors == {"human_clicks": 221, "bot_clicks": 2}, visitors
+    storage.update_link("alpha", None, "beta")
+    assert abs(storage.visitors("beta", today)["unique_visitors"] - 70) <= 2
+    assert storage.visitors("alpha", today)["unique_visitors"] == 0
+
+
+def check_timeseries(storage):
+    storage.create_link(link("https://example.com/a", "alpha"))
+    storage.record_clicks([
+        click("alpha", "2026-03-01 10:15:00"),
+        click("alpha", "2026-03-01 10:45:00", ip="10.0.0.9"),
+        click("alpha", "2026-03-02 08:00:00"),
+    ], hooks=[storage.rollups.apply])
+    series, breakdown = storage.timeseries("alpha", "day", "2026-03-01 00:00:00", "2026-03-03 00:00:00")
+    assert [(point["bucket"], point["clicks"]) for point in series] == [("2026-03-01", 2), ("2026-03-02", 1)]
+    assert series[0]["unique_ips"] == 2
+    assert isinstance(breakdown, dict)
+
+
+def check_index_follows_changes(storage):
+    if storage.link_index is None:
+        return
+    # A second reader on the same files stands in for another worker process.
+    other = LinkIndex(storage.link_index.directory)
+    storage.create_link(link("https://example.com/a", "alpha"))
+    assert other.get("alpha") == ("https://example.com/a", None, None)
+    storage.update_link("alpha", "https://example.com/b", "beta")
+    assert other.get("alpha") is None
+    assert other.get("beta") == ("https://example.com/b", None, None)
+    storage.create_links([(i, link(f"https://example.com/{i}", f"bulk{i}")) for i in range(150)])
+    assert other.get("bulk149") == ("https://example.com/149", None, None)
+    assert storage.link_index.needs_compaction()
+    storage.rebuild_index()
+    assert not storage.link_index.needs_compaction()
+    storage.delete_link("bulk0")
+    assert other.get("bulk0") is None and other.get("bulk1") == ("https://example.com/1", None, None)
+    assert other.stats()["generation"] == 2 and other.stats()["links"] == 151
+
+
+def check_index_catches_up(storage):
+    if storage.link_index is None:
+        return
+    index = storage.link_index
+    storage.create_link(link("https://example.com/a", "alpha"))
+    # Writes by a process running without the index never reach its delta.
+    storage.link_index = None
+    storage.create_link(link("https://example.com/b", "beta"))
+    storage.update_link("alpha", "https://example.com/a2")
+    storage.link_index = index
+    assert index.get("beta") is None
+    storage.create_tables()
+    assert storage.resolve("beta") == ("https://example.com/b", None, None)
+    assert storage.resolve("alpha") == ("https://example.com/a2", None, None)
+    rebuilds = index.rebuilds
+    storage.create_tables()
+    assert index.rebuilds == rebuilds
+
+
+CHECKS = [
+    check_create_and_resolve,
+    check_generator_exhaustion,
+    check_batch_create,
+    check_dedup,
+    check_search,
+    check_update,
+    check_redirect_status,
+    check_delete,
+    check_list_links,
+    check_clicks,
+    check_delete_hides_clicks,
+    check_rename_moves_clicks,
+    check_recent_clicks_across_batches,
+    check_change_events,
+    check_expire_links,
+    check_visitors,
+    check_timeseries,
+    check_index_follows_changes,
+    check_index_catches_up,
+]
+
+
+def run_conformance(backend, with_index):
+    failures = 0
+    for check in CHECKS:
+        storage, database = open_storage(backend, tempfile.mkdtemp(), with_index)
+        try:
+            check(storage)
+            status = "ok"
+        except Exception:
+            failures += 1
+            status = "FAIL\n" + traceback.format_exc()
+        finally:
+            database.close()
+        print(f"  {check.__name__:32} {status}")
+    return failures
+
+
+def timed(label, count, func, results):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    results.append((label, count, elapsed))
+
+
+def run_performance(backend, links, clicks, batch_size, with_index):
+    storage, database = open_storage(backend, tempfile.mkdtemp(), with_index)
+    results = []
+    codes = [f"p{i:07d}" for i in range(links)]
+
+    def create():
+        for start in range(0, links, 1000):
+            storage.create_links([(i, link(f"https://example.com/{i}", codes[i]))
+                                  for i in range(start, min(start + 1000, links))])
+
+    def resolve():
+        for code in codes:
+            storage.resolve(code)
+
+    base = datetime.now(timezone.utc) - timedelta(days=40)
+
+    def record():
+        for start in range(0, clicks, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, clicks)):
+                timestamp = (base + timedelta(seconds=i * 3)).strftime('%Y-%m-%d %H:%M:%S')
+                batch.append(click(codes[i % links], timestamp, ip=f"10.0.{i % 250}.{i % 7}"))
+            storage.record_clicks(batch)
+
+    def recent():
+        for code in codes[:200]:
+            storage.recent_clicks(code, limit=100)
+
+    def export():
+        for _ in storage.iter_clicks():
+            pass
+
+    timed("create links (batches of 1000)", links, create, results)
+    if with_index:
+        timed("rebuild link index", links, storage.rebuild_index, results)
+    timed("resolve", links, resolve, results)
+    timed(f"record clicks (batches of {batch_size})", clicks, record, results)
+    timed("recent clicks, 200 codes", 200, recent, results)
+    timed("export all clicks", clicks, export, results)
+    database.close()
+
+    for label, count, elapsed in results:
+        print(f"  {label:36} {count:>9} {elapsed:>9.3f}s {count / elapsed:>12.0f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conformance and performance checks for every storage backend.")
+    parser.add_argument("--backend", action="append", choices=sorted(STORAGE_BACKENDS))
+    parser.add_argument("--links", type=int, default=10000)
+    parser.add_argument("--clicks", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--link-index", action="store_true", help="attach a LinkIndex to each backend")
+    parser.add_argument("--skip-performance", action="store_true")
+    args = parser.parse_args()
+
+    failures = 0
+    for backend in args.backend or sorted(STORAGE_BACKENDS):
+        print(f"{backend}: conformance")
+        failures += run_conformance(backend, args.link_index)
+        if not args.skip_performance:
+            print(f"{backend}: performance")
+            run_performance(backend, args.links, args.clicks, args.batch_size, args.link_index)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from cache import LinkCache, MISSING
+from codes import create_code_generator
+from db import Database
+from linkindex import LinkIndex
+from rollups import Rollups
+from storage import STORAGE_BACKENDS, ShortcodeTaken, create_storage
+
+# Concurrency stress test for link updates, renames and deletes. Worker
+# threads race creates, renames, URL updates, deletes, clicks and
+# read-through cache lookups over a small pool of codes. Once they stop,
+# the cache, the link index and the click aggregates are checked against the
+# database:
+#
+#     python bench/stress_links.py
+#     python bench/stress_links.py --backend log --threads 16 --seconds 20 --link-index
+
+
+def open_storage(backend, workdir, with_index):
+    database = Database(os.path.join(workdir, "shortener.db"), pool_size=8)
+    generator = create_code_generator("random", "counters")
+    options = {"log_dir": os.path.join(workdir, "click_log")} if backend == "log" else {}
+    if with_index:
+        options["link_index"] = LinkIndex(os.path.join(workdir, "link_index"), max_delta=500)
+    storage = create_storage(backend, database, "urls", "analytics", "counters",
+                             generator, Rollups("analytics"), **options)
+    storage.create_tables()
+    return storage, database
+
+
+class Stress:
+    def __init__(self, storage, codes, seed):
+        self.storage = storage
+        self.pool = [f"s{i}" for i in range(codes)]
+        self.seed = seed
+        self.cache = LinkCache(max_size=codes * 2, negative_ttl=3600)
+        # Wired like the server: every committed change drops the cached codes.
+        storage.subscribe(lambda changes: self.cache.invalidate(*(change.code for change in changes)))
+        self.ops = Counter()
+        self.errors = []
+        self._stopping = threading.Event()
+
+    def lookup(self, code):
+        token = self.cache.token()
+        cached = self.cache.get(code)
+        if cached is not MISSING:
+            return cached
+        row = self.storage.resolve(code)
+        if row:
+            self.cache.put(code, *row, token=token)
+        else:
+            self.cache.put_missing(code, token=token)
+        return row
+
+    def worker(self, number):
+        rng = random.Random(self.seed + number)
+        operations = [
+            (self.op_read, 50),
+            (self.op_click, 20),
+            (self.op_rename, 10),
+            (self.op_update, 10),
+            (self.op_create, 5),
+            (self.op_delete, 5),
+        ]
+        choices = [op for op, _ in operations]
+        weights = [weight for _, weight in operations]
+        sequence = 0
+        while not self._stopping.is_set():
+            sequence += 1
+            op = rng.choices(choices, weights)[0]
+            try:
+                outcome = op(rng, f"{number}-{sequence}")
+            except Exception:
+                self.errors.append(traceback.format_exc())
+                outcome = "error"
+            self.ops[(op.__name__[3:], outcome)] += 1
+
+    def op_read(self, rng, tag):
+        return "hit" if self.lookup(rng.choice(self.pool)) else "miss"
+
+    def op_click(self, rng, tag):
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        batch = [(rng.choice(self.pool), f"10.0.{rng.randrange(256)}.{rng.randrange(256)}", "stress", None, timestamp)
+                 for _ in range(rng.randint(1, 5))]
+        self.storage.record_clicks(batch, hooks=[self.storage.rollups.apply])
+        return "ok"
+
+    def op_rename(self, rng, tag):
+        try:
+            renamed = self.storage.update_link(rng.choice(self.pool), None, rng.choice(self.pool))
+        except ShortcodeTaken:
+            return "taken"
+        return "ok" if renamed else "missing"
+
+    def op_update(self, rng, tag):
+        updated = self.storage.update_link(rng.choice(self.pool), f"https://example.com/{tag}")
+        return "ok" if updated else "missing"
+
+    def op_create(self, rng, tag):
+        try:
+            self.storage.create_link({"url": f"https://example.com/{tag}", "code": rng.choice(self.pool),
+                                      "expires_at": None, "redirect": None})
+        except ShortcodeTaken:
+            return "taken"
+        return "ok"
+
+    def op_delete(self, rng, tag):
+        return "ok" if self.storage.delete_link(rng.choice(self.pool)) else "missing"
+
+    def run(self, threads, seconds):
+        workers = [threading.Thread(target=self.worker, args=(number,)) for number in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        time.sleep(seconds)
+        self._stopping.set()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - started
+
+    def verify(self):
+        storage = self.storage
+        failures = []
+        rows = {}
+        with storage.database.reader() as conn:
+            for code, url, expires_at, redirect_status, clicks in conn.execute(
+                    'SELECT shortcode, original_url, expires_at, redirect_status, clicks FROM urls'):
+                rows[code] = ((url, expires_at, redirect_status), clicks)
+            day_clicks = dict(conn.execute('''
+                SELECT shortcode, SUM(clicks) FROM analytics_rollup
+                WHERE granularity = 'day' GROUP BY shortcode
+            '''))
+            raw_clicks = dict(conn.execute('SELECT shortcode, COUNT(*) FROM analytics GROUP BY shortcode'))
+        if storage.name != "sqlite":
+            raw_clicks = Counter(event[0] for event in storage.iter_clicks())
+
+        if storage.count_links() != len(rows):
+            failures.append(f"link counter says {storage.count_links()}, table has {len(rows)}")
+
+        other = LinkIndex(storage.link_index.directory) if storage.link_index is not None else None
+        for code in self.pool:
+            expected = rows[code][0] if code in rows else None
+            cached = self.cache.get(code)
+            if cached is not MISSING and cached != expected:
+                failures.append(f"cache holds {cached} for {code}, database has {expected}")
+            if other is not None and other.get(code) != expected:
+                failures.append(f"index holds {other.get(code)} for {code}, database has {expected}")
+
+        for code, (_, clicks) in rows.items():
+            if day_clicks.get(code, 0) != clicks:
+                failures.append(f"{code}: {clicks} clicks but {day_clicks.get(code, 0)} in the daily rollup")
+            if raw_clicks.get(code, 0) != clicks:
+                failures.append(f"{code}: {clicks} clicks but {raw_clicks.get(code, 0)} click events")
+        return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent update/rename/delete stress test.")
+    parser.add_argument("--backend", choices=sorted(STORAGE_BACKENDS), default="sqlite")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--codes", type=int, default=40, help="size of the shortcode pool; smaller means more conflicts")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--link-index", action="store_true", help="attach a LinkIndex and check it too")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    storage, database = open_storage(args.backend, workdir, args.link_index)
+    stress = Stress(storage, args.codes, args.seed)
+    for code in stress.pool[::2]:
+        storage.create_link({"url": f"https://example.com/{code}", "code": code, "expires_at": None, "redirect": None})
+
+    elapsed = stress.run(args.threads, args.seconds)
+    total = sum(stress.ops.values())
+    print(f"{args.backend}: {total} operations in {elapsed:.1f}s ({total / elapsed:,.0f}/s) on {args.threads} threads")
+    for (op, outcome), count in sorted(stress.ops.items()):
+        print(f"  {op:8} {outcome:8} {count:>8}")
+    print(f"  stale cache fills refused: {stress.cache.stats()['stale_fills']}")
+
+    failures = stress.verify()
+    for error in stress.errors[:5]:
+        print(error)
+    for failure in failures[:20]:
+        print(f"  FAIL {failure}")
+    database.close()
+    if stress.errors or failures:
+        print(f"{len(stress.errors)} errors, {len(failures)} inconsistencies")
+        sys.exit(1)
+    print("consistent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from limits import parse_many
+from werkzeug.urls import iri_to_uri
+
+import server
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+_CODE_PATH = re.compile(r"^/([A-Za-z0-9_-]+)$")
+
+_ERRORS = {
+    404: json.dumps({"error": "Not found"}).encode("utf-8"),
+    410: json.dumps({"error": "This link has expired"}).encode("utf-8"),
+    429: json.dumps({"error": "Rate limit exceeded"}).encode("utf-8")
+}
+
+
+class RedirectApp:
+    # Serves GET/HEAD /<code> directly on the event loop. Misses are resolved
+    # on a small thread pool sized like the read pool, which also runs the
+    # per-IP rate limit check while the limiter is enabled; cache hits
+    # otherwise never leave the loop. Clicks go to the shared click queue
+    # without waiting.
+    # Everything else is handed to the fallback app (the Flask API wrapped by
+    # asgiref when it is installed).
+    def __init__(self, fallback=None, workers=None):
+        self.fallback = fallback
+        # Flask routes without arguments, like /metrics, look like codes but
+        # are the fallback's.
+        self.reserved = frozenset(rule.rule for rule in server.app.url_map.iter_rules() if not rule.arguments)
+        self.rate_limits = [item for spec in server.DEFAULT_RATE_LIMITS for item in parse_many(spec)]
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or server.DB_POOL_SIZE,
+            thread_name_prefix="redirect-lookup"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        path = scope.get("path", "")
+        match = _CODE_PATH.match(path)
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD") and match and path not in self.reserved:
+            await self._redirect(scope, send, match.group(1))
+            return
+
+        if self.fallback is not None:
+            await self.fallback(scope, receive, send)
+            return
+
+        await self._respond(send, 404, body=_ERRORS[404])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.get_running_loop().run_in_executor(self.executor, server.ensure_tables)
+                server.tables_ready = True
+                server.start_background_tasks()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Flushes the click queue and joins the retention, expiry and
+                # index threads.
+                await asyncio.get_running_loop().run_in_executor(self.executor, server.stop_background_tasks)
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _redirect(self, scope, send, code):
+        started = time.perf_counter()
+        status, trace = await self._send_redirect(scope, send, code)
+        elapsed = time.perf_counter() - started
+        if server.METRICS_ENABLED:
+            # Same route label as the Flask view, so both paths add up.
+            server.observe_request(scope["method"], "/<code>", status, elapsed)
+        if server.slow_requests:
+            server.slow_requests.finish(trace or [], scope["method"], scope["path"], status, elapsed)
+
+    async def _send_redirect(self, scope, send, code):
+        trace = None
+        client = scope.get("client")
+        address = client[0] if client else "127.0.0.1"
+        if server.limiter.enabled:
+            # The limit storage may wait on a lock, so the check runs off the
+            # loop.
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(self.executor, self._within_limits, address):
+                server.rate_limited.inc("/<code>")
+                await self._respond(send, 429, body=_ERRORS[429])
+                return 429, trace
+
+        result = server.resolve_redirect(code, cached_only=True)
+        if result is None:
+            loop = asyncio.get_running_loop()
+            result, trace = await loop.run_in_executor(self.executor, self._resolve, code)
+
+        status, url, cache_control = result
+        if status not in server.REDIRECT_STATUSES:
+            await self._respond(send, status, body=_ERRORS[status])
+            return status, trace
+
+        headers = dict(scope.get("headers") or [])
+        server.click_queue.record(
+            code,
+            client[0] if client else None,
+            headers.get(b"user-agent", b"").decode("latin-1"),
+            headers[b"referer"].decode("latin-1") if b"referer" in headers else None,
+            block=False
+        )
+        await self._respond(send, status, location=iri_to_uri(url), cache_control=cache_control)
+        return status, trace
+
+    def _within_limits(self, address):
+        # The Flask /<code> route's default per-IP limits, hit under the same
+        # keys flask-limiter uses for it, so both paths count together.
+        strategy = server.limiter.limiter
+        return all(strategy.hit(item, address, "redirect_short_url") for item in self.rate_limits)
+
+    def _resolve(self, code):
+        # Runs on an executor thread, so the lookup's SQL is collected there.
+        if not server.slow_requests:
+            return server.resolve_redirect(code), None
+        trace = server.slow_requests.begin()
+        try:
+            return server.resolve_redirect(code), trace
+        finally:
+            server.slow_requests.detach()
+
+    async def _respond(self, send, status, body=b"", location=None, cache_control=None):
+        headers = [(b"content-length", str(len(body)).encode("ascii"))]
+        if body:
+            headers.append((b"content-type", b"application/json"))
+        if location:
+            headers.append((b"location", location.encode("latin-1")))
+        if cache_control:
+            headers.append((b"cache-control", cache_control.encode("ascii")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+app = RedirectApp(fallback=WsgiToAsgi(server.app) if WsgiToAsgi else None)
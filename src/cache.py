@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+MISSING = object()
+
+
+class LinkCache:
+    def __init__(self, max_size=10000, negative_ttl=30):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_fills = 0
+        self._generation = 0
+
+    def get(self, code):
+        # Returns (url, expires_at, redirect_status), None for a cached 404,
+        # or MISSING.
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            value, stale_at = entry
+            if stale_at is not None and stale_at <= time.monotonic():
+                del self._entries[code]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            if value is not None and value[1]:
+                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                if value[1] < now:
+                    del self._entries[code]
+                    self.expirations += 1
+                    self.misses += 1
+                    return MISSING
+
+            self._entries.move_to_end(code)
+            self.hits += 1
+            return value
+
+    def token(self):
+        # Taken before reading the database. A put() with the token is
+        # dropped if anything was invalidated in between, so a read that
+        # raced an update cannot cache the old row.
+        return self._generation
+
+    def put(self, code, url, expires_at, redirect_status=None, token=None):
+        return self._store(code, (url, expires_at, redirect_status), None, token)
+
+    def put_missing(self, code, token=None):
+        return self._store(code, None, time.monotonic() + self.negative_ttl, token)
+
+    def _store(self, code, value, stale_at, token):
+        if self.max_size <= 0:
+            return True
+        with self._lock:
+            if token is not None and token != self._generation:
+                self.stale_fills += 1
+                return False
+            self._entries[code] = (value, stale_at)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, *codes):
+        with self._lock:
+            self._generation += 1
+            for code in codes:
+                self._entries.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale_fills": self.stale_fills,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
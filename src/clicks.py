@@ -0,0 +1,123 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ClickQueue:
+    def __init__(self, storage, batch_size=500, flush_interval=0.5, max_size=100000, hooks=None, listeners=None):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Callables run as hook(conn, batch) inside the transaction that
+        # updates the click counts.
+        self.hooks = list(hooks or [])
+        # Callables run as listener(batch) after that transaction commits.
+        self.listeners = list(listeners or [])
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        atexit.register(self.stop)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="click-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, shortcode, ip_address, user_agent, referrer, block=True):
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self._queue.put((shortcode, ip_address, user_agent, referrer, timestamp), block=block, timeout=1)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout=10):
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    continue
+                batch.append(item)
+
+            if batch:
+                self._flush(batch)
+
+        # Drain anything that raced in behind the stop marker.
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            self._flush(leftover[start:start + self.batch_size])
+
+    def _flush(self, batch):
+        try:
+            self.storage.record_clicks(batch, self.hooks)
+        except (sqlite3.Error, OSError):
+            self.failed += len(batch)
+            logger.exception("Failed to flush %d click events", len(batch))
+            return
+        self.flushed += len(batch)
+        self.batches += 1
+        for listener in self.listeners:
+            try:
+                listener(batch)
+            except Exception:
+                logger.exception("Click listener failed")
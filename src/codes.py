@@ -0,0 +1,110 @@
+import secrets
+import string
+
+BASE62 = string.digits + string.ascii_letters
+
+
+def base62_encode(number, length=0):
+    chars = []
+    while number:
+        number, rem = divmod(number, 62)
+        chars.append(BASE62[rem])
+    code = ''.join(reversed(chars)) or BASE62[0]
+    return code.rjust(length, BASE62[0])
+
+
+class RandomCodeGenerator:
+    # Uniform random codes. The length grows by one whenever the share of the
+    # current keyspace already in use passes grow_at, which keeps the chance
+    # that a fresh code collides at or below grow_at.
+    name = "random"
+
+    def __init__(self, table_counters, length=6, grow_at=0.01, max_length=12):
+        self.table_counters = table_counters
+        self.min_length = length
+        self.grow_at = grow_at
+        self.max_length = max_length
+        self.generated = 0
+        self.collisions = 0
+
+    def length_for(self, occupied):
+        length = self.min_length
+        while length < self.max_length and occupied >= self.grow_at * 62 ** length:
+            length += 1
+        return length
+
+    def generate(self, conn):
+        row = conn.execute(f'''
+            SELECT value FROM {self.table_counters}
+            WHERE name = 'links'
+        ''').fetchone()
+        length = self.length_for(row[0] if row else 0)
+        self.generated += 1
+        return base62_encode(secrets.randbelow(62 ** length), length)
+
+    def stats(self):
+        return {
+            "strategy": self.name,
+            "generated": self.generated,
+            "collisions": self.collisions
+        }
+
+
+class CounterCodeGenerator:
+    # Codes derived from a monotonically increasing sequence kept in the
+    # counters table. With obfuscate on, each id is pushed through an affine
+    # bijection on [0, 62**length), so consecutive links get unrelated looking
+    # codes while staying collision free among themselves.
+    name = "counter"
+
+    def __init__(self, table_counters, length=6, obfuscate=True, multiplier=None, offset=None):
+        self.table_counters = table_counters
+        self.min_length = length
+        self.obfuscate = obfuscate
+        # 62 = 2 * 31, so any multiplier coprime to both makes the map a bijection.
+        self.multiplier = multiplier or 0x5DEECE66D
+        self.offset = offset if offset is not None else 0x2545F491
+        if self.multiplier % 2 == 0 or self.multiplier % 31 == 0:
+            raise ValueError("multiplier must be coprime with 62")
+        self.generated = 0
+        self.collisions = 0
+
+    def encode(self, sequence):
+        length = self.min_length
+        while sequence >= 62 ** length:
+            length += 1
+        if not self.obfuscate:
+            return base62_encode(sequence, length)
+        space = 62 ** length
+        return base62_encode((sequence * self.multiplier + self.offset) % space, length)
+
+    def generate(self, conn):
+        row = conn.execute(f'''
+            UPDATE {self.table_counters}
+            SET value = value + 1
+            WHERE name = 'code_sequence'
+            RETURNING value
+        ''').fetchone()
+        self.generated += 1
+        return self.encode(row[0])
+
+    def stats(self):
+        return {
+            "strategy": self.name,
+            "generated": self.generated,
+            "collisions": self.collisions
+        }
+
+
+CODE_GENERATORS = {
+    RandomCodeGenerator.name: RandomCodeGenerator,
+    CounterCodeGenerator.name: CounterCodeGenerator
+}
+
+
+def create_code_generator(strategy, table_counters, **options):
+    try:
+        generator = CODE_GENERATORS[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown code strategy: {strategy}")
+    return generator(table_counters, **options)
@@ -0,0 +1,145 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_PRAGMAS = {
+    # auto_vacuum only takes effect if set before the first table exists,
+    # and must precede journal_mode for that.
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": "-16000",
+    "mmap_size": "268435456",
+    "busy_timeout": "5000",
+    "temp_store": "MEMORY"
+}
+
+# Pragmas that are properties of the database file rather than the connection,
+# so they are only applied on connections that are allowed to write.
+_WRITE_ONLY_PRAGMAS = {"auto_vacuum", "journal_mode"}
+
+
+def parse_pragmas(spec):
+    pragmas = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+class Database:
+    def __init__(self, db_file, pragmas=None, pool_size=8, factory=sqlite3.Connection):
+        self.db_file = db_file
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.pool_size = pool_size
+        # sqlite3.Connection subclass for pooled connections, e.g. one that
+        # records timings.
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {"read": queue.LifoQueue(), "write": queue.LifoQueue()}
+        self._counters = {
+            kind: {"opened": 0, "closed": 0, "checkouts": 0, "in_use": 0}
+            for kind in ("read", "write")
+        }
+
+    def _connect(self, kind):
+        if kind == "read":
+            path = os.path.abspath(self.db_file)
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, factory=self.factory)
+        else:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False, factory=self.factory)
+        for name, value in self.pragmas.items():
+            if kind == "read" and name in _WRITE_ONLY_PRAGMAS:
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _checkout(self, kind):
+        with self._lock:
+            # Connections must never cross a fork; workers start with a fresh pool.
+            if self._pid != os.getpid():
+                self._reset()
+            counters = self._counters[kind]
+            counters["checkouts"] += 1
+            counters["in_use"] += 1
+        try:
+            return self._idle[kind].get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = self._connect(kind)
+        except Exception:
+            with self._lock:
+                counters["in_use"] -= 1
+            raise
+        with self._lock:
+            counters["opened"] += 1
+        return conn
+
+    def _release(self, kind, conn, broken=False):
+        with self._lock:
+            counters = self._counters[kind]
+            counters["in_use"] -= 1
+            keep = not broken and self._idle[kind].qsize() < self.pool_size
+            if not keep:
+                counters["closed"] += 1
+        if keep:
+            self._idle[kind].put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def reader(self):
+        conn = self._checkout("read")
+        broken = False
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            self._release("read", conn, broken)
+
+    @contextmanager
+    def writer(self):
+        conn = self._checkout("write")
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            raise
+        finally:
+            self._release("write", conn, broken)
+
+    def close(self):
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+    def stats(self):
+        with self._lock:
+            stats = {kind: dict(counters) for kind, counters in self._counters.items()}
+        for kind, idle in self._idle.items():
+            stats[kind]["idle"] = idle.qsize()
+        stats["pool_size"] = self.pool_size
+        stats["pragmas"] = dict(self.pragmas)
+        return stats
@@ -0,0 +1,57 @@
+import hashlib
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+# Query parameters that only say where a click came from. Links that differ
+# only in these go to the same page.
+TRACKING_PARAMS = frozenset((
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid", "twclid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "ref_src",
+))
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _is_tracking(name):
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def normalize_url(url):
+    # The form links are compared in: scheme and host lowercased, default
+    # port dropped, trailing slashes removed from the path and tracking
+    # parameters removed from the query. Everything else is case sensitive
+    # and kept in order, fragment included.
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = f"[{host}]" if ":" in host else host
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.netloc.rpartition("@")[0]
+        netloc = f"{userinfo}@{netloc}"
+
+    path = parts.path.rstrip("/")
+    # Parameters are filtered as written rather than decoded and re-encoded,
+    # so the rest of the query keeps its exact encoding.
+    query = "&".join(
+        pair for pair in parts.query.split("&")
+        if pair and not _is_tracking(unquote_plus(pair.partition("=")[0]).lower())
+    )
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def url_key(url):
+    # (normalized URL, signed 64-bit hash of it); the hash fits an SQLite
+    # INTEGER and is what urls.url_hash indexes.
+    normalized = normalize_url(url)
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+    return normalized, int.from_bytes(digest, "big", signed=True)
+
+
+def url_hash(url):
+    return url_key(url)[1]
@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+
+
+class ClickFeed:
+    # Server-sent event streams of click counts for the dashboard. Each stream
+    # watches the codes it was opened with and sends the counts that changed.
+    # Batches flushed by this process wake the streams straight away; clicks
+    # recorded by other workers or nodes are picked up by re-reading the
+    # counts every poll_interval.
+    def __init__(self, storage, poll_interval=5, min_interval=1, max_age=300, max_codes=500):
+        self.storage = storage
+        self.poll_interval = poll_interval
+        self.min_interval = min_interval
+        self.max_age = max_age
+        self.max_codes = max_codes
+        self._changed = threading.Condition()
+        self._version = 0
+        self.streams = 0
+        self.events = 0
+
+    def notify(self, batch):
+        # ClickQueue listener, called once the batch is committed.
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def stream(self, codes):
+        codes = list(dict.fromkeys(codes))[:self.max_codes]
+        self.streams += 1
+        try:
+            # Browsers reconnect by themselves once max_age closes the stream,
+            # which keeps a stuck client from holding a thread forever.
+            yield "retry: 1000\n\n"
+            sent = {}
+            version = self._version
+            deadline = time.monotonic() + self.max_age
+            while time.monotonic() < deadline:
+                polled_at = time.monotonic()
+                counts = self.storage.click_counts(codes)
+                changed = {code: counts.get(code) for code in codes if sent.get(code, -1) != counts.get(code)}
+                if changed:
+                    sent.update(changed)
+                    self.events += 1
+                    yield f"event: clicks\ndata: {json.dumps(changed, separators=(',', ':'))}\n\n"
+                else:
+                    # Keeps proxies from timing the connection out and
+                    # surfaces a closed client as a write error.
+                    yield ": idle\n\n"
+
+                with self._changed:
+                    self._changed.wait_for(lambda: self._version != version, timeout=self.poll_interval)
+                    version = self._version
+                # Coalesces a run of flushes into one query per min_interval.
+                time.sleep(max(0, polled_at + self.min_interval - time.monotonic()))
+        finally:
+            self.streams -= 1
+
+    def stats(self):
+        return {
+            "streams": self.streams,
+            "events": self.events,
+            "poll_interval": self.poll_interval,
+            "max_age": self.max_age
+        }
@@ -0,0 +1,151 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_MODES = ("archive", "purge")
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class ExpirySweeper:
+    # Removes links once they have been expired for `grace` seconds, so the
+    # urls table and the dashboard stop carrying dead links. Until then the
+    # redirect keeps answering 410. Upcoming expirations wait in a min-heap of
+    # (expires_at, shortcode) and the thread sleeps until the earliest is due
+    # instead of scanning. The heap only holds links expiring before a
+    # horizon; it is refilled from idx_expires every interval, which also
+    # picks up links created by other workers. Links created here are pushed
+    # straight in through the storage subscription. Entries for links renamed
+    # or deleted since are harmless: the sweep re-checks expires_at.
+    # expires_at is local time, like the checks in the redirect path.
+    def __init__(self, storage, mode="archive", grace=0, interval=60, batch_size=500, max_scheduled=100000):
+        if mode not in EXPIRY_MODES:
+            raise ValueError(f"Unknown expiry mode: {mode}")
+        self.storage = storage
+        self.mode = mode
+        self.grace = grace
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_scheduled = max_scheduled
+        self._heap = []
+        self._horizon = ""
+        self._truncated = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.loads = 0
+        self.expired = 0
+        self.last_run = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="link-expiry", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def schedule(self, changes):
+        # Storage subscriber. Wakes the thread if a change is due before
+        # whatever it is sleeping until.
+        with self._lock:
+            earliest = self._heap[0][0] if self._heap else None
+            for change in changes:
+                if change.url is not None and change.expires_at and change.expires_at <= self._horizon:
+                    heapq.heappush(self._heap, (change.expires_at, change.code))
+            if self._heap and self._heap[0][0] != earliest:
+                self._wake.set()
+
+    def _cutoff(self, now):
+        return (now - timedelta(seconds=self.grace)).strftime(TIMESTAMP_FORMAT)
+
+    def reload(self, now=None):
+        now = now or datetime.now()
+        horizon = self._cutoff(now + timedelta(seconds=self.interval))
+        loaded = self.storage.expiring(horizon, self.max_scheduled)
+        truncated = len(loaded) == self.max_scheduled
+        if truncated:
+            # Later links come with the next reload, which runs as soon as
+            # these are swept.
+            horizon = loaded[-1][0]
+        with self._lock:
+            # Merged rather than replaced, so pushes made while the query ran
+            # are kept; a sorted list is a valid heap.
+            self._heap = sorted(set(self._heap).union(loaded))
+            self._horizon = horizon
+            self._truncated = truncated
+        self.loads += 1
+
+    def sweep(self, now=None):
+        now = now or datetime.now()
+        cutoff = self._cutoff(now)
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= cutoff:
+                due.append(heapq.heappop(self._heap)[1])
+        due = list(dict.fromkeys(due))
+
+        # One small transaction per batch, like retention; anything left by a
+        # failed batch is overdue and comes back with the next reload.
+        for start in range(0, len(due), self.batch_size):
+            if self._stopping.is_set():
+                break
+            removed = self.storage.expire_links(due[start:start + self.batch_size], cutoff,
+                                                archive=self.mode == "archive")
+            self.expired += len(removed)
+        self.last_run = now.strftime(TIMESTAMP_FORMAT)
+
+    def run_once(self, now=None):
+        self.reload(now)
+        self.sweep(now)
+
+    def _sleep_time(self, next_reload):
+        timeout = next_reload - time.monotonic()
+        with self._lock:
+            if self._heap:
+                due_at = datetime.strptime(self._heap[0][0], TIMESTAMP_FORMAT) + timedelta(seconds=self.grace)
+                timeout = min(timeout, (due_at - datetime.now()).total_seconds())
+            elif self._truncated:
+                timeout = 0
+        return max(0, timeout)
+
+    def _run(self):
+        next_reload = 0
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() >= next_reload or (self._truncated and not self._heap):
+                    self.reload()
+                    next_reload = time.monotonic() + self.interval
+                self.sweep()
+                timeout = self._sleep_time(next_reload)
+            except Exception:
+                logger.exception("Link expiry sweep failed")
+                timeout = self.interval
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def stats(self):
+        with self._lock:
+            scheduled = len(self._heap)
+            next_due = self._heap[0][0] if self._heap else None
+        return {
+            "mode": self.mode,
+            "grace": self.grace,
+            "scheduled": scheduled,
+            "next_expiry": next_due,
+            "overdue": self.storage.count_expiring(self._cutoff(datetime.now())),
+            "expired": self.expired,
+            "loads": self.loads,
+            "last_run": self.last_run
+        }
@@ -0,0 +1,62 @@
+import csv
+import json
+from io import StringIO
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+def iter_rows(database, table, columns, where=None, params=(), chunk_size=1000):
+    # Walks the table in id order, one short read per chunk, so a slow client
+    # never pins a connection or a snapshot for the whole export.
+    clauses = ["id > ?"]
+    if where:
+        clauses.extend(where)
+    select = ", ".join(["id"] + list(columns))
+    sql = f'''
+        SELECT {select}
+        FROM {table}
+        WHERE {" AND ".join(clauses)}
+        ORDER BY id
+        LIMIT ?
+    '''
+    last_id = 0
+    while True:
+        with database.reader() as conn:
+            rows = conn.execute(sql, (last_id, *params, chunk_size)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def format_rows(rows, columns, fmt, chunk_size=1000):
+    if fmt == "csv":
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        pending = 0
+        for row in rows:
+            writer.writerow(row)
+            pending += 1
+            if pending >= chunk_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        yield buffer.getvalue()
+        return
+
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
@@ -0,0 +1,85 @@
+import hashlib
+import math
+import struct
+
+PRECISION = 12
+
+_SPARSE = 0
+_DENSE = 1
+_ENTRY = struct.Struct(">HB")
+_POWERS = [2.0 ** -rank for rank in range(66)]
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    # Cardinality sketch with 2**precision one-byte registers (4 KB at the
+    # default precision, about 1.6% standard error). The top bits of a
+    # 64-bit hash pick the register, which keeps the longest run of leading
+    # zeros seen in the rest. Most links see few visitors a day, so a sketch
+    # starts sparse, as {index: rank}, in memory and on disk, and only turns
+    # into the register array once that is smaller.
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.sparse = {}
+        self.registers = None
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        sketch = cls(data[1])
+        if data[0] == _DENSE:
+            sketch.sparse = None
+            sketch.registers = bytearray(data[2:])
+        else:
+            sketch.sparse = dict(_ENTRY.iter_unpack(data[2:]))
+        return sketch
+
+    def to_bytes(self):
+        if self.sparse is not None:
+            return bytes((_SPARSE, self.precision)) + b"".join(
+                _ENTRY.pack(index, rank) for index, rank in sorted(self.sparse.items())
+            )
+        return bytes((_DENSE, self.precision)) + bytes(self.registers)
+
+    def _densify(self):
+        self.registers = bytearray(self.size)
+        for index, rank in self.sparse.items():
+            self.registers[index] = rank
+        self.sparse = None
+
+    def add(self, value):
+        # True if the sketch changed.
+        hashed = _hash(value)
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if self.sparse is not None:
+            if rank <= self.sparse.get(index, 0):
+                return False
+            self.sparse[index] = rank
+            if len(self.sparse) * _ENTRY.size >= self.size:
+                self._densify()
+            return True
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def estimate(self):
+        m = self.size
+        if self.sparse is not None:
+            # At most a third of the registers are set, where the raw estimate
+            # is always in the linear counting range.
+            return round(m * math.log(m / (m - len(self.sparse))))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(map(_POWERS.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty.
+            return round(m * math.log(m / zeros))
+        return round(raw)
@@ -0,0 +1,350 @@
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE = object()
+
+_MAGIC = b"SLIX"
+_VERSION = 3
+_HEADER = struct.Struct("<4sIQQQ")   # magic, version, generation, count, slots
+_SLOT = struct.Struct("<QQ")         # hash, record offset (0 = empty)
+_RECORD = struct.Struct("<HHIH")     # code length, expires_at length, url length, redirect status
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class LinkIndex:
+    # Read-optimized shortcode -> (original_url, expires_at, redirect_status)
+    # map for the redirect path. The base file is an open-addressing hash
+    # table followed by the records, written once and mmap'd read-only by
+    # every worker, so the pages are shared through the page cache. Changes
+    # since the base was built are appended to a small JSON-lines delta file
+    # that readers replay into a per-process overlay; a rebuild folds them
+    # into a new base.
+    #
+    # Writers hold lock() around their database transaction and apply(), so
+    # delta order matches commit order across processes. Each rebuild and
+    # apply() also records the database's link write counter, so writes made
+    # without the index can be detected and the index rebuilt.
+    def __init__(self, directory, max_delta=10000):
+        self.directory = directory
+        self.max_delta = max_delta
+        self.base_path = os.path.join(directory, "links.idx")
+        self.delta_path = os.path.join(directory, "links.idx.log")
+        self.lock_path = os.path.join(directory, "links.idx.lock")
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._pid = None
+        self._mm = None
+        self._delta_fd = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._subscribers = []
+        # (inode, mtime) of a base file that failed to load.
+        self._rejected = None
+        self._reset()
+        self.lookups = 0
+        self.overlay_hits = 0
+        self.fallbacks = 0
+        self.rebuilds = 0
+
+    def _reset(self):
+        self._generation = None
+        self._slots = 0
+        self._count = 0
+        self._overlay = {}
+        self._delta_pos = 0
+        self._delta_tail = b""
+        self._delta_entries = 0
+        self._sealed = False
+        self._writes = None
+
+    def valid(self):
+        # False if the files are missing or were written by another version.
+        if not os.path.exists(self.delta_path):
+            return False
+        try:
+            with open(self.base_path, "rb") as f:
+                magic, version = _HEADER.unpack(f.read(_HEADER.size))[:2]
+        except (FileNotFoundError, struct.error):
+            return False
+        return magic == _MAGIC and version == _VERSION
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def rebuild(self, rows, writes=None):
+        # rows: iterable of (shortcode, original_url, expires_at,
+        # redirect_status), as of the database write counter writes. The
+        # caller holds lock() and reads the rows inside it.
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self._current_generation() + 1
+        records = bytearray()
+        entries = []
+        for code, url, expires_at, redirect_status in rows:
+            key = code.encode("utf-8")
+            expires = (expires_at or "").encode("utf-8")
+            target = url.encode("utf-8")
+            entries.append((_hash(key), len(records)))
+            records += _RECORD.pack(len(key), len(expires), len(target), redirect_status or 0) + key + expires + target
+
+        slots = 16
+        while slots < len(entries) * 2:
+            slots *= 2
+        data_start = _HEADER.size + slots * _SLOT.size
+        table = bytearray(slots * _SLOT.size)
+        mask = slots - 1
+        for key_hash, offset in entries:
+            index = key_hash & mask
+            while _SLOT.unpack_from(table, index * _SLOT.size)[1]:
+                index = (index + 1) & mask
+            _SLOT.pack_into(table, index * _SLOT.size, key_hash, data_start + offset)
+
+        base_tmp = f"{self.base_path}.{os.getpid()}.tmp"
+        with open(base_tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, generation, len(entries), slots))
+            f.write(table)
+            f.write(records)
+        delta_tmp = f"{self.delta_path}.{os.getpid()}.tmp"
+        with open(delta_tmp, "wb") as f:
+            f.write(json.dumps([generation, writes]).encode("utf-8") + b"\n")
+
+        # Readers holding the old files see the seal and reopen.
+        if os.path.exists(self.delta_path):
+            self._append(b"[]\n")
+        os.replace(base_tmp, self.base_path)
+        os.replace(delta_tmp, self.delta_path)
+        self.rebuilds += 1
+        return len(entries)
+
+    def _current_generation(self):
+        try:
+            with open(self.base_path, "rb") as f:
+                return _HEADER.unpack(f.read(_HEADER.size))[2]
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def apply(self, changes, writes=None):
+        # changes: (shortcode, original_url, expires_at, redirect_status) with
+        # original_url None for a deleted code, committed as of the database
+        # write counter writes. The caller holds lock().
+        if not changes or not os.path.exists(self.delta_path):
+            return
+        lines = [json.dumps(list(change), separators=(",", ":")) for change in changes]
+        lines.append(json.dumps([self._current_generation(), writes]))
+        self._append(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def _append(self, data):
+        fd = os.open(self.delta_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+    def _open(self):
+        self._close()
+        self._reset()
+        self._pid = os.getpid()
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Shared lock so a rebuild cannot swap the files between the two opens.
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            with open(self.base_path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._delta_fd = os.open(self.delta_path, os.O_RDONLY)
+        except FileNotFoundError:
+            self._close()
+            return False
+        finally:
+            os.close(fd)
+
+        magic, version, generation, count, slots = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._close()
+            raise ValueError(f"{self.base_path} is not a version {_VERSION} link index")
+        self._generation = generation
+        self._count = count
+        self._slots = slots
+        return True
+
+    def _base_key(self):
+        try:
+            stat = os.stat(self.base_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _close(self):
+        # The old map is left to the garbage collector; a concurrent get()
+        # may still be reading from it.
+        self._mm = None
+        if self._delta_fd is not None:
+            os.close(self._delta_fd)
+            self._delta_fd = None
+
+    def subscribe(self, callback):
+        # callback(codes) is called with the codes changed by any process, so
+        # per-process caches in front of the index can drop them.
+        self._subscribers.append(callback)
+
+    def _replay(self, entry, changed):
+        if len(entry) == 4:
+            code, url, expires_at, redirect_status = entry
+            self._overlay[code] = (url, expires_at, redirect_status) if url is not None else None
+            self._delta_entries += 1
+            changed.append(code)
+        elif len(entry) == 2:
+            self._writes = entry[1]
+        elif not entry:
+            self._sealed = True
+
+    def refresh(self):
+        # Returns the (map, overlay, slots) to read from, or None if there is
+        # no index. One fstat when nothing has changed.
+        changed = []
+        try:
+            state = self._refresh(changed)
+        except ValueError:
+            # Logged once; the files are skipped until a rebuild replaces them.
+            self._close()
+            self._rejected = self._base_key()
+            logger.exception("Link index unavailable")
+            state = None
+        except OSError:
+            logger.exception("Link index unavailable")
+            state = None
+        if changed:
+            for callback in self._subscribers:
+                try:
+                    callback(changed)
+                except Exception:
+                    logger.exception("Link index subscriber failed")
+        return state
+
+    def _refresh(self, changed):
+        # New delta lines are replayed into the overlay; a sealed delta means
+        # a rebuild replaced both files.
+        with self._refresh_lock:
+            if self._pid != os.getpid() or self._mm is None:
+                # Nothing can be cached from an index this process has not
+                # read yet, so the first replay is not reported.
+                changed = []
+                if self._rejected is not None and self._rejected == self._base_key():
+                    return None
+                if not self._open():
+                    return None
+                self._rejected = None
+            while True:
+                size = os.fstat(self._delta_fd).st_size
+                if size <= self._delta_pos:
+                    return self._mm, self._overlay, self._slots
+                data = self._delta_tail + os.pread(self._delta_fd, size - self._delta_pos, self._delta_pos)
+                self._delta_pos = size
+                lines = data.split(b"\n")
+                # A writer may be mid-append; keep the partial line for next time.
+                self._delta_tail = lines.pop()
+                for line in lines:
+                    self._replay(json.loads(line), changed)
+                if not self._sealed:
+                    return self._mm, self._overlay, self._slots
+                if not self._open():
+                    return None
+
+    def get(self, code):
+        # (original_url, expires_at, redirect_status), None if the code does
+        # not exist, or
+        # UNAVAILABLE if there is no index to answer from.
+        state = self.refresh()
+        if state is None:
+            self.fallbacks += 1
+            return UNAVAILABLE
+        mm, overlay, slots = state
+        self.lookups += 1
+
+        if code in overlay:
+            self.overlay_hits += 1
+            return overlay[code]
+
+        key = code.encode("utf-8")
+        key_hash = _hash(key)
+        mask = slots - 1
+        index = key_hash & mask
+        while True:
+            slot_hash, offset = _SLOT.unpack_from(mm, _HEADER.size + index * _SLOT.size)
+            if not offset:
+                return None
+            if slot_hash == key_hash:
+                code_len, expires_len, url_len, redirect_status = _RECORD.unpack_from(mm, offset)
+                start = offset + _RECORD.size
+                if mm[start:start + code_len] == key:
+                    start += code_len
+                    expires_at = mm[start:start + expires_len].decode("utf-8") or None
+                    start += expires_len
+                    return mm[start:start + url_len].decode("utf-8"), expires_at, redirect_status or None
+            index = (index + 1) & mask
+
+    def writes(self):
+        # The database write counter the index is current with, or None if
+        # unknown (no index, or one written before the counter existed).
+        if self.refresh() is None:
+            return None
+        return self._writes
+
+    def start(self, compact, interval=60):
+        # Runs compact() whenever the delta has grown past max_delta; one
+        # process per deployment is enough.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(compact, interval), name="link-index", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, compact, interval):
+        while not self._stopping.wait(interval):
+            try:
+                if self.needs_compaction():
+                    compact()
+            except Exception:
+                logger.exception("Link index compaction failed")
+
+    def needs_compaction(self):
+        if self.refresh() is None:
+            return True
+        return self._delta_entries >= self.max_delta
+
+    def stats(self):
+        return {
+            "generation": self._generation,
+            "links": self._count,
+            "slots": self._slots,
+            "delta_entries": self._delta_entries,
+            "lookups": self.lookups,
+            "overlay_hits": self.overlay_hits,
+            "fallbacks": self.fallbacks,
+            "rebuilds": self.rebuilds
+        }
@@ -0,0 +1,211 @@
+import bisect
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+# Seconds. Requests and SQL statements sit at different scales, so each gets
+# its own ladder.
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_BUCKETS = (0.00002, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 2.5)
+
+_VERB = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|PRAGMA|BEGIN|COMMIT|ROLLBACK|EXPLAIN|CREATE|DROP|ALTER|WITH)\b", re.I)
+_TABLE = {
+    "SELECT": re.compile(r"\bFROM\s+(\w+)", re.I),
+    "DELETE": re.compile(r"\bFROM\s+(\w+)", re.I),
+    "INSERT": re.compile(r"\bINTO\s+(\w+)", re.I),
+    "REPLACE": re.compile(r"\bINTO\s+(\w+)", re.I),
+    "UPDATE": re.compile(r"^\s*UPDATE\s+(\w+)", re.I),
+    "PRAGMA": re.compile(r"^\s*PRAGMA\s+(\w+)", re.I),
+}
+_WHERE = re.compile(r"\bWHERE\s+\(?\s*(\w+)", re.I)
+_SET = re.compile(r"\bSET\s+(\w+)", re.I)
+
+
+@lru_cache(maxsize=2048)
+def statement_label(sql):
+    # A short, bounded name for a statement: verb, table and the first column
+    # it filters (or sets) on, e.g. "select urls where shortcode" or
+    # "update urls set clicks". IN lists of any length get the same name.
+    match = _VERB.match(sql)
+    if not match:
+        return "other"
+    verb = match.group(1).upper()
+    table = _TABLE.get(verb)
+    match = table.search(sql) if table else None
+    if not match:
+        return verb.lower()
+    label = f"{verb.lower()} {match.group(1)}"
+    column = (_SET if verb == "UPDATE" else _WHERE).search(sql)
+    if column and verb != "INSERT":
+        label += f" {'set' if verb == 'UPDATE' else 'where'} {column.group(1)}"
+    return label
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values)
+        return lines
+
+
+class Histogram:
+    # Per label set: a count per bucket (not yet cumulative), the sum and the
+    # count. observe() is a bisect and a few additions under a lock.
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Callback:
+    # Values read from another component's stats() at scrape time, so the
+    # hot paths pay nothing for them. fn returns a number, or a dict keyed by
+    # label value tuples.
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def render(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(values.items()) if value is not None
+        )
+        return lines
+
+
+class Metrics:
+    # In-process registry rendered in the Prometheus text format. Each
+    # process keeps its own values; with several workers every scrape is
+    # answered by one of them.
+    def __init__(self, prefix="shortener"):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(f"{self.prefix}_{name}", help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        return self._add(Histogram(f"{self.prefix}_{name}", help, labels, buckets))
+
+    def callback(self, name, help, fn, labels=(), kind="gauge"):
+        return self._add(Callback(f"{self.prefix}_{name}", help, fn, labels, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def timed_connection(statements=None, connects=None, tracer=None):
+    # A sqlite3.Connection class for Database(factory=...) that times every
+    # execute, executemany and commit by statement_label, and the connect
+    # itself. For SELECTs the time is to the first row; later rows are
+    # stepped by fetchall() outside the timer. tracer, if given, is called as
+    # tracer(conn, sql, parameters, seconds); parameters is None for
+    # executemany and commit.
+    perf_counter = time.perf_counter
+
+    class TimedConnection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            start = perf_counter()
+            super().__init__(*args, **kwargs)
+            if connects is not None:
+                connects.observe(perf_counter() - start)
+
+        def _observe(self, sql, parameters, seconds):
+            if statements is not None:
+                statements.observe(seconds, statement_label(sql))
+            if tracer is not None:
+                tracer(self, sql, parameters, seconds)
+
+        def execute(self, sql, parameters=()):
+            start = perf_counter()
+            try:
+                return super().execute(sql, parameters)
+            finally:
+                self._observe(sql, parameters, perf_counter() - start)
+
+        def executemany(self, sql, parameters):
+            start = perf_counter()
+            try:
+                return super().executemany(sql, parameters)
+            finally:
+                self._observe(sql, None, perf_counter() - start)
+
+        def commit(self):
+            start = perf_counter()
+            try:
+                return super().commit()
+            finally:
+                self._observe("COMMIT", None, perf_counter() - start)
+
+    return TimedConnection
@@ -0,0 +1,149 @@
+import argparse
+import socketserver
+import threading
+import time
+
+
+class Store:
+    def __init__(self):
+        self.data = {}
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    # Implements just enough of RESP2 for the shortener's shared cache:
+    # PING, GET, SET [EX|PX], DEL, EXISTS, FLUSHALL, PUBLISH and SUBSCRIBE.
+    def handle(self):
+        store = self.server.store
+        self.write_lock = threading.Lock()
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                break
+            if args is None:
+                break
+            name = args[0].upper()
+            if name == b"SUBSCRIBE":
+                self.subscribe(store, args[1:])
+                break
+            self.write(self.execute(store, name, args[1:]))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = self.rfile.readline()
+            length = int(header[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def execute(self, store, name, args):
+        with store.lock:
+            if name == b"PING":
+                return "PONG"
+            if name in (b"SELECT", b"AUTH"):
+                return "OK"
+            if name == b"GET":
+                return store.get(args[0])
+            if name == b"SET":
+                expires_at = None
+                options = [arg.upper() for arg in args[2:]]
+                if b"EX" in options:
+                    expires_at = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+                elif b"PX" in options:
+                    expires_at = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+                store.data[args[0]] = (args[1], expires_at)
+                return "OK"
+            if name == b"DEL":
+                return sum(1 for key in args if store.data.pop(key, None) is not None)
+            if name == b"EXISTS":
+                return sum(1 for key in args if store.get(key) is not None)
+            if name == b"FLUSHALL":
+                store.data.clear()
+                return "OK"
+            if name == b"PUBLISH":
+                receivers = list(store.channels.get(args[0], ()))
+            else:
+                return RuntimeError(f"unknown command '{name.decode()}'")
+        delivered = 0
+        for handler in receivers:
+            try:
+                handler.write([b"message", args[0], args[1]])
+                delivered += 1
+            except OSError:
+                pass
+        return delivered
+
+    def subscribe(self, store, channels):
+        with store.lock:
+            for count, channel in enumerate(channels, 1):
+                store.channels.setdefault(channel, set()).add(self)
+                self.write([b"subscribe", channel, count])
+        try:
+            while self.rfile.readline():
+                pass
+        finally:
+            with store.lock:
+                for channel in channels:
+                    store.channels.get(channel, set()).discard(self)
+
+    def write(self, value):
+        with self.write_lock:
+            self.wfile.write(self.encode(value))
+            self.wfile.flush()
+
+    def encode(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode("utf-8")
+        if isinstance(value, Exception):
+            return b"-ERR %s\r\n" % str(value).encode("utf-8")
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(self.encode(item) for item in value)
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.store = Store()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="miniredis", daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal Redis-compatible server for local testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    with RespServer((args.host, args.port)) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
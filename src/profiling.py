@@ -0,0 +1,222 @@
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Where an otherwise idle thread sits: pool workers, the click queue and the
+# sweepers waiting for work, and the server waiting for connections.
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socketserver.py", "serve_forever"),
+    ("thread.py", "_worker"),
+}
+
+_SPACE = re.compile(r"\s+")
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+_EXPLAINED = re.compile(r"^\s*(SELECT|UPDATE|DELETE|WITH)\b", re.I)
+_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?$")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def normalize_sql(sql):
+    # One line, with IN lists of any length folded into a single "?, …".
+    return _PLACEHOLDERS.sub("?, …", _SPACE.sub(" ", sql).strip())
+
+
+class SamplingProfiler:
+    # Samples the Python stack of every thread in this process every
+    # `interval` seconds for a fixed time and counts identical stacks, which
+    # is the folded format flamegraph.pl, speedscope and inferno read. Nothing
+    # is hooked into the interpreter, so there is no cost outside a profile
+    # and only one runs at a time.
+    def __init__(self, max_seconds=60):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.profiles = 0
+
+    def profile(self, seconds, interval=0.005, include_idle=False):
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            own = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            names = {}
+            deadline = time.monotonic() + min(seconds, self.max_seconds)
+            while time.monotonic() < deadline:
+                if samples % 100 == 0:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = self._fold(frame, include_idle)
+                    if stack:
+                        stacks[f"{names.get(ident, ident)};{stack}"] += 1
+                samples += 1
+                time.sleep(interval)
+            self.profiles += 1
+            return stacks, samples
+        finally:
+            self._lock.release()
+
+    def _fold(self, frame, include_idle):
+        code = frame.f_code
+        if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+            return None
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+
+def collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+class QueryPlans:
+    # Runs EXPLAIN QUERY PLAN the first time a statement shape is seen, on
+    # the connection that just ran it and with the same parameters, and
+    # flags plans that read a whole table or index or sort in a temp b-tree.
+    # Later executions cost one set lookup.
+    def __init__(self, max_statements=1000):
+        self.max_statements = max_statements
+        self._seen = set()
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def check(self, conn, sql, parameters):
+        if sql in self._seen:
+            return
+        if len(self._seen) < 4 * self.max_statements:
+            self._seen.add(sql)
+        if parameters is None or not _EXPLAINED.match(sql):
+            return
+        key = normalize_sql(sql)
+        with self._lock:
+            if key in self._plans or len(self._plans) >= self.max_statements:
+                return
+            self._plans[key] = None
+
+        try:
+            rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+            plan = [row[3] for row in rows]
+            flags = self._flags(conn, plan)
+        except sqlite3.Error as e:
+            plan, flags = [], [f"explain failed: {e}"]
+
+        with self._lock:
+            self._plans[key] = {"plan": plan, "flags": flags}
+        if flags:
+            logger.warning("Query plan for %s: %s", key, "; ".join(flags))
+
+    def _flags(self, conn, plan):
+        flags = []
+        for detail in plan:
+            if detail.startswith("USE TEMP B-TREE"):
+                flags.append(detail.lower())
+                continue
+            match = _SCAN.match(detail)
+            if not match:
+                continue
+            # CTEs, subqueries and constant rows are scanned too; only real
+            # tables count.
+            table = sqlite3.Connection.execute(
+                conn, "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (match.group(1),)
+            ).fetchone()
+            if table:
+                flags.append(f"{'index' if match.group(2) else 'full'} scan of {match.group(1)}")
+        return flags
+
+    def plans(self, flagged_only=False):
+        with self._lock:
+            items = [(sql, entry) for sql, entry in self._plans.items() if entry is not None]
+        return [
+            {"sql": sql, **entry}
+            for sql, entry in sorted(items)
+            if entry["flags"] or not flagged_only
+        ]
+
+    def stats(self):
+        with self._lock:
+            entries = [entry for entry in self._plans.values() if entry is not None]
+        return {
+            "statements": len(entries),
+            "flagged": sum(1 for entry in entries if entry["flags"])
+        }
+
+
+class SlowRequestLog:
+    # Requests slower than `threshold` seconds are logged with the SQL they
+    # ran. Statements reach it as the connection tracer and are collected
+    # for the thread's current request between begin() and detach(); the
+    # query plan check sees every statement, including background jobs'.
+    def __init__(self, threshold, plans=None, keep=100, max_statements=200):
+        self.threshold = threshold
+        self.plans = plans
+        self.max_statements = max_statements
+        self._local = threading.local()
+        self._recent = deque(maxlen=keep)
+        self.requests = 0
+        self.slow = 0
+
+    def begin(self):
+        trace = []
+        self._local.trace = trace
+        return trace
+
+    def detach(self):
+        self._local.trace = None
+
+    def statement(self, conn, sql, parameters, seconds):
+        trace = getattr(self._local, "trace", None)
+        if trace is not None and len(trace) < self.max_statements:
+            trace.append((sql, seconds))
+        if self.plans is not None:
+            self.plans.check(conn, sql, parameters)
+
+    def finish(self, trace, method, path, status, seconds):
+        self.requests += 1
+        if seconds < self.threshold:
+            return
+        statements = [{"sql": normalize_sql(sql), "ms": round(elapsed * 1000, 3)} for sql, elapsed in trace]
+        entry = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "method": method,
+            "path": path,
+            "status": status,
+            "ms": round(seconds * 1000, 3),
+            "sql_ms": round(sum(elapsed for _, elapsed in trace) * 1000, 3),
+            "statements": statements
+        }
+        self._recent.append(entry)
+        self.slow += 1
+        logger.warning(
+            "Slow request: %s %s -> %s in %.1f ms, %d statements in %.1f ms%s",
+            method, path, status, entry["ms"], len(statements), entry["sql_ms"],
+            "".join(f"\n  {statement['ms']:.3f} ms  {statement['sql']}" for statement in statements)
+        )
+
+    def recent(self):
+        return list(self._recent)
+
+    def stats(self):
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "requests": self.requests,
+            "slow": self.slow,
+            **({"query_plans": self.plans.stats()} if self.plans is not None else {})
+        }
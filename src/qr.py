@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+
+QR_FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml"
+}
+
+QR_BORDER = 4
+
+
+def render_qr(data, size, fmt):
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=QR_BORDER,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffered = BytesIO()
+
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffered)
+        return buffered.getvalue()
+
+    qr.box_size = max(1, size // (qr.modules_count + 2 * QR_BORDER))
+    img = qr.make_image(fill_color="black", back_color="white").get_image()
+    if img.size != (size, size):
+        img = img.resize((size, size), resample=0)
+    img.save(buffered, format="PNG", optimize=True)
+    return buffered.getvalue()
+
+
+class QRCache:
+    # Two tiers: a byte-bounded LRU in memory in front of a directory of
+    # rendered files. Images only depend on the encoded short URL, so entries
+    # never need invalidating when a link's destination changes.
+    def __init__(self, cache_dir=None, max_bytes=16 * 1024 * 1024, max_files=10000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+        self.evictions = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, data, size, fmt):
+        if fmt == "svg":
+            size = 0
+        key = hashlib.sha256(f"{fmt}:{size}:{data}".encode("utf-8")).hexdigest()
+
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return key, image
+
+        image = self._read_disk(key, fmt)
+        if image is not None:
+            self.disk_hits += 1
+        else:
+            image = render_qr(data, size, fmt)
+            self.renders += 1
+            self._write_disk(key, fmt, image)
+
+        self._remember(key, image)
+        return key, image
+
+    def _remember(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = image
+            self._bytes += len(image)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def _read_disk(self, key, fmt):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key, fmt), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, fmt, image):
+        if not self.cache_dir:
+            return
+        path = self._path(key, fmt)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(image)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file()]
+        except OSError:
+            return
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._entries),
+                "memory_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "renders": self.renders,
+                "evictions": self.evictions
+            }
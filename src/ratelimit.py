@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import threading
+import time
+
+from limits.storage import Storage
+
+
+class SQLiteStorage(Storage):
+    # Fixed-window rate limit counters in a small SQLite file, so every worker
+    # process on the host sees the same counts and they survive restarts.
+    # Registered with `limits` under sqlite:///relative/path or
+    # sqlite:////absolute/path.
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        path = (uri or "sqlite:///ratelimits.db")[len("sqlite:///"):]
+        self.path = path or "ratelimits.db"
+        self.timeout = float(options.get("timeout", 5))
+        self._local = threading.local()
+        self._pid = None
+        self._writes = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        row = self._connection().execute('''
+            INSERT INTO rate_limits (key, value, expires_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END,
+                expires_at = CASE WHEN expires_at <= ? OR ? THEN excluded.expires_at ELSE expires_at END
+            RETURNING value
+        ''', (key, amount, now + expiry, now, now, bool(elastic_expiry))).fetchone()
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self.purge_expired()
+        return row[0]
+
+    def get(self, key):
+        row = self._connection().execute('''
+            SELECT value FROM rate_limits
+            WHERE key = ? AND expires_at > ?
+        ''', (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute('''
+            SELECT expires_at FROM rate_limits
+            WHERE key = ?
+        ''', (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        return self._connection().execute(
+            "DELETE FROM rate_limits WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
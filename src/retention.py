@@ -0,0 +1,301 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+_ARCHIVE_NAME = re.compile(r"^analytics-(\d{4})-(\d{2})\.db$")
+
+
+def month_start(now):
+    return now.strftime('%Y-%m-01 00:00:00')
+
+
+def months_back(now, months):
+    year, month = now.year, now.month - months
+    while month <= 0:
+        year -= 1
+        month += 12
+    return year, month
+
+
+class Retention:
+    # Raw analytics rows live in the main database only for the current month.
+    # Closed months are moved, a small batch per transaction, into one archive
+    # file per month; expired months are dropped by deleting their file. The
+    # rollups already hold the aggregates, since they are updated as clicks
+    # are ingested. With the log storage backend the raw events are in
+    # monthly segments instead (click_log), which are dropped the same way.
+    def __init__(self, database, table_analytics, rollups, archive_dir,
+                 retention_months=12, interval=3600, batch_size=5000,
+                 visitor_grace_days=2, vacuum_pages=1000, click_log=None, table_orphans=None,
+                 table_renames=None):
+        self.database = database
+        self.table_analytics = table_analytics
+        self.rollups = rollups
+        self.archive_dir = archive_dir
+        self.retention_months = retention_months
+        self.interval = interval
+        self.batch_size = batch_size
+        self.visitor_grace_days = visitor_grace_days
+        self.vacuum_pages = vacuum_pages
+        self.click_log = click_log
+        # Deleted codes are queued here by storage, which also takes them
+        # back if the code is reused before a run gets to it. Renames are
+        # queued the same way: both tables are shared by workers, and only
+        # one of them runs retention.
+        self.table_orphans = table_orphans or f"{table_analytics}_orphans"
+        self.table_renames = table_renames or f"{table_analytics}_renames"
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.archived = 0
+        self.purged_months = 0
+        self.orphans_deleted = 0
+        self.last_run = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="analytics-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        # Analytics for deleted and renamed links are handled by the next run
+        # rather than inline, so those requests stay small writes.
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Analytics retention run failed")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        with self._run_lock:
+            self._archive_closed_months(now)
+            self._purge_expired_archives(now)
+            self._clean_orphans()
+            self._compact_rollups(now)
+            self._incremental_vacuum()
+            self.runs += 1
+            self.last_run = now.strftime('%Y-%m-%d %H:%M:%S')
+
+    def _archive_path(self, year, month):
+        return os.path.join(self.archive_dir, f"analytics-{year:04d}-{month:02d}.db")
+
+    def _open_archive(self, year, month):
+        return self._open_archive_path(self._archive_path(year, month))
+
+    def _open_archive_path(self, path):
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS analytics (
+                id INTEGER PRIMARY KEY,
+                shortcode TEXT NOT NULL,
+                ip_address TEXT,
+                user_agent TEXT,
+                referrer TEXT,
+                timestamp TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_analytics_shortcode ON analytics(shortcode)')
+        conn.execute('CREATE TABLE IF NOT EXISTS renames_applied (last_id INTEGER NOT NULL)')
+        return conn
+
+    def _apply_renames(self, archive, renames):
+        # Replays the queued renames this archive has not had yet, inside
+        # the caller's transaction, and records the last one. A rename drops
+        # what a deleted link left under the new code first, so replaying
+        # one twice would drop the moved clicks too.
+        row = archive.execute('SELECT last_id FROM renames_applied').fetchone()
+        pending = [rename for rename in renames if rename[0] > (row[0] if row else 0)]
+        if not pending:
+            return
+        for _, old_code, new_code in pending:
+            archive.execute('DELETE FROM analytics WHERE shortcode = ?', (new_code,))
+            archive.execute('UPDATE analytics SET shortcode = ? WHERE shortcode = ?', (new_code, old_code))
+        archive.execute('DELETE FROM renames_applied')
+        archive.execute('INSERT INTO renames_applied (last_id) VALUES (?)', (pending[-1][0],))
+
+    def _archives(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        archives = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            match = _ARCHIVE_NAME.match(name)
+            if match:
+                archives.append((int(match.group(1)), int(match.group(2)), os.path.join(self.archive_dir, name)))
+        return archives
+
+    def _archive_closed_months(self, now):
+        cutoff = month_start(now)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        while not self._stopping.is_set():
+            # The rows carry every rename queued as of the same snapshot, so
+            # those are applied to the archive before the rows go in.
+            with self.database.reader() as conn:
+                conn.execute('BEGIN')
+                rows = conn.execute(f'''
+                    SELECT id, shortcode, ip_address, user_agent, referrer, timestamp
+                    FROM {self.table_analytics}
+                    ORDER BY id
+                    LIMIT ?
+                ''', (self.batch_size,)).fetchall()
+                renames = conn.execute(f'SELECT id, old_code, new_code FROM {self.table_renames} ORDER BY id').fetchall()
+
+            closed = [row for row in rows if row[5] and row[5] < cutoff]
+            if not closed:
+                return
+
+            by_month = defaultdict(list)
+            for row in closed:
+                by_month[(int(row[5][:4]), int(row[5][5:7]))].append(row)
+
+            # Archive first, then delete: ids are primary keys in the archive,
+            # so a run interrupted between the two steps is simply repeated.
+            for (year, month), month_rows in by_month.items():
+                archive = self._open_archive(year, month)
+                try:
+                    with archive:
+                        self._apply_renames(archive, renames)
+                        archive.executemany('''
+                            INSERT OR IGNORE INTO analytics
+                            (id, shortcode, ip_address, user_agent, referrer, timestamp)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', month_rows)
+                finally:
+                    archive.close()
+
+            with self.database.writer() as conn:
+                conn.executemany(f'''
+                    DELETE FROM {self.table_analytics} WHERE id = ?
+                ''', [(row[0],) for row in closed])
+            self.archived += len(closed)
+
+    def _purge_expired_archives(self, now):
+        if self.retention_months <= 0:
+            return
+        oldest = months_back(now, self.retention_months)
+        for year, month, path in self._archives():
+            if (year, month) >= oldest:
+                continue
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+            self.purged_months += 1
+        if self.click_log is not None:
+            self.purged_months += self.click_log.purge_before(*oldest)
+
+    def _move_renamed(self):
+        # Storage moved the rows in the main database with the link. Once
+        # every archive has a rename it leaves the queue.
+        with self.database.reader() as conn:
+            renames = conn.execute(f'SELECT id, old_code, new_code FROM {self.table_renames} ORDER BY id').fetchall()
+        if not renames:
+            return
+
+        for _, _, path in self._archives():
+            archive = self._open_archive_path(path)
+            try:
+                with archive:
+                    self._apply_renames(archive, renames)
+            finally:
+                archive.close()
+
+        with self.database.writer() as conn:
+            conn.execute(f'DELETE FROM {self.table_renames} WHERE id <= ?', (renames[-1][0],))
+
+    def _clean_orphans(self):
+        self._move_renamed()
+
+        with self.database.reader() as conn:
+            codes = [row[0] for row in conn.execute(f'SELECT shortcode FROM {self.table_orphans}')]
+
+        for code in codes:
+            # Each batch re-checks the queue: once the code is reused its
+            # rows are live.
+            while True:
+                with self.database.writer() as conn:
+                    cursor = conn.execute(f'''
+                        DELETE FROM {self.table_analytics}
+                        WHERE id IN (
+                            SELECT id FROM {self.table_analytics}
+                            WHERE shortcode = ?
+                            LIMIT ?
+                        )
+                        AND EXISTS (SELECT 1 FROM {self.table_orphans} WHERE shortcode = ?)
+                    ''', (code, self.batch_size, code))
+                self.orphans_deleted += cursor.rowcount
+                if cursor.rowcount < self.batch_size:
+                    break
+
+            for _, _, path in self._archives():
+                archive = sqlite3.connect(path)
+                try:
+                    with archive:
+                        cursor = archive.execute('DELETE FROM analytics WHERE shortcode = ?', (code,))
+                    self.orphans_deleted += cursor.rowcount
+                finally:
+                    archive.close()
+
+            with self.database.writer() as conn:
+                still_orphaned = conn.execute(f'''
+                    DELETE FROM {self.table_orphans}
+                    WHERE shortcode = ?
+                    RETURNING shortcode
+                ''', (code,)).fetchall()
+                if still_orphaned:
+                    self.rollups.delete(conn, code)
+
+    def _compact_rollups(self, now):
+        visitors_before = (now - timedelta(days=self.visitor_grace_days)).strftime('%Y-%m-%d')
+        hourly_before = None
+        if self.retention_months > 0:
+            year, month = months_back(now, self.retention_months)
+            hourly_before = f"{year:04d}-{month:02d}-01"
+        with self.database.writer() as conn:
+            self.rollups.compact(conn, visitors_before, hourly_before)
+
+    def _incremental_vacuum(self):
+        with self.database.writer() as conn:
+            conn.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+
+    def stats(self):
+        with self.database.reader() as conn:
+            pending = conn.execute(f'SELECT COUNT(*) FROM {self.table_orphans}').fetchone()[0]
+            renames = conn.execute(f'SELECT COUNT(*) FROM {self.table_renames}').fetchone()[0]
+        return {
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "archived": self.archived,
+            "archive_months": len(self._archives()),
+            "purged_months": self.purged_months,
+            "orphans_deleted": self.orphans_deleted,
+            "pending_orphans": pending,
+            "pending_renames": renames,
+            "retention_months": self.retention_months
+        }
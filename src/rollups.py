@@ -0,0 +1,320 @@
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from urllib.parse import urlparse
+
+from hll import HyperLogLog
+
+GRANULARITIES = ("hour", "day")
+
+# Day key of the all-time visitor sketch.
+ALL_TIME = "all"
+
+_AGENT_FAMILIES = [
+    ("bot", re.compile(r"bot|crawl|spider|slurp|preview|facebookexternalhit|headless|lighthouse|pingdom|uptime"
+                       r"|monitor|embedly|whatsapp", re.I)),
+    ("curl", re.compile(r"^curl/|^wget/|python-requests|^Go-http-client", re.I)),
+    ("edge", re.compile(r"Edg(e|A|iOS)?/")),
+    ("opera", re.compile(r"OPR/|Opera")),
+    ("samsung", re.compile(r"SamsungBrowser/")),
+    ("chrome", re.compile(r"Chrome/|CriOS/")),
+    ("firefox", re.compile(r"Firefox/|FxiOS/")),
+    ("safari", re.compile(r"Safari/")),
+]
+
+
+# A handful of agent strings make up most traffic, so each distinct string
+# goes through the patterns once.
+@lru_cache(maxsize=4096)
+def agent_family(user_agent):
+    if not user_agent:
+        return "unknown"
+    for family, pattern in _AGENT_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return "other"
+
+
+def is_automated(user_agent):
+    # Crawlers, link previews and scripted clients.
+    return not user_agent or agent_family(user_agent) in ("bot", "curl")
+
+
+def referrer_host(referrer):
+    if not referrer:
+        return "(direct)"
+    try:
+        return (urlparse(referrer).hostname or "(direct)").lower()
+    except ValueError:
+        return "(invalid)"
+
+
+def bucket_of(timestamp, granularity):
+    # Timestamps are stored as 'YYYY-MM-DD HH:MM:SS', so buckets are prefixes.
+    if granularity == "hour":
+        return timestamp[:13] + ":00:00"
+    return timestamp[:10]
+
+
+class Rollups:
+    def __init__(self, prefix="analytics"):
+        self.table_buckets = f"{prefix}_rollup"
+        self.table_visitors = f"{prefix}_rollup_visitors"
+        self.table_referrers = f"{prefix}_rollup_referrers"
+        self.table_agents = f"{prefix}_rollup_agents"
+        self.table_sketches = f"{prefix}_sketches"
+        self.sketch_writes = 0
+
+    def _tables(self):
+        return (self.table_buckets, self.table_visitors, self.table_referrers, self.table_agents,
+                self.table_sketches)
+
+    def create_tables(self, conn):
+        # Returns the parts that are new and need a backfill.
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = []
+        if self.table_buckets not in existing:
+            missing.append("buckets")
+        if self.table_sketches not in existing:
+            missing.append("sketches")
+
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_buckets} (
+                shortcode TEXT NOT NULL,
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                unique_ips INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (shortcode, granularity, bucket)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_visitors} (
+                shortcode TEXT NOT NULL,
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                ip_address TEXT NOT NULL,
+                PRIMARY KEY (shortcode, granularity, bucket, ip_address)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_referrers} (
+                shortcode TEXT NOT NULL,
+                day TEXT NOT NULL,
+                referrer TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (shortcode, day, referrer)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_agents} (
+                shortcode TEXT NOT NULL,
+                day TEXT NOT NULL,
+                family TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (shortcode, day, family)
+            ) WITHOUT ROWID
+        ''')
+        # HyperLogLog sketches of visitor IPs per link and day, plus one
+        # all-time sketch per link (day = 'all'), with the estimate stored
+        # alongside so reads never decode the registers. Automated clients are
+        # left out of the sketches and counted in bot_clicks instead.
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_sketches} (
+                shortcode TEXT NOT NULL,
+                day TEXT NOT NULL,
+                registers BLOB NULL,
+                visitors INTEGER NOT NULL DEFAULT 0,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                bot_clicks INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (shortcode, day)
+            ) WITHOUT ROWID
+        ''')
+        return missing
+
+    def backfill(self, conn, table_analytics, parts=("buckets", "sketches"), chunk_size=10000):
+        last_id = 0
+        while True:
+            rows = conn.execute(f'''
+                SELECT id, shortcode, ip_address, user_agent, referrer, timestamp
+                FROM {table_analytics}
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            if not rows:
+                return
+            batch = [row[1:] for row in rows]
+            if "buckets" in parts:
+                self.apply_buckets(conn, batch)
+            if "sketches" in parts:
+                self.apply_sketches(conn, batch)
+            last_id = rows[-1][0]
+
+    def apply(self, conn, batch):
+        # batch holds (shortcode, ip_address, user_agent, referrer, timestamp)
+        # tuples; runs inside the caller's transaction.
+        self.apply_buckets(conn, batch)
+        self.apply_sketches(conn, batch)
+
+    def apply_buckets(self, conn, batch):
+        buckets = Counter()
+        visitors = set()
+        referrers = Counter()
+        agents = Counter()
+
+        for shortcode, ip_address, user_agent, referrer, timestamp in batch:
+            for granularity in GRANULARITIES:
+                bucket = bucket_of(timestamp, granularity)
+                buckets[(shortcode, granularity, bucket)] += 1
+                if ip_address:
+                    visitors.add((shortcode, granularity, bucket, ip_address))
+            day = bucket_of(timestamp, "day")
+            referrers[(shortcode, day, referrer_host(referrer))] += 1
+            agents[(shortcode, day, agent_family(user_agent))] += 1
+
+        # Only visitors new to their bucket are inserted, so the per-bucket
+        # rowcounts are what unique_ips grows by.
+        new_visitors = Counter()
+        cursor = conn.cursor()
+        insert = f'''
+            INSERT OR IGNORE INTO {self.table_visitors} (shortcode, granularity, bucket, ip_address)
+            VALUES (?, ?, ?, ?)
+        '''
+        for visitor in visitors:
+            cursor.execute(insert, visitor)
+            new_visitors[visitor[:3]] += cursor.rowcount
+        conn.executemany(f'''
+            INSERT INTO {self.table_buckets} (shortcode, granularity, bucket, clicks, unique_ips)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (shortcode, granularity, bucket)
+            DO UPDATE SET clicks = clicks + excluded.clicks, unique_ips = unique_ips + excluded.unique_ips
+        ''', [(*key, count, new_visitors[key]) for key, count in buckets.items()])
+        conn.executemany(f'''
+            INSERT INTO {self.table_referrers} (shortcode, day, referrer, clicks)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (shortcode, day, referrer)
+            DO UPDATE SET clicks = clicks + excluded.clicks
+        ''', [(*key, count) for key, count in referrers.items()])
+        conn.executemany(f'''
+            INSERT INTO {self.table_agents} (shortcode, day, family, clicks)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (shortcode, day, family)
+            DO UPDATE SET clicks = clicks + excluded.clicks
+        ''', [(*key, count) for key, count in agents.items()])
+
+    def apply_sketches(self, conn, batch):
+        clicks = Counter()
+        bot_clicks = Counter()
+        visitors = defaultdict(set)
+        for shortcode, ip_address, user_agent, _, timestamp in batch:
+            for key in ((shortcode, bucket_of(timestamp, "day")), (shortcode, ALL_TIME)):
+                if is_automated(user_agent):
+                    bot_clicks[key] += 1
+                    continue
+                clicks[key] += 1
+                if ip_address:
+                    visitors[key].add(ip_address)
+
+        rows = []
+        for key in clicks.keys() | bot_clicks.keys():
+            registers = estimate = None
+            if key in visitors:
+                row = conn.execute(f'''
+                    SELECT registers FROM {self.table_sketches}
+                    WHERE shortcode = ? AND day = ?
+                ''', key).fetchone()
+                sketch = HyperLogLog.from_bytes(row[0] if row else None)
+                changed = False
+                for ip_address in visitors[key]:
+                    changed = sketch.add(ip_address) or changed
+                # Repeat visitors leave the registers as they were, which is
+                # the common case for busy links; only the counts are written.
+                if changed:
+                    registers, estimate = sketch.to_bytes(), sketch.estimate()
+            rows.append((*key, registers, estimate or 0, clicks[key], bot_clicks[key]))
+
+        conn.executemany(f'''
+            INSERT INTO {self.table_sketches} (shortcode, day, registers, visitors, clicks, bot_clicks)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (shortcode, day) DO UPDATE SET
+                registers = COALESCE(excluded.registers, registers),
+                visitors = CASE WHEN excluded.registers IS NULL THEN visitors ELSE excluded.visitors END,
+                clicks = clicks + excluded.clicks,
+                bot_clicks = bot_clicks + excluded.bot_clicks
+        ''', rows)
+        self.sketch_writes += sum(1 for row in rows if row[2] is not None)
+
+    def visitors(self, conn, shortcode, day):
+        # Unique visitor estimates and click counts without bots, all-time
+        # and for day; two primary key lookups.
+        rows = dict((row[0], row[1:]) for row in conn.execute(f'''
+            SELECT day, visitors, clicks, bot_clicks FROM {self.table_sketches}
+            WHERE shortcode = ? AND day IN (?, ?)
+        ''', (shortcode, ALL_TIME, day)))
+        all_time = rows.get(ALL_TIME, (0, 0, 0))
+        return {
+            "unique_visitors": all_time[0],
+            "unique_visitors_today": rows.get(day, (0,))[0],
+            "human_clicks": all_time[1],
+            "bot_clicks": all_time[2]
+        }
+
+    def series(self, conn, shortcode, granularity, since, until):
+        rows = conn.execute(f'''
+            SELECT bucket, clicks, unique_ips
+            FROM {self.table_buckets}
+            WHERE shortcode = ? AND granularity = ? AND bucket BETWEEN ? AND ?
+            ORDER BY bucket
+        ''', (shortcode, granularity, bucket_of(since, granularity), bucket_of(until, granularity))).fetchall()
+        return [{"bucket": row[0], "clicks": row[1], "unique_ips": row[2]} for row in rows]
+
+    def breakdown(self, conn, shortcode, since, until, limit=10):
+        start = bucket_of(since, "day")
+        end = bucket_of(until, "day")
+        referrers = conn.execute(f'''
+            SELECT referrer, SUM(clicks) AS total
+            FROM {self.table_referrers}
+            WHERE shortcode = ? AND day BETWEEN ? AND ?
+            GROUP BY referrer
+            ORDER BY total DESC
+            LIMIT ?
+        ''', (shortcode, start, end, limit)).fetchall()
+        agents = conn.execute(f'''
+            SELECT family, SUM(clicks) AS total
+            FROM {self.table_agents}
+            WHERE shortcode = ? AND day BETWEEN ? AND ?
+            GROUP BY family
+            ORDER BY total DESC
+        ''', (shortcode, start, end)).fetchall()
+        return {
+            "top_referrers": [{"referrer": row[0], "clicks": row[1]} for row in referrers],
+            "user_agents": [{"family": row[0], "clicks": row[1]} for row in agents]
+        }
+
+    def compact(self, conn, visitors_before, hourly_before=None):
+        # Visitor sets are only needed while a bucket can still receive
+        # clicks; the unique counts already stored on the bucket survive.
+        conn.execute(f'''
+            DELETE FROM {self.table_visitors}
+            WHERE bucket < ?
+        ''', (visitors_before,))
+        if hourly_before:
+            conn.execute(f'''
+                DELETE FROM {self.table_buckets}
+                WHERE granularity = 'hour' AND bucket < ?
+            ''', (hourly_before,))
+            # Daily sketches go with the hourly buckets; the all-time sketch
+            # stays.
+            conn.execute(f'''
+                DELETE FROM {self.table_sketches}
+                WHERE day < ? AND day != ?
+            ''', (hourly_before, ALL_TIME))
+
+    def delete(self, conn, shortcode):
+        for table in self._tables():
+            conn.execute(f"DELETE FROM {table} WHERE shortcode = ?", (shortcode,))
+
+    def rename(self, conn, old_code, new_code):
+        for table in self._tables():
+            conn.execute(f"UPDATE {table} SET shortcode = ? WHERE shortcode = ?", (new_code, old_code))
@@ -0,0 +1,221 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("shortener.serve")
+
+
+def init_schema():
+    # Runs in a throwaway child so the master never imports the app; that
+    # keeps reloads honest, since every worker generation imports fresh code.
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            import server
+            server.ensure_tables()
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError("schema initialisation failed")
+
+
+def run_worker(listener, slot, drain_timeout=20):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    code = 0
+    try:
+        from werkzeug.serving import make_server
+        import server
+
+        server.tables_ready = True
+        # Only one worker per generation runs the background maintenance jobs.
+        server.BACKGROUND_JOBS = slot == 0
+        host, port = listener.getsockname()[:2]
+        httpd = make_server(host, port, server.app, threaded=True, fd=listener.fileno())
+        # werkzeug makes request threads daemons, which exit would kill
+        # mid-response; non-daemon ones are tracked so they can be joined.
+        httpd.daemon_threads = False
+
+        def shutdown(signum, frame):
+            threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        server.start_background_tasks()
+        httpd.serve_forever()
+
+        # Requests in flight finish before their clicks are flushed; a
+        # stream still open at the deadline is cut.
+        closing = threading.Thread(target=httpd.server_close, daemon=True)
+        closing.start()
+        closing.join(drain_timeout)
+        if closing.is_alive():
+            logger.warning("worker %d exiting with requests still running", os.getpid())
+        server.stop_background_tasks()
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+class Arbiter:
+    def __init__(self, host, port, workers, graceful_timeout=30):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.listener = None
+        self.children = {}
+        # Workers of a previous generation finishing their requests, with
+        # the time they are killed at.
+        self.retiring = {}
+        self._reload = False
+        self._stopping = False
+
+    def run(self):
+        self.listener = socket.create_server((self.host, self.port), backlog=1024, reuse_port=False)
+        self.listener.set_inheritable(True)
+        init_schema()
+
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "_reload", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "_stopping", True))
+
+        logger.info("listening on http://%s:%d with %d workers", self.host, self.port, self.workers)
+        for slot in range(self.workers):
+            self.spawn(slot)
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self.reload()
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.2)
+
+        self.stop()
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            # Leaves time for the background jobs to stop before the kill.
+            run_worker(self.listener, slot, drain_timeout=self.graceful_timeout * 0.75)
+        self.children[pid] = slot
+        return pid
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is not None and not self._stopping:
+                logger.warning("worker %d exited with %d, respawning", pid, os.waitstatus_to_exitcode(status))
+                self.spawn(slot)
+
+    def kill_overdue(self):
+        now = time.time()
+        for pid, deadline in self.retiring.items():
+            if now >= deadline:
+                logger.warning("worker %d did not finish within %gs, killing it", pid, self.graceful_timeout)
+                self._signal(pid, signal.SIGKILL)
+
+    def reload(self):
+        logger.info("reloading workers")
+        try:
+            init_schema()
+        except RuntimeError:
+            logger.exception("reload aborted, keeping current workers")
+            return
+        old = dict(self.children)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        # The old generation drains while the loop keeps reaping and
+        # respawning the new one.
+        deadline = time.time() + self.graceful_timeout
+        for pid in old:
+            self.children.pop(pid, None)
+            self.retiring[pid] = deadline
+            self._signal(pid, signal.SIGTERM)
+
+    def stop(self):
+        logger.info("shutting down")
+        pids = dict(self.children)
+        self.children.clear()
+        for pid in pids:
+            self._signal(pid, signal.SIGTERM)
+        pids.update(self.retiring)
+        self.retiring.clear()
+        self._wait(pids)
+        self.listener.close()
+
+    def _wait(self, pids):
+        deadline = time.time() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.time() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+            time.sleep(0.05)
+        for pid in remaining:
+            self._signal(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def share_link_changes():
+    # Each worker keeps its own link cache, which only learns about changes
+    # made by other workers through the shared cache's broadcasts or the link
+    # index's delta log. Workers read the settings from the environment.
+    if os.environ.get("SHORTENER_SHARED_CACHE"):
+        return
+    os.environ.setdefault("SHORTENER_LINK_INDEX_DIR", "link_index")
+    if not os.environ["SHORTENER_LINK_INDEX_DIR"]:
+        logger.warning("no link index or shared cache, so workers do not cache links")
+        os.environ["SHORTENER_LINK_CACHE_SIZE"] = "0"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the URL shortener with pre-forked worker processes.")
+    parser.add_argument("--host", default=os.environ.get("SHORTENER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SHORTENER_PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SHORTENER_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--graceful-timeout", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.workers > 1:
+        share_link_changes()
+    Arbiter(args.host, args.port, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,253 @@
-from flask import Flask, redirect, abort, render_template_string, request, jsonify
+from flask import Flask, Response, redirect, abort, render_template, request, jsonify, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-import sqlite3
 import validators
-import qrcode
-from io import BytesIO
 import base64
+import hmac
+import json
 from datetime import datetime
-import secrets
-import string
-from datetime import timedelta
+from datetime import timedelta, timezone
+from functools import wraps
+import os
+import time
+from cache import LinkCache, MISSING
+from clicks import ClickQueue
+from events import ClickFeed
+from db import Database, parse_pragmas
+from export import EXPORT_FORMATS, format_rows
+from codes import create_code_generator
+from qr import QR_FORMATS, QRCache
+from rollups import GRANULARITIES, Rollups
+from retention import Retention
+from expiry import ExpirySweeper
+from metrics import Metrics, SQL_BUCKETS, timed_connection
+from profiling import ProfilerBusy, QueryPlans, SamplingProfiler, SlowRequestLog, collapsed
+from shared_cache import create_shared_cache
+from linkindex import LinkIndex, UNAVAILABLE
+from storage import LINK_FIELDS, CLICK_FIELDS, ShortcodeTaken, CodeUnavailable, DuplicateLink, create_storage
+import ratelimit  # registers the sqlite:// rate limit storage
 
 app = Flask(__name__)
 
+RATELIMIT_STORAGE_URI = os.environ.get("SHORTENER_RATELIMIT_STORAGE", "sqlite:///ratelimits.db")
+
+DEFAULT_RATE_LIMITS = ["2000 per day", "500 per hour"]
+
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    default_limits=["2000 per day", "500 per hour"]
+    default_limits=DEFAULT_RATE_LIMITS,
+    storage_uri=RATELIMIT_STORAGE_URI
 )
 
 DB_FILE = "shortener.db"
 TABLE_URLS = "urls"
 TABLE_ANALYTICS = "analytics"
+TABLE_COUNTERS = "counters"
+
+LINKS_PAGE_SIZE = 50
+LINKS_MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 1000
+BATCH_MAX_LINKS = 100000
+SHORTCODE_MAX_LENGTH = 64
+
+LINK_CACHE_SIZE = int(os.environ.get("SHORTENER_LINK_CACHE_SIZE", 10000))
+NEGATIVE_CACHE_TTL = int(os.environ.get("SHORTENER_NEGATIVE_CACHE_TTL", 30))
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+PERMANENT_REDIRECTS = (301, 308)
+DEFAULT_REDIRECT_STATUS = int(os.environ.get("SHORTENER_REDIRECT_STATUS", 302))
+REDIRECT_MAX_AGE = int(os.environ.get("SHORTENER_REDIRECT_MAX_AGE", 86400))
+
+SHARED_CACHE_URL = os.environ.get("SHORTENER_SHARED_CACHE", "")
+SHARED_CACHE_TTL = int(os.environ.get("SHORTENER_SHARED_CACHE_TTL", 300))
+
+CLICK_BATCH_SIZE = int(os.environ.get("SHORTENER_CLICK_BATCH_SIZE", 500))
+CLICK_FLUSH_INTERVAL = float(os.environ.get("SHORTENER_CLICK_FLUSH_INTERVAL", 0.5))
+CLICK_QUEUE_SIZE = int(os.environ.get("SHORTENER_CLICK_QUEUE_SIZE", 100000))
+
+CODE_STRATEGY = os.environ.get("SHORTENER_CODE_STRATEGY", "random")
+CODE_LENGTH = int(os.environ.get("SHORTENER_CODE_LENGTH", 6))
+CODE_GROW_AT = float(os.environ.get("SHORTENER_CODE_GROW_AT", 0.01))
+CODE_OBFUSCATE = os.environ.get("SHORTENER_CODE_OBFUSCATE", "1") == "1"
+CODE_ATTEMPTS = 5
+
+DEDUP_URLS = os.environ.get("SHORTENER_DEDUP_URLS", "0") == "1"
+
+SEARCH_ENABLED = os.environ.get("SHORTENER_SEARCH", "1") == "1"
+SEARCH_MAX_QUERY = 200
+
+QR_CACHE_DIR = os.environ.get("SHORTENER_QR_CACHE_DIR", "qr_cache")
+QR_CACHE_BYTES = int(os.environ.get("SHORTENER_QR_CACHE_BYTES", 16 * 1024 * 1024))
+QR_CACHE_FILES = int(os.environ.get("SHORTENER_QR_CACHE_FILES", 10000))
+QR_PRERENDER = os.environ.get("SHORTENER_QR_PRERENDER", "0") == "1"
+QR_DEFAULT_SIZE = 300
+QR_MIN_SIZE = 64
+QR_MAX_SIZE = 2048
+QR_MAX_AGE = 86400
+
+BACKGROUND_JOBS = os.environ.get("SHORTENER_BACKGROUND_JOBS", "1") == "1"
+
+ANALYTICS_ARCHIVE_DIR = os.environ.get("SHORTENER_ANALYTICS_ARCHIVE_DIR", "analytics_archive")
+ANALYTICS_RETENTION_MONTHS = int(os.environ.get("SHORTENER_ANALYTICS_RETENTION_MONTHS", 12))
+ANALYTICS_RETENTION_INTERVAL = int(os.environ.get("SHORTENER_ANALYTICS_RETENTION_INTERVAL", 3600))
+
+STORAGE_BACKEND = os.environ.get("SHORTENER_STORAGE", "sqlite")
+CLICK_LOG_DIR = os.environ.get("SHORTENER_CLICK_LOG_DIR", "click_log")
+
+LINK_INDEX_DIR = os.environ.get("SHORTENER_LINK_INDEX_DIR", "")
+LINK_INDEX_MAX_DELTA = int(os.environ.get("SHORTENER_LINK_INDEX_MAX_DELTA", 10000))
+LINK_INDEX_COMPACT_INTERVAL = int(os.environ.get("SHORTENER_LINK_INDEX_COMPACT_INTERVAL", 60))
+
+EXPIRY_MODE = os.environ.get("SHORTENER_EXPIRY_MODE", "archive")
+EXPIRY_GRACE = int(os.environ.get("SHORTENER_EXPIRY_GRACE", 86400))
+EXPIRY_INTERVAL = int(os.environ.get("SHORTENER_EXPIRY_INTERVAL", 60))
+EXPIRY_BATCH_SIZE = int(os.environ.get("SHORTENER_EXPIRY_BATCH_SIZE", 500))
+
+EVENTS_POLL_INTERVAL = float(os.environ.get("SHORTENER_EVENTS_POLL_INTERVAL", 5))
+EVENTS_MAX_AGE = int(os.environ.get("SHORTENER_EVENTS_MAX_AGE", 300))
+
+DB_POOL_SIZE = int(os.environ.get("SHORTENER_DB_POOL_SIZE", 8))
+DB_PRAGMAS = parse_pragmas(os.environ.get("SHORTENER_SQLITE_PRAGMAS"))
+
+METRICS_ENABLED = os.environ.get("SHORTENER_METRICS", "1") == "1"
+
+ADMIN_TOKEN = os.environ.get("SHORTENER_ADMIN_TOKEN", "")
+SLOW_REQUEST_MS = float(os.environ.get("SHORTENER_SLOW_REQUEST_MS", 0))
+PROFILE_MAX_SECONDS = int(os.environ.get("SHORTENER_PROFILE_MAX_SECONDS", 60))
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_DEFAULT_INTERVAL_MS = 5
+
+metrics = Metrics()
+request_count = metrics.counter(
+    "http_requests_total", "Requests by route and status.", ("method", "route", "status")
+)
+request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "Time until the response headers, by route.", ("method", "route")
+)
+sql_seconds = metrics.histogram(
+    "db_statement_duration_seconds", "SQLite execute, executemany and commit time by statement.",
+    ("statement",), buckets=SQL_BUCKETS
+)
+connect_seconds = metrics.histogram(
+    "db_connect_duration_seconds", "Time to open a pooled SQLite connection.", buckets=SQL_BUCKETS
+)
+rate_limited = metrics.counter("rate_limited_total", "Requests rejected by the rate limiter.", ("route",))
+
+profiler = SamplingProfiler(max_seconds=PROFILE_MAX_SECONDS)
+slow_requests = SlowRequestLog(SLOW_REQUEST_MS / 1000, plans=QueryPlans()) if SLOW_REQUEST_MS > 0 else None
+
+db = Database(
+    DB_FILE,
+    pragmas=DB_PRAGMAS,
+    pool_size=DB_POOL_SIZE,
+    **({"factory": timed_connection(
+        sql_seconds if METRICS_ENABLED else None,
+        connect_seconds if METRICS_ENABLED else None,
+        tracer=slow_requests.statement if slow_requests else None
+    )} if METRICS_ENABLED or slow_requests else {})
+)
+code_generator = create_code_generator(
+    CODE_STRATEGY,
+    TABLE_COUNTERS,
+    length=CODE_LENGTH,
+    **({"grow_at": CODE_GROW_AT} if CODE_STRATEGY == "random" else {"obfuscate": CODE_OBFUSCATE})
+)
+rollups = Rollups(TABLE_ANALYTICS)
+link_index = LinkIndex(LINK_INDEX_DIR, max_delta=LINK_INDEX_MAX_DELTA) if LINK_INDEX_DIR else None
+storage = create_storage(
+    STORAGE_BACKEND,
+    db,
+    TABLE_URLS,
+    TABLE_ANALYTICS,
+    TABLE_COUNTERS,
+    code_generator,
+    rollups,
+    attempts=CODE_ATTEMPTS,
+    link_index=link_index,
+    search=SEARCH_ENABLED,
+    **({"log_dir": CLICK_LOG_DIR} if STORAGE_BACKEND == "log" else {})
+)
+retention = Retention(
+    db,
+    TABLE_ANALYTICS,
+    rollups,
+    ANALYTICS_ARCHIVE_DIR,
+    retention_months=ANALYTICS_RETENTION_MONTHS,
+    interval=ANALYTICS_RETENTION_INTERVAL,
+    click_log=storage if STORAGE_BACKEND == "log" else None,
+    table_orphans=storage.table_orphans,
+    table_renames=storage.table_renames
+)
+expiry_sweeper = ExpirySweeper(
+    storage,
+    mode=EXPIRY_MODE,
+    grace=EXPIRY_GRACE,
+    interval=EXPIRY_INTERVAL,
+    batch_size=EXPIRY_BATCH_SIZE
+) if EXPIRY_MODE != "off" else None
+qr_cache = QRCache(QR_CACHE_DIR, max_bytes=QR_CACHE_BYTES, max_files=QR_CACHE_FILES)
+link_cache = LinkCache(max_size=LINK_CACHE_SIZE, negative_ttl=NEGATIVE_CACHE_TTL)
+shared_cache = create_shared_cache(SHARED_CACHE_URL)
+click_feed = ClickFeed(
+    storage,
+    poll_interval=EVENTS_POLL_INTERVAL,
+    max_age=EVENTS_MAX_AGE,
+    max_codes=LINKS_MAX_PAGE_SIZE
+)
+click_queue = ClickQueue(
+    storage,
+    batch_size=CLICK_BATCH_SIZE,
+    flush_interval=CLICK_FLUSH_INTERVAL,
+    max_size=CLICK_QUEUE_SIZE,
+    hooks=[rollups.apply],
+    listeners=[click_feed.notify]
+)
+
+def cache_lookups():
+    link = link_cache.stats()
+    qr = qr_cache.stats()
+    lookups = {
+        ("link", "hit"): link["hits"],
+        ("link", "miss"): link["misses"],
+        ("qr", "hit"): qr["memory_hits"] + qr["disk_hits"],
+        ("qr", "miss"): qr["renders"]
+    }
+    if shared_cache:
+        shared = shared_cache.stats()
+        lookups[("shared", "hit")] = shared["hits"]
+        lookups[("shared", "miss")] = shared["misses"]
+    return lookups
+
+def cache_hit_ratios():
+    lookups = cache_lookups()
+    ratios = {}
+    for cache in {cache for cache, _ in lookups}:
+        total = lookups[(cache, "hit")] + lookups[(cache, "miss")]
+        ratios[(cache,)] = lookups[(cache, "hit")] / total if total else None
+    return ratios
+
+def db_connections():
+    stats = db.stats()
+    return {
+        (kind, state): stats[kind][state]
+        for kind in ("read", "write")
+        for state in ("in_use", "idle")
+    }
+
+def click_events():
+    stats = click_queue.stats()
+    return {(outcome,): stats[outcome] for outcome in ("enqueued", "flushed", "dropped", "failed")}
+
+# Read from the components' stats() at scrape time.
+metrics.callback("cache_lookups_total", "Cache lookups by cache and result.", cache_lookups,
+                 ("cache", "result"), kind="counter")
+metrics.callback("cache_hit_ratio", "Hits over lookups since start, by cache.", cache_hit_ratios, ("cache",))
+metrics.callback("click_queue_depth", "Click events waiting to be written.", click_queue.depth)
+metrics.callback("click_events_total", "Click events by outcome.", click_events, ("outcome",), kind="counter")
+metrics.callback("db_connections", "Pooled SQLite connections by kind and state.", db_connections,
+                 ("kind", "state"))
+metrics.callback("links", "Links stored.", storage.count_links)
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -200,64 +426,71 @@ HTML_TEMPLATE = """
             <div class="d-flex justify-content-between align-items-center mb-3">
                 <h5 class="mb-0"><i class="bi bi-list-ul me-2"></i>Your Links</h5>
                 <div class="d-flex align-items-center">
-                    <span class="badge bg-secondary me-2">{{ link_count }} links</span>
+                    <span class="badge bg-secondary me-2"><span id="link-count">{{ link_count }}</span> links</span>
                     <button class="btn btn-sm btn-outline-secondary" onclick="refreshStats()">
                         <i class="bi bi-arrow-clockwise"></i>
                     </button>
                 </div>
             </div>
             
-            {% if links %}
-                <div class="list-group" id="links-list">
-                    {% for link in links %}
-                        <div class="list-group-item" id="link-{{ link.shortcode }}">
-                            <div class="d-flex flex-column flex-md-row justify-content-between align-items-md-center">
-                                <div class="mb-2 mb-md-0" style="flex: 1; min-width: 0;">
-                                    <div class="d-flex align-items-center">
-                                        <a href="/{{ link.shortcode }}" class="shortcode text-truncate me-2" 
-                                           style="display: block; max-width: 150px;" 
-                                           title="/{{ link.shortcode }}" data-code="{{ link.shortcode }}">
-                                            /{{ link.shortcode }}
-                                        </a>
-                                        <span class="badge bg-info text-dark">{{ link.clicks }} clicks</span>
-                                        {% if link.expires_at and link.expires_at < now %}
-                                            <span class="badge bg-danger ms-2">Expired</span>
-                                        {% endif %}
-                                    </div>
-                                    <div class="text-truncate text-muted small" style="max-width: 400px;">
-                                        {{ link.original_url }}
-                                    </div>
-                                    <div class="small mt-1">
-                                        <span class="text-muted">Created: {{ link.created_at }}</span>
-                                        {% if link.expires_at %}
-                                            <span class="text-muted ms-2">Expires: {{ link.expires_at }}</span>
-                                        {% endif %}
-                                    </div>
-                                </div>
-                                <div class="d-flex flex-column flex-sm-row align-items-start align-items-md-center gap-2">
-                                    <button class="btn btn-sm btn-outline-primary" onclick="copyToClipboard('{{ link.shortcode }}')">
-                                        <i class="bi bi-clipboard"></i>
-                                    </button>
-                                    <button class="btn btn-sm btn-outline-success" onclick="showQR('{{ link.shortcode }}')">
-                                        <i class="bi bi-qr-code"></i>
-                                    </button>
-                                    <button class="btn btn-sm btn-outline-warning" onclick="startEdit('{{ link.shortcode }}')">
-                                        <i class="bi bi-pencil"></i>
-                                    </button>
-                                    <button class="btn btn-sm btn-outline-danger" onclick="deleteLink('{{ link.shortcode }}')">
-                                        <i class="bi bi-trash"></i>
-                                    </button>
-                                </div>
+            <div class="input-group input-group-sm mb-3">
+                <span class="input-group-text"><i class="bi bi-search"></i></span>
+                <input type="search" class="form-control" id="link-search" autocomplete="off"
+                       placeholder="Search by short code, domain or URL">
+            </div>
+            
+            {% macro link_row(link) %}
+                <div class="list-group-item link-row" id="link-{{ link.shortcode }}" data-code="{{ link.shortcode }}">
+                    <div class="d-flex flex-column flex-md-row justify-content-between align-items-md-center">
+                        <div class="mb-2 mb-md-0" style="flex: 1; min-width: 0;">
+                            <div class="d-flex align-items-center">
+                                <a href="/{{ link.shortcode }}" class="shortcode text-truncate me-2 link-code" 
+                                   style="display: block; max-width: 150px;" 
+                                   title="/{{ link.shortcode }}">/{{ link.shortcode }}</a>
+                                <span class="badge bg-info text-dark"><span class="link-clicks">{{ link.clicks }}</span> clicks</span>
+                                <span class="badge bg-danger ms-2 link-expired" {% if not (link.expires_at and link.expires_at < now) %}hidden{% endif %}>Expired</span>
+                            </div>
+                            <div class="text-truncate text-muted small link-url" style="max-width: 400px;">{{ link.original_url }}</div>
+                            <div class="small mt-1">
+                                <span class="text-muted">Created: <span class="link-created">{{ link.created_at }}</span></span>
+                                <span class="text-muted ms-2 link-expires-label" {% if not link.expires_at %}hidden{% endif %}>Expires: <span class="link-expires">{{ link.expires_at }}</span></span>
                             </div>
                         </div>
-                    {% endfor %}
-                </div>
-            {% else %}
-                <div class="text-center py-4">
-                    <i class="bi bi-link-45deg text-muted" style="font-size: 2rem;"></i>
-                    <p class="text-muted mt-2">No short links created yet</p>
+                        <div class="d-flex flex-column flex-sm-row align-items-start align-items-md-center gap-2">
+                            <button class="btn btn-sm btn-outline-primary" data-action="copy">
+                                <i class="bi bi-clipboard"></i>
+                            </button>
+                            <button class="btn btn-sm btn-outline-success" data-action="qr">
+                                <i class="bi bi-qr-code"></i>
+                            </button>
+                            <button class="btn btn-sm btn-outline-warning" data-action="edit">
+                                <i class="bi bi-pencil"></i>
+                            </button>
+                            <button class="btn btn-sm btn-outline-danger" data-action="delete">
+                                <i class="bi bi-trash"></i>
+                            </button>
+                        </div>
+                    </div>
                 </div>
-            {% endif %}
+            {% endmacro %}
+            
+            <div class="list-group" id="links-list">
+                {% for link in links %}
+                    {{ link_row(link) }}
+                {% endfor %}
+            </div>
+            {# Rows added by the dashboard script are cloned from this. #}
+            <template id="link-row-template">{{ link_row({}) }}</template>
+            <div class="text-center mt-3" id="load-more" {% if not next_cursor %}hidden{% endif %}>
+                <a href="/?cursor={{ next_cursor or '' }}" class="btn btn-sm btn-outline-secondary" id="load-more-button"
+                   data-cursor="{{ next_cursor or '' }}">
+                    Older links <i class="bi bi-chevron-right"></i>
+                </a>
+            </div>
+            <div class="text-center py-4" id="links-empty" {% if links %}hidden{% endif %}>
+                <i class="bi bi-link-45deg text-muted" style="font-size: 2rem;"></i>
+                <p class="text-muted mt-2" id="links-empty-text">No short links created yet</p>
+            </div>
         </div>
     </div>
     
@@ -357,7 +590,7 @@ HTML_TEMPLATE = """
             const qrLink = document.getElementById('qrLink');
             const downloadQR = document.getElementById('downloadQR');
             
-            qrImage.src = `https://api.qrserver.com/v1/create-qr-code/?size=300x300&data=${encodeURIComponent(url)}`;
+            qrImage.src = `/api/qr/${encodeURIComponent(code)}/image?size=300`;
             qrLink.value = url;
             downloadQR.href = qrImage.src;
             
@@ -372,7 +605,151 @@ HTML_TEMPLATE = """
             showToast('Copied to clipboard!');
         }
         
-        async function deleteLink(code) {
+        const linksList = document.getElementById('links-list');
+        const rowTemplate = document.getElementById('link-row-template');
+        const pageSize = {{ page_size }};
+        const maxEventCodes = {{ max_event_codes }};
+        let events = null;
+        
+        function rowFor(code) {
+            return document.getElementById(`link-${code}`);
+        }
+        
+        function localTimestamp() {
+            const d = new Date();
+            const pad = (n) => String(n).padStart(2, '0');
+            return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())} ` +
+                `${pad(d.getHours())}:${pad(d.getMinutes())}:${pad(d.getSeconds())}`;
+        }
+        
+        function fillRow(row, link) {
+            const code = link.shortcode;
+            const anchor = row.querySelector('.link-code');
+            row.id = `link-${code}`;
+            row.dataset.code = code;
+            anchor.href = `/${code}`;
+            anchor.title = anchor.textContent = `/${code}`;
+            row.querySelector('.link-clicks').textContent = link.clicks;
+            row.querySelector('.link-url').textContent = link.original_url;
+            row.querySelector('.link-created').textContent = link.created_at;
+            row.querySelector('.link-expires').textContent = link.expires_at || '';
+            row.querySelector('.link-expires-label').hidden = !link.expires_at;
+            row.querySelector('.link-expired').hidden = !(link.expires_at && link.expires_at < localTimestamp());
+            return row;
+        }
+        
+        function renderLink(link) {
+            return fillRow(rowTemplate.content.firstElementChild.cloneNode(true), link);
+        }
+        
+        async function fetchLink(code) {
+            const response = await fetch(`/api/links/${encodeURIComponent(code)}`);
+            if (!response.ok) return null;
+            const link = await response.json();
+            return { ...link, original_url: link.url };
+        }
+        
+        function setLinkCount(count) {
+            document.getElementById('link-count').textContent = count;
+            document.getElementById('links-empty').hidden = linksList.children.length > 0;
+        }
+        
+        function setCursor(cursor) {
+            const button = document.getElementById('load-more-button');
+            const params = new URLSearchParams(window.location.search);
+            params.set('cursor', cursor || '');
+            button.dataset.cursor = cursor || '';
+            button.href = `/?${params}`;
+            document.getElementById('load-more').hidden = !cursor;
+        }
+        
+        let searchQuery = '';
+        let searchTimer = null;
+        
+        function pageUrl(cursor) {
+            // Search results when there is a query, otherwise the list with
+            // whatever status/created_after filters the page was opened with.
+            const params = searchQuery ? new URLSearchParams({ q: searchQuery })
+                                       : new URLSearchParams(window.location.search);
+            if (cursor) params.set('cursor', cursor);
+            else params.delete('cursor');
+            params.set('limit', pageSize);
+            return `${searchQuery ? '/api/search' : '/api/links'}?${params}`;
+        }
+        
+        async function search(query) {
+            searchQuery = query;
+            try {
+                const response = await fetch(pageUrl(null));
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                
+                const page = await response.json();
+                if (query !== searchQuery) return;
+                linksList.replaceChildren(...page.links.map(renderLink));
+                document.getElementById('links-empty-text').textContent =
+                    query ? 'No links match your search' : 'No short links created yet';
+                setCursor(page.next_cursor);
+                setLinkCount(page.total ?? Number(document.getElementById('link-count').textContent));
+                connectEvents();
+            } catch (error) {
+                console.error('Error:', error);
+                showToast('Search failed', 'danger');
+            }
+        }
+        
+        document.getElementById('link-search').addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            const query = this.value.trim();
+            searchTimer = setTimeout(() => search(query), 250);
+        });
+        
+        async function loadMore() {
+            const button = document.getElementById('load-more-button');
+            const cursor = button.dataset.cursor;
+            if (!cursor || button.classList.contains('disabled')) return;
+            
+            button.classList.add('disabled');
+            try {
+                const query = searchQuery;
+                const response = await fetch(pageUrl(cursor));
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                
+                const page = await response.json();
+                if (query !== searchQuery) return;
+                for (const link of page.links) {
+                    if (!rowFor(link.shortcode)) linksList.appendChild(renderLink(link));
+                }
+                setCursor(page.next_cursor);
+                if (page.total !== undefined) setLinkCount(page.total);
+                connectEvents();
+            } catch (error) {
+                console.error('Error:', error);
+                showToast('Failed to load links', 'danger');
+            } finally {
+                button.classList.remove('disabled');
+            }
+        }
+        
+        function connectEvents() {
+            // One stream per page, reopened whenever the set of rows changes;
+            // its first event carries the current count for every row.
+            if (events) events.close();
+            events = null;
+            
+            const codes = [...linksList.children].map(row => row.dataset.code).slice(0, maxEventCodes);
+            if (!codes.length || !window.EventSource) return;
+            
+            events = new EventSource(`/api/events?codes=${encodeURIComponent(codes.join(','))}`);
+            events.addEventListener('clicks', (e) => {
+                for (const [code, clicks] of Object.entries(JSON.parse(e.data))) {
+                    const row = rowFor(code);
+                    if (row && clicks !== null) row.querySelector('.link-clicks').textContent = clicks;
+                }
+            });
+        }
+        
+        async function deleteLink(row) {
+            const code = row.dataset.code;
             if (!confirm(`Are you sure you want to delete /${code}?`)) return;
             
             try {
@@ -382,7 +759,9 @@ HTML_TEMPLATE = """
                 });
                 
                 if (response.ok) {
-                    document.getElementById(`link-${code}`).remove();
+                    row.remove();
+                    setLinkCount(Number(document.getElementById('link-count').textContent) - 1);
+                    connectEvents();
                     showToast('Link deleted successfully');
                 } else {
                     const error = await response.json();
@@ -394,33 +773,40 @@ HTML_TEMPLATE = """
             }
         }
         
-        function startEdit(code) {
-            const li = document.getElementById(`link-${code}`);
-            const url = li.querySelector('.text-muted').textContent.trim();
+        function startEdit(row) {
+            if (row.querySelector('.link-edit')) return;
             
-            li.innerHTML = `
+            const form = document.createElement('div');
+            form.className = 'link-edit';
+            form.innerHTML = `
                 <div class="mb-3">
                     <label class="form-label">Short Code</label>
-                    <input type="text" id="edit-code-${code}" class="form-control" value="${code}">
+                    <input type="text" class="form-control edit-code">
                 </div>
                 <div class="mb-3">
                     <label class="form-label">Destination URL</label>
-                    <input type="url" id="edit-url-${code}" class="form-control" value="${url}">
+                    <input type="url" class="form-control edit-url">
                 </div>
                 <div class="d-flex justify-content-end gap-2">
-                    <button class="btn btn-secondary" onclick="cancelEdit('${code}')">Cancel</button>
-                    <button class="btn btn-primary" onclick="saveEdit('${code}')">Save Changes</button>
+                    <button class="btn btn-secondary" data-action="cancel">Cancel</button>
+                    <button class="btn btn-primary" data-action="save">Save Changes</button>
                 </div>
             `;
+            form.querySelector('.edit-code').value = row.dataset.code;
+            form.querySelector('.edit-url').value = row.querySelector('.link-url').textContent.trim();
+            row.firstElementChild.classList.add('d-none');
+            row.appendChild(form);
         }
         
-        function cancelEdit(code) {
-            window.location.reload();
+        function cancelEdit(row) {
+            row.querySelector('.link-edit').remove();
+            row.firstElementChild.classList.remove('d-none');
         }
         
-        async function saveEdit(oldCode) {
-            const newCode = document.getElementById(`edit-code-${oldCode}`).value.trim();
-            const newUrl = document.getElementById(`edit-url-${oldCode}`).value.trim();
+        async function saveEdit(row) {
+            const oldCode = row.dataset.code;
+            const newCode = row.querySelector('.edit-code').value.trim();
+            const newUrl = row.querySelector('.edit-url').value.trim();
             
             if (!newCode || !newUrl) {
                 showToast('Code and URL cannot be empty', 'danger');
@@ -432,14 +818,19 @@ HTML_TEMPLATE = """
                     method: 'PUT',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ 
-                        new_code: newCode, 
+                        new_code: newCode !== oldCode ? newCode : undefined, 
                         new_url: newUrl 
                     })
                 });
                 
                 if (response.ok) {
+                    // The server may normalise a new code, so use the one it kept.
+                    const { code } = await response.json();
+                    const link = await fetchLink(code);
+                    if (link) fillRow(row, link);
+                    cancelEdit(row);
+                    if (code !== oldCode) connectEvents();
                     showToast('Link updated successfully');
-                    setTimeout(() => window.location.reload(), 1000);
                 } else {
                     const error = await response.json();
                     showToast(error.error || 'Failed to update link', 'danger');
@@ -450,24 +841,43 @@ HTML_TEMPLATE = """
             }
         }
         
-        async function refreshStats() {
-            try {
-                const response = await fetch('/api/links');
-                if (response.ok) {
-                    window.location.reload();
-                } else {
-                    showToast('Failed to refresh', 'danger');
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                showToast('Failed to refresh', 'danger');
-            }
+        function refreshStats() {
+            connectEvents();
+            showToast('Click counts refreshed');
+        }
+        
+        linksList.addEventListener('click', function(e) {
+            const button = e.target.closest('[data-action]');
+            if (!button) return;
+            
+            const row = button.closest('.link-row');
+            const actions = {
+                copy: () => copyToClipboard(row.dataset.code),
+                qr: () => showQR(row.dataset.code),
+                edit: () => startEdit(row),
+                delete: () => deleteLink(row),
+                cancel: () => cancelEdit(row),
+                save: () => saveEdit(row)
+            };
+            actions[button.dataset.action]();
+        });
+        
+        document.getElementById('load-more-button').addEventListener('click', function(e) {
+            e.preventDefault();
+            loadMore();
+        });
+        
+        if (window.IntersectionObserver) {
+            new IntersectionObserver((entries) => {
+                if (entries.some(entry => entry.isIntersecting)) loadMore();
+            }).observe(document.getElementById('load-more'));
         }
         
         document.getElementById('create-form').addEventListener('submit', async function(e) {
             e.preventDefault();
             
-            const formData = new FormData(this);
+            const form = this;
+            const formData = new FormData(form);
             const url = formData.get('url');
             const code = formData.get('code');
             const expiry = formData.get('expiry');
@@ -480,8 +890,15 @@ HTML_TEMPLATE = """
                 });
                 
                 if (response.ok) {
+                    const created = await response.json();
+                    const link = await fetchLink(created.shortcode);
+                    if (link && !rowFor(link.shortcode)) {
+                        linksList.prepend(renderLink(link));
+                        setLinkCount(Number(document.getElementById('link-count').textContent) + 1);
+                        connectEvents();
+                    }
+                    form.reset();
                     showToast('Short link created!');
-                    setTimeout(() => window.location.reload(), 1000);
                 } else {
                     const error = await response.json();
                     showToast(error.error || 'Failed to create link', 'danger');
@@ -493,48 +910,17 @@ HTML_TEMPLATE = """
         });
         
         document.addEventListener('DOMContentLoaded', applySavedMode);
+        connectEvents();
     </script>
 </body>
 </html>
 """
 
-def ensure_tables():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS {TABLE_URLS} (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            original_url TEXT NOT NULL,
-            shortcode TEXT NOT NULL UNIQUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP NULL,
-            clicks INTEGER DEFAULT 0
-        )
-    ''')
-    
-    cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS {TABLE_ANALYTICS} (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            shortcode TEXT NOT NULL,
-            ip_address TEXT,
-            user_agent TEXT,
-            referrer TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (shortcode) REFERENCES {TABLE_URLS}(shortcode)
-        )
-    ''')
-    
-    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_shortcode ON {TABLE_URLS}(shortcode)')
-    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_expires ON {TABLE_URLS}(expires_at)')
-    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_analytics_shortcode ON {TABLE_ANALYTICS}(shortcode)')
-    
-    conn.commit()
-    conn.close()
+# Parsed once; render_template_string would compile it on every view.
+DASHBOARD_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
 
-def generate_random_code(length=6):
-    chars = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(chars) for _ in range(length))
+def ensure_tables():
+    storage.create_tables()
 
 def validate_url(url):
     if not url:
@@ -549,7 +935,7 @@ def validate_url(url):
     return url
 
 def validate_shortcode(code):
-    if not code:
+    if not code or len(code) > SHORTCODE_MAX_LENGTH:
         return None
     
     if not all(c.isalnum() or c in ('-', '_') for c in code):
@@ -558,182 +944,557 @@ def validate_shortcode(code):
     return code.lower()
 
 def record_click(shortcode, request):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute(f'''
-        UPDATE {TABLE_URLS} 
-        SET clicks = clicks + 1 
-        WHERE shortcode = ?
-    ''', (shortcode,))
-    
-    cursor.execute(f'''
-        INSERT INTO {TABLE_ANALYTICS} 
-        (shortcode, ip_address, user_agent, referrer)
-        VALUES (?, ?, ?, ?)
-    ''', (
+    click_queue.record(
         shortcode,
         request.remote_addr,
         request.user_agent.string,
         request.referrer
-    ))
+    )
+
+def parse_link_request(data):
+    if not isinstance(data, dict) or not data.get('url'):
+        return None, "Missing URL"
+    
+    url = validate_url(data['url'])
+    if not url:
+        return None, "Invalid URL"
+    
+    code = None
+    if data.get('code'):
+        code = validate_shortcode(data['code'])
+        if not code:
+            return None, "Invalid short code"
+    
+    try:
+        expiry_days = int(data.get('expiry') or 0)
+    except (TypeError, ValueError):
+        return None, "Invalid expiry"
+    
+    expires_at = None
+    if expiry_days > 0:
+        expires_at = (datetime.now() + timedelta(days=expiry_days)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    redirect_status, error = parse_redirect_status(data.get('redirect'))
+    if error:
+        return None, error
     
-    conn.commit()
-    conn.close()
+    return {"url": url, "code": code, "expires_at": expires_at, "redirect": redirect_status}, None
 
-def get_links():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+def parse_redirect_status(value):
+    if value is None:
+        return None, None
     
-    cursor.execute(f'''
-        SELECT shortcode, original_url, clicks, created_at, expires_at
-        FROM {TABLE_URLS}
-        ORDER BY created_at DESC
-    ''')
+    try:
+        status = int(value)
+    except (TypeError, ValueError):
+        status = None
     
-    links = []
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if status not in REDIRECT_STATUSES:
+        return None, "Redirect must be one of 301, 302, 307 or 308"
     
-    for row in cursor.fetchall():
-        links.append({
-            'shortcode': row[0],
-            'original_url': row[1],
-            'clicks': row[2],
-            'created_at': row[3],
-            'expires_at': row[4],
-            'is_expired': row[4] and row[4] < now
-        })
+    return status, None
+
+def parse_flag(name, value, default):
+    # JSON booleans, or 1/0 and true/false as numbers or strings, so a query
+    # string and a JSON body say the same thing the same way.
+    if value is None:
+        return default, None
+    if isinstance(value, bool):
+        return value, None
+    if isinstance(value, (int, str)):
+        text = str(value).strip().lower()
+        if text in ("1", "true"):
+            return True, None
+        if text in ("0", "false"):
+            return False, None
+    return None, f"{name} must be true or false"
+
+def read_batch_items():
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
     
-    conn.close()
-    return links
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('links')
+    return data if isinstance(data, list) else None
+
+def encode_cursor(created_at, link_id):
+    raw = json.dumps([created_at, link_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, link_id = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    
+    if not isinstance(created_at, str) or not isinstance(link_id, int):
+        return None
+    
+    return created_at, link_id
+
+def encode_search_cursor(offset):
+    # Search results are ranked, not ordered by a column, so their cursor is
+    # an offset into the ranking.
+    return base64.urlsafe_b64encode(json.dumps([offset]).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_search_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        offset, = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    
+    if not isinstance(offset, int) or offset < 0:
+        return None
+    
+    return offset
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+def get_link_count():
+    return storage.count_links()
+
+def get_links(limit=LINKS_PAGE_SIZE, cursor=None, status=None, created_after=None):
+    links, next_key = storage.list_links(limit, cursor, status, created_after)
+    return links, encode_cursor(*next_key) if next_key else None
+
+def parse_links_query(args):
+    try:
+        limit = int(args.get('limit', LINKS_PAGE_SIZE))
+    except ValueError:
+        return None, "Invalid limit"
+    
+    if limit < 1 or limit > LINKS_MAX_PAGE_SIZE:
+        return None, f"Limit must be between 1 and {LINKS_MAX_PAGE_SIZE}"
+    
+    cursor = None
+    if args.get('cursor'):
+        cursor = decode_cursor(args['cursor'])
+        if cursor is None:
+            return None, "Invalid cursor"
+    
+    status = args.get('status') or None
+    if status not in (None, 'active', 'expired'):
+        return None, "Invalid status"
+    
+    created_after = None
+    if args.get('created_after'):
+        created_after = parse_timestamp(args['created_after'])
+        if created_after is None:
+            return None, "Invalid created_after"
+    
+    return {
+        'limit': limit,
+        'cursor': cursor,
+        'status': status,
+        'created_after': created_after
+    }, None
 
 def generate_qr_code(url):
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
+    _, image = qr_cache.get(url, QR_DEFAULT_SIZE, "png")
+    return base64.b64encode(image).decode('utf-8')
+
+def prerender_qr_codes(codes):
+    for code in codes:
+        for fmt in QR_FORMATS:
+            qr_cache.get(f"{request.host_url}{code}", QR_DEFAULT_SIZE, fmt)
+
+tables_ready = False
+
+@app.before_request
+def start_background_tasks():
+    global tables_ready
+    if not tables_ready:
+        ensure_tables()
+        tables_ready = True
     
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    if shared_cache:
+        shared_cache.start()
+    if BACKGROUND_JOBS:
+        retention.start()
+        if expiry_sweeper:
+            expiry_sweeper.start()
+        if link_index:
+            link_index.start(storage.rebuild_index, LINK_INDEX_COMPACT_INTERVAL)
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+def observe_request(method, route, status, seconds):
+    request_count.inc(method, route, str(status))
+    request_seconds.observe(seconds, method, route)
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        # Streaming responses (exports, events) are timed to their headers.
+        started = g.get('request_started')
+        if started is not None:
+            observe_request(request.method, route_label(), response.status_code, time.perf_counter() - started)
+        return response
+
+if slow_requests:
+    @app.before_request
+    def start_request_trace():
+        g.request_trace = slow_requests.begin()
+        g.request_trace_started = time.perf_counter()
+    
+    @app.after_request
+    def finish_request_trace(response):
+        slow_requests.detach()
+        trace = g.get('request_trace')
+        if trace is not None:
+            slow_requests.finish(trace, request.method, request.path, response.status_code,
+                                 time.perf_counter() - g.request_trace_started)
+        return response
+
+def admin_only(view):
+    # The admin endpoints only exist when SHORTENER_ADMIN_TOKEN is set, and
+    # want it as a bearer token.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            abort(404)
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+            return jsonify({"error": "Admin token required"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def stop_background_tasks():
+    retention.stop()
+    if expiry_sweeper:
+        expiry_sweeper.stop()
+    click_queue.stop()
+    if link_index:
+        link_index.stop()
+    if shared_cache:
+        shared_cache.close()
+
+def drop_local_links(codes):
+    # Invalidations published by any node, including this one.
+    if codes is None:
+        link_cache.clear()
+    else:
+        link_cache.invalidate(*codes)
+
+if shared_cache:
+    shared_cache.subscribe(drop_local_links)
+if link_index:
+    link_index.subscribe(drop_local_links)
+
+def invalidate_links(*codes):
+    link_cache.invalidate(*codes)
+    if shared_cache:
+        shared_cache.invalidate(*codes)
+
+def link_changed(changes):
+    # Storage change events: drop every cached copy of the changed codes and
+    # let retention follow deletes and renames into the archives.
+    invalidate_links(*{change.code for change in changes})
+    if any(change.renamed_from or change.url is None for change in changes):
+        retention.wake()
+
+storage.subscribe(link_changed)
+if expiry_sweeper:
+    storage.subscribe(expiry_sweeper.schedule)
 
 @app.route("/")
 def home():
-    ensure_tables()
-    links = get_links()
+    query, error = parse_links_query(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    # Only the first page is rendered here; the dashboard pages through
+    # /api/links and gets click counts from /api/events.
+    links, next_cursor = get_links(**query)
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    return render_template_string(
-        HTML_TEMPLATE,
+    return render_template(
+        DASHBOARD_TEMPLATE,
         links=links,
-        link_count=len(links),
+        link_count=get_link_count(),
+        next_cursor=next_cursor,
+        page_size=query['limit'],
+        max_event_codes=click_feed.max_codes,
         now=now
     )
 
-@app.route("/<code>")
-def redirect_short_url(code):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+def lookup_link(code):
+    if link_index:
+        # Picks up changes made by other workers before trusting link_cache.
+        link_index.refresh()
+    token = link_cache.token()
+    cached = link_cache.get(code)
+    if cached is not MISSING:
+        return cached
     
-    cursor.execute(f'''
-        SELECT original_url, expires_at 
-        FROM {TABLE_URLS} 
-        WHERE shortcode = ?
-    ''', (code,))
+    if shared_cache:
+        cached = shared_cache.get(code)
+        if cached is None:
+            link_cache.put_missing(code, token=token)
+            return None
+        if cached is not MISSING:
+            link_cache.put(code, *cached, token=token)
+            return cached
     
-    row = cursor.fetchone()
-    conn.close()
+    row = storage.resolve(code)
     
+    # A change committed while we were reading has already invalidated both
+    # caches; the row we hold may predate it, so it is returned uncached.
     if not row:
-        abort(404)
+        if link_cache.put_missing(code, token=token) and shared_cache:
+            shared_cache.set(code, None, NEGATIVE_CACHE_TTL)
+        return None
     
-    url, expires_at = row
+    expires_at = row[1]
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if not expires_at or expires_at >= now:
+        if link_cache.put(code, *row, token=token) and shared_cache:
+            shared_cache.set(code, tuple(row), SHARED_CACHE_TTL)
+    return row
+
+def redirect_cache_control(status, expires_at):
+    # Permanent redirects may be kept by browsers and CDNs, but never past the
+    # link's expiry. Temporary ones are how clicks get tracked, so every
+    # request has to reach us.
+    if status in PERMANENT_REDIRECTS:
+        max_age = REDIRECT_MAX_AGE
+        if expires_at:
+            remaining = datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S') - datetime.now()
+            max_age = min(max_age, int(remaining.total_seconds()))
+        if max_age > 0:
+            return f"public, max-age={max_age}"
+    return "no-store"
+
+def resolve_redirect(code, cached_only=False):
+    # Shared by the Flask view and the ASGI fast path. Returns (status, url,
+    # cache_control); with cached_only set, returns None instead of touching
+    # the database on a cache miss.
+    if cached_only:
+        if link_index:
+            link_index.refresh()
+        row = link_cache.get(code)
+        if row is MISSING and link_index:
+            # The index is a local mmap, cheap enough to read on the event loop.
+            row = link_index.get(code)
+            if row is UNAVAILABLE:
+                row = MISSING
+        if row is MISSING:
+            return None
+    else:
+        row = lookup_link(code)
+    
+    if not row:
+        return 404, None, None
+    
+    url, expires_at, redirect_status = row
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     if expires_at and expires_at < now:
-        abort(410)
+        return 410, None, None
+    
+    status = redirect_status or DEFAULT_REDIRECT_STATUS
+    return status, url, redirect_cache_control(status, expires_at)
+
+@app.route("/<code>")
+def redirect_short_url(code):
+    status, url, cache_control = resolve_redirect(code)
+    
+    if status not in REDIRECT_STATUSES:
+        abort(status)
     
     record_click(code, request)
-    return redirect(url)
+    response = redirect(url, code=status)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def conditional_json(payload):
+    # Read APIs are revalidated on every poll; an unchanged body is a 304.
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route("/api/links", methods=["GET"])
 def api_get_links():
-    links = get_links()
-    return jsonify(links)
+    query, error = parse_links_query(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    links, next_cursor = get_links(**query)
+    return conditional_json({
+        "links": links,
+        "next_cursor": next_cursor,
+        "total": get_link_count()
+    })
+
+@app.route("/api/search", methods=["GET"])
+def api_search_links():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"error": "Missing q"}), 400
+    if len(q) > SEARCH_MAX_QUERY:
+        return jsonify({"error": f"q must be at most {SEARCH_MAX_QUERY} characters"}), 400
+    
+    try:
+        limit = int(request.args.get('limit', LINKS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if limit < 1 or limit > LINKS_MAX_PAGE_SIZE:
+        return jsonify({"error": f"Limit must be between 1 and {LINKS_MAX_PAGE_SIZE}"}), 400
+    
+    offset = 0
+    if request.args.get('cursor'):
+        offset = decode_search_cursor(request.args['cursor'])
+        if offset is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+    
+    links, more = storage.search_links(q, limit, offset)
+    return conditional_json({
+        "query": q,
+        "links": links,
+        "next_cursor": encode_search_cursor(offset + limit) if more else None
+    })
 
 @app.route("/api/links", methods=["POST"])
 @limiter.limit("10 per minute")
 def api_create_link():
     data = request.get_json()
     
-    if not data or 'url' not in data:
-        return jsonify({"error": "Missing URL"}), 400
+    link, error = parse_link_request(data)
+    if error:
+        return jsonify({"error": error}), 400
     
-    url = validate_url(data['url'])
-    if not url:
-        return jsonify({"error": "Invalid URL"}), 400
-    
-    code = validate_shortcode(data.get('code')) if data.get('code') else generate_random_code()
-    if not code:
-        return jsonify({"error": "Invalid short code"}), 400
-    
-    expiry_days = int(data.get('expiry', 0))
-    expires_at = None
-    if expiry_days > 0:
-        expires_at = (datetime.now() + timedelta(days=expiry_days)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    dedup, error = parse_flag("dedup", data.get('dedup'), DEDUP_URLS)
+    if error:
+        return jsonify({"error": error}), 400
+    qr, error = parse_flag("qr", data.get('qr'), QR_PRERENDER)
+    if error:
+        return jsonify({"error": error}), 400
     
     try:
-        cursor.execute(f'''
-            INSERT INTO {TABLE_URLS} 
-            (original_url, shortcode, expires_at)
-            VALUES (?, ?, ?)
-        ''', (url, code, expires_at))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
+        code = storage.create_link(link, dedup=dedup)
+    except DuplicateLink as e:
+        # A link to the same page already exists; hand that one back.
+        existing = e.link
+        return jsonify({
+            "shortcode": existing['code'],
+            "url": existing['url'],
+            "expires_at": existing['expires_at'],
+            "redirect": existing['redirect'] or DEFAULT_REDIRECT_STATUS,
+            "short_url": f"{request.host_url}{existing['code']}",
+            "existing": True
+        }), 200
+    except ShortcodeTaken:
         return jsonify({"error": "Short code already exists"}), 409
+    except CodeUnavailable:
+        return jsonify({"error": "Could not generate a unique short code"}), 503
     except Exception as e:
-        conn.close()
         return jsonify({"error": str(e)}), 500
     
-    conn.close()
+    if qr:
+        prerender_qr_codes([code])
     return jsonify({
         "shortcode": code,
-        "url": url,
-        "expires_at": expires_at,
+        "url": link['url'],
+        "expires_at": link['expires_at'],
+        "redirect": link['redirect'] or DEFAULT_REDIRECT_STATUS,
         "short_url": f"{request.host_url}{code}"
     }), 201
 
-@app.route("/api/links/<code>", methods=["GET"])
-def api_get_link(code):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+@app.route("/api/links/batch", methods=["POST"])
+@limiter.limit("10 per minute")
+def api_create_links_batch():
+    items = read_batch_items()
     
-    cursor.execute(f'''
-        SELECT original_url, created_at, expires_at, clicks
-        FROM {TABLE_URLS}
-        WHERE shortcode = ?
-    ''', (code,))
+    if items is None:
+        return jsonify({"error": "Expected a JSON array or NDJSON body"}), 400
+    if len(items) > BATCH_MAX_LINKS:
+        return jsonify({"error": f"At most {BATCH_MAX_LINKS} links per batch"}), 413
     
-    row = cursor.fetchone()
-    conn.close()
+    dedup, error = parse_flag("dedup", request.args.get('dedup'), DEDUP_URLS)
+    if error:
+        return jsonify({"error": error}), 400
+    qr, error = parse_flag("qr", request.args.get('qr'), QR_PRERENDER)
+    if error:
+        return jsonify({"error": error}), 400
     
-    if not row:
-        return jsonify({"error": "Not found"}), 404
+    results = [None] * len(items)
+    links = []
+    for index, data in enumerate(items):
+        link, error = parse_link_request(data)
+        if error:
+            results[index] = {"index": index, "error": error}
+        else:
+            links.append((index, link))
+    
+    try:
+        assigned, failed = storage.create_links(links, dedup=dedup)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    conflicts = []
+    for index, code in failed:
+        if code:
+            conflicts.append(code)
+            results[index] = {"index": index, "shortcode": code, "error": "Short code already exists"}
+        else:
+            results[index] = {"index": index, "error": "Could not generate a unique short code"}
     
+    for index, link in assigned:
+        results[index] = {
+            "index": index,
+            "shortcode": link['code'],
+            "url": link['url'],
+            "expires_at": link['expires_at'],
+            "redirect": link['redirect'] or DEFAULT_REDIRECT_STATUS,
+            "short_url": f"{request.host_url}{link['code']}",
+            **({"existing": True} if link.get('existing') else {})
+        }
+    
+    created = [link['code'] for _, link in assigned if not link.get('existing')]
+    if qr:
+        prerender_qr_codes(created)
     return jsonify({
+        "created": len(created),
+        "existing": len(assigned) - len(created),
+        "failed": len(items) - len(assigned),
+        "conflicts": conflicts,
+        "results": results
+    })
+
+@app.route("/api/links/<code>", methods=["GET"])
+def api_get_link(code):
+    link = storage.get_link(code)
+    
+    if not link:
+        return jsonify({"error": "Not found"}), 404
+    
+    return conditional_json({
         "shortcode": code,
-        "url": row[0],
-        "created_at": row[1],
-        "expires_at": row[2],
-        "clicks": row[3],
+        "url": link['original_url'],
+        "created_at": link['created_at'],
+        "expires_at": link['expires_at'],
+        "clicks": link['clicks'],
+        "redirect": link['redirect_status'] or DEFAULT_REDIRECT_STATUS,
         "short_url": f"{request.host_url}{code}",
         "qr_code": f"{request.host_url}api/qr/{code}"
     })
@@ -746,78 +1507,48 @@ def api_update_link(code):
     if not data:
         return jsonify({"error": "No data provided"}), 400
     
-    new_code = validate_shortcode(data.get('new_code'))
-    new_url = validate_url(data.get('new_url'))
+    if not any(data.get(field) is not None for field in ('new_url', 'new_code', 'redirect')):
+        return jsonify({"error": "Nothing to update: give new_url, new_code or redirect"}), 400
     
-    if new_url is None:
-        return jsonify({"error": "Invalid URL"}), 400
+    new_url = None
+    if data.get('new_url') is not None:
+        new_url = validate_url(data['new_url'])
+        if new_url is None:
+            return jsonify({"error": "Invalid URL"}), 400
     
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    new_code = None
+    if data.get('new_code') is not None:
+        new_code = validate_shortcode(data['new_code'])
+        if new_code is None:
+            return jsonify({"error": "Invalid short code"}), 400
+    
+    redirect_status, error = parse_redirect_status(data.get('redirect'))
+    if error:
+        return jsonify({"error": error}), 400
     
     try:
-        if new_code and new_code != code:
-            cursor.execute(f'''
-                SELECT 1 FROM {TABLE_URLS} 
-                WHERE shortcode = ?
-            ''', (new_code,))
-            if cursor.fetchone():
-                conn.close()
-                return jsonify({"error": "Short code already exists"}), 409
-        
-        cursor.execute(f'''
-            UPDATE {TABLE_URLS}
-            SET original_url = COALESCE(?, original_url),
-                shortcode = COALESCE(?, shortcode)
-            WHERE shortcode = ?
-        ''', (new_url, new_code, code))
-        
-        if cursor.rowcount == 0:
-            conn.close()
+        if not storage.update_link(code, new_url, new_code, redirect_status):
             return jsonify({"error": "Not found"}), 404
-        
-        conn.commit()
+    except ShortcodeTaken:
+        return jsonify({"error": "Short code already exists"}), 409
     except Exception as e:
-        conn.close()
         return jsonify({"error": str(e)}), 500
     
-    conn.close()
-    return jsonify({"message": "Link updated successfully"})
+    return jsonify({"message": "Link updated successfully", "code": new_code or code})
 
 @app.route("/api/links/<code>", methods=["DELETE"])
 @limiter.limit("10 per minute")
 def api_delete_link(code):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute(f'''
-        DELETE FROM {TABLE_URLS}
-        WHERE shortcode = ?
-    ''', (code,))
-    
-    if cursor.rowcount == 0:
-        conn.close()
+    if not storage.delete_link(code):
         return jsonify({"error": "Not found"}), 404
     
-    conn.commit()
-    conn.close()
     return jsonify({"message": "Link deleted successfully"})
 
 @app.route("/api/qr/<code>", methods=["GET"])
 def api_get_qr_code(code):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    link = storage.get_link(code)
     
-    cursor.execute(f'''
-        SELECT original_url 
-        FROM {TABLE_URLS} 
-        WHERE shortcode = ?
-    ''', (code,))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if not row:
+    if not link:
         abort(404)
     
     short_url = f"{request.host_url}{code}"
@@ -825,52 +1556,201 @@ def api_get_qr_code(code):
     
     return jsonify({
         "shortcode": code,
-        "url": row[0],
+        "url": link['original_url'],
         "short_url": short_url,
-        "qr_code": f"data:image/png;base64,{qr_code}"
+        "qr_code": f"data:image/png;base64,{qr_code}",
+        "image_url": f"{request.host_url}api/qr/{code}/image"
     })
 
+@app.route("/api/qr/<code>/image", methods=["GET"])
+def api_get_qr_image(code):
+    fmt = request.args.get('format', 'png')
+    if fmt not in QR_FORMATS:
+        return jsonify({"error": "Format must be png or svg"}), 400
+    
+    try:
+        size = int(request.args.get('size', QR_DEFAULT_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid size"}), 400
+    if size < QR_MIN_SIZE or size > QR_MAX_SIZE:
+        return jsonify({"error": f"Size must be between {QR_MIN_SIZE} and {QR_MAX_SIZE}"}), 400
+    
+    if not lookup_link(code):
+        abort(404)
+    
+    key, image = qr_cache.get(f"{request.host_url}{code}", size, fmt)
+    response = Response(image, mimetype=QR_FORMATS[fmt])
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = QR_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route("/api/analytics/<code>", methods=["GET"])
 def api_get_analytics(code):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute(f'''
-        SELECT original_url, created_at, clicks
-        FROM {TABLE_URLS}
-        WHERE shortcode = ?
-    ''', (code,))
-    
-    link_info = cursor.fetchone()
-    if not link_info:
-        conn.close()
+    link = storage.get_link(code)
+    
+    if not link:
         return jsonify({"error": "Not found"}), 404
     
-    cursor.execute(f'''
-        SELECT timestamp, ip_address, user_agent, referrer
-        FROM {TABLE_ANALYTICS}
-        WHERE shortcode = ?
-        ORDER BY timestamp DESC
-        LIMIT 100
-    ''', (code,))
-    
-    analytics = []
-    for row in cursor.fetchall():
-        analytics.append({
-            "timestamp": row[0],
-            "ip_address": row[1],
-            "user_agent": row[2],
-            "referrer": row[3]
-        })
-    
-    conn.close()
+    return conditional_json({
+        "shortcode": code,
+        "url": link['original_url'],
+        "created_at": link['created_at'],
+        "total_clicks": link['clicks'],
+        **storage.visitors(code, datetime.now(timezone.utc).strftime('%Y-%m-%d')),
+        "recent_clicks": storage.recent_clicks(code, limit=100)
+    })
+
+@app.route("/api/analytics/<code>/timeseries", methods=["GET"])
+def api_get_analytics_timeseries(code):
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": "Granularity must be hour or day"}), 400
     
-    return jsonify({
+    now = datetime.now(timezone.utc)
+    until = parse_timestamp(request.args['until']) if request.args.get('until') else now.strftime('%Y-%m-%d %H:%M:%S')
+    default_since = now - (timedelta(hours=48) if granularity == 'hour' else timedelta(days=30))
+    since = parse_timestamp(request.args['since']) if request.args.get('since') else default_since.strftime('%Y-%m-%d %H:%M:%S')
+    if not since or not until:
+        return jsonify({"error": "Invalid time range"}), 400
+    
+    link = storage.get_link(code)
+    
+    if not link:
+        return jsonify({"error": "Not found"}), 404
+    
+    series, breakdown = storage.timeseries(code, granularity, since, until)
+    
+    return conditional_json({
         "shortcode": code,
-        "url": link_info[0],
-        "created_at": link_info[1],
-        "total_clicks": link_info[2],
-        "recent_clicks": analytics
+        "url": link['original_url'],
+        "total_clicks": link['clicks'],
+        "granularity": granularity,
+        "since": since,
+        "until": until,
+        "series": series,
+        **breakdown
+    })
+
+def export_response(name, columns, rows):
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "Format must be ndjson or csv"}), 400
+    
+    response = Response(
+        format_rows(rows, columns, fmt, chunk_size=EXPORT_CHUNK_SIZE),
+        mimetype=EXPORT_FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+@app.route("/api/events", methods=["GET"])
+def api_events():
+    # Counts are keyed by the codes as sent; validation would lowercase them.
+    codes = [code for code in request.args.get('codes', '').split(',') if validate_shortcode(code)]
+    if not codes:
+        return jsonify({"error": "Missing codes"}), 400
+    
+    response = Response(click_feed.stream(codes), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route("/api/export/links", methods=["GET"])
+def api_export_links():
+    return export_response(
+        TABLE_URLS,
+        LINK_FIELDS,
+        storage.iter_links(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+@app.route("/api/export/analytics", methods=["GET"])
+def api_export_analytics():
+    bounds = {}
+    for arg in ('since', 'until'):
+        bounds[arg] = None
+        if request.args.get(arg):
+            bounds[arg] = parse_timestamp(request.args[arg])
+            if bounds[arg] is None:
+                return jsonify({"error": f"Invalid {arg}"}), 400
+    
+    return export_response(
+        TABLE_ANALYTICS,
+        CLICK_FIELDS,
+        storage.iter_clicks(
+            request.args.get('code') or None,
+            chunk_size=EXPORT_CHUNK_SIZE,
+            **bounds
+        )
+    )
+
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+def api_metrics():
+    if not METRICS_ENABLED:
+        abort(404)
+    
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/admin/profile", methods=["POST"])
+@limiter.exempt
+@admin_only
+def api_admin_profile():
+    # Blocks for the whole profile and samples only the worker process that
+    # answers it.
+    try:
+        seconds = float(request.args.get('seconds', PROFILE_DEFAULT_SECONDS))
+        interval = float(request.args.get('interval_ms', PROFILE_DEFAULT_INTERVAL_MS)) / 1000
+    except ValueError:
+        return jsonify({"error": "Invalid seconds or interval_ms"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS}"}), 400
+    if not 0.001 <= interval <= 1:
+        return jsonify({"error": "interval_ms must be between 1 and 1000"}), 400
+    
+    try:
+        stacks, samples = profiler.profile(seconds, interval, include_idle=request.args.get('idle') == '1')
+    except ProfilerBusy:
+        return jsonify({"error": "A profile is already running"}), 409
+    
+    return Response(collapsed(stacks), mimetype="text/plain", headers={
+        "X-Profile-Samples": str(samples),
+        "X-Profile-Pid": str(os.getpid())
+    })
+
+@app.route("/api/admin/slow-requests", methods=["GET"])
+@limiter.exempt
+@admin_only
+def api_admin_slow_requests():
+    if not slow_requests:
+        return jsonify({"error": "Slow request logging is off (SHORTENER_SLOW_REQUEST_MS)"}), 404
+    
+    return jsonify({**slow_requests.stats(), "recent": slow_requests.recent()})
+
+@app.route("/api/admin/query-plans", methods=["GET"])
+@limiter.exempt
+@admin_only
+def api_admin_query_plans():
+    if not slow_requests:
+        return jsonify({"error": "Slow request logging is off (SHORTENER_SLOW_REQUEST_MS)"}), 404
+    
+    return jsonify({"statements": slow_requests.plans.plans(flagged_only=request.args.get('flagged') == '1')})
+
+@app.route("/api/stats", methods=["GET"])
+def api_get_stats():
+    return jsonify({
+        "link_cache": link_cache.stats(),
+        "click_queue": click_queue.stats(),
+        "events": click_feed.stats(),
+        "db_pool": db.stats(),
+        "storage": storage.stats(),
+        "link_index": link_index.stats() if link_index else None,
+        "codes": code_generator.stats(),
+        "qr_cache": qr_cache.stats(),
+        "retention": retention.stats(),
+        "expiry": expiry_sweeper.stats() if expiry_sweeper else None,
+        "slow_requests": slow_requests.stats() if slow_requests else None,
+        "shared_cache": shared_cache.stats() if shared_cache else None
     })
 
 @app.errorhandler(404)
@@ -883,8 +1763,10 @@ def page_gone(e):
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
+    rate_limited.inc(route_label())
     return jsonify({"error": "Rate limit exceeded"}), 429
 
 if __name__ == "__main__":
     ensure_tables()
+    tables_ready = True
     app.run(debug=True)
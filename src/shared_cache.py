@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from cache import MISSING
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "shortener:invalidate"
+
+
+class SharedCache:
+    # Cache tier shared by every node. Values are (original_url, expires_at,
+    # redirect_status) tuples, None for a cached 404, or MISSING.
+    # Invalidations are broadcast so nodes can drop their in-process entries
+    # as well.
+    def __init__(self, prefix="shortener:link:"):
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._subscribers = []
+
+    def get(self, code):
+        raise NotImplementedError
+
+    def set(self, code, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, *codes):
+        raise NotImplementedError
+
+    def publish(self, codes):
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        # callback(codes) gets a list of shortcodes, or None when everything
+        # should be dropped (e.g. after missing messages while disconnected).
+        self._subscribers.append(callback)
+
+    def start(self):
+        pass
+
+    def invalidate(self, *codes):
+        codes = [code for code in codes if code]
+        if not codes:
+            return
+        self.delete(*codes)
+        self.publish(codes)
+
+    def _deliver(self, codes):
+        for callback in self._subscribers:
+            try:
+                callback(codes)
+            except Exception:
+                logger.exception("Invalidation subscriber failed")
+
+    def close(self):
+        pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def encode_value(value):
+    return json.dumps(None if value is None else list(value))
+
+
+def decode_value(raw):
+    value = json.loads(raw)
+    return None if value is None else tuple(value)
+
+
+class MemorySharedCache(SharedCache):
+    # Single-process implementation of the interface, for tests and for
+    # running the same code path without an external server.
+    backend = "memory"
+
+    def __init__(self, prefix="shortener:link:"):
+        super().__init__(prefix)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[code]
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return entry[0]
+
+    def set(self, code, value, ttl):
+        with self._lock:
+            self._entries[code] = (value, time.monotonic() + ttl)
+
+    def delete(self, *codes):
+        with self._lock:
+            for code in codes:
+                self._entries.pop(code, None)
+
+    def publish(self, codes):
+        self._deliver(list(codes))
+
+
+class RespError(Exception):
+    pass
+
+
+class RespConnection:
+    def __init__(self, host, port, db=0, password=None, timeout=1.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", db)
+
+    def send(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.sock.sendall(b"".join(parts))
+
+    def read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode("utf-8")
+        if prefix == b"-":
+            raise RespError(payload.decode("utf-8"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self.read() for _ in range(length)]
+        raise RespError(f"unexpected reply prefix {prefix!r}")
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read()
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisSharedCache(SharedCache):
+    # Talks RESP2 directly so any Redis-compatible server works, including
+    # the stand-in in miniredis.py. Errors degrade to cache misses; a
+    # redirect never fails because the shared tier is down.
+    backend = "redis"
+
+    def __init__(self, url, prefix="shortener:link:", timeout=0.25):
+        super().__init__(prefix)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._subscriber = None
+        self._closing = threading.Event()
+        self._down_until = 0.0
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+            self._subscriber = None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Don't pay a connect timeout on every request while the server is down.
+            if time.monotonic() < self._down_until:
+                raise ConnectionError("shared cache unavailable")
+            conn = RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _command(self, *args):
+        try:
+            return self._connection().command(*args)
+        except (OSError, RespError, ValueError) as e:
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+                self._local.conn = None
+            if isinstance(e, OSError):
+                self._down_until = time.monotonic() + 1.0
+            self.errors += 1
+            raise
+
+    def get(self, code):
+        try:
+            raw = self._command("GET", self.prefix + code)
+        except (OSError, RespError, ValueError):
+            self.misses += 1
+            return MISSING
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return decode_value(raw)
+
+    def set(self, code, value, ttl):
+        try:
+            self._command("SET", self.prefix + code, encode_value(value), "EX", max(1, int(ttl)))
+        except (OSError, RespError, ValueError):
+            pass
+
+    def delete(self, *codes):
+        try:
+            self._command("DEL", *(self.prefix + code for code in codes))
+        except (OSError, RespError, ValueError):
+            pass
+
+    def publish(self, codes):
+        try:
+            self._command("PUBLISH", INVALIDATION_CHANNEL, json.dumps(list(codes)))
+        except (OSError, RespError, ValueError):
+            pass
+
+    def start(self):
+        # Called per process (after fork); the listener thread does not
+        # survive a fork, so it is started lazily rather than on subscribe.
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+            self._subscriber = None
+        if not self._subscribers:
+            return
+        if self._subscriber is None or not self._subscriber.is_alive():
+            self._subscriber = threading.Thread(target=self._listen, name="shared-cache-invalidations", daemon=True)
+            self._subscriber.start()
+
+    def _listen(self):
+        backoff = 0.1
+        while not self._closing.is_set():
+            conn = None
+            try:
+                conn = RespConnection(self.host, self.port, self.db, self.password, timeout=None)
+                conn.command("SUBSCRIBE", INVALIDATION_CHANNEL)
+                backoff = 0.1
+                while not self._closing.is_set():
+                    message = conn.read()
+                    if isinstance(message, list) and len(message) == 3 and message[0] == b"message":
+                        self._deliver(json.loads(message[2]))
+            except (OSError, RespError, ValueError):
+                self.errors += 1
+                # Anything may have changed while we were disconnected.
+                self._deliver(None)
+                self._closing.wait(backoff)
+                backoff = min(backoff * 2, 5.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def close(self):
+        self._closing.set()
+
+
+def create_shared_cache(url):
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemorySharedCache()
+    if url.startswith("redis://"):
+        return RedisSharedCache(url)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
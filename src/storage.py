@@ -0,0 +1,1437 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import sqlite3
+import unicodedata
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from dedup import normalize_url, url_hash, url_key
+from export import iter_rows
+from linkindex import UNAVAILABLE
+
+LINK_FIELDS = ("shortcode", "original_url", "clicks", "created_at", "expires_at", "redirect_status")
+CLICK_FIELDS = ("shortcode", "timestamp", "ip_address", "user_agent", "referrer")
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_NAME = re.compile(r"^clicks-(\d{4})-(\d{2})\.log$")
+_SEARCH_TOKEN = re.compile(r"[^\W_]+")
+_CODE_PREFIX = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Matches ranked per search, taken newest first. Ranking every match of a
+# common word like "https" would grow with the table, so ranking is within
+# this many of the latest matches and pagination stops there.
+SEARCH_CANDIDATES = 500
+# A word in fewer URLs than this drives a search of several words: its rows
+# are read and the rest checked here, where FTS5 would seek the doclists of
+# words like "www" and "com" once for each of them.
+SEARCH_RARE_WORD = 4000
+
+# One committed link change. url is None when the code stopped existing,
+# which a rename reports for the old code alongside the new row carrying
+# renamed_from. The first four fields are what the LinkIndex stores.
+LinkChange = namedtuple(
+    "LinkChange",
+    ("code", "url", "expires_at", "redirect_status", "renamed_from"),
+    defaults=(None,)
+)
+
+
+class ShortcodeTaken(Exception):
+    pass
+
+
+class CodeUnavailable(Exception):
+    pass
+
+
+class DuplicateLink(Exception):
+    # create_link(dedup=True) found a link to the same page; link is that
+    # one, shaped like the links create_links returns.
+    def __init__(self, link):
+        super().__init__(link['code'])
+        self.link = link
+
+
+def _search_tokens(text):
+    # Lowercased and without diacritics, the way FTS5's default unicode61
+    # tokenizer indexes them.
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return _SEARCH_TOKEN.findall(text)
+
+
+def search_terms(query):
+    # (phrases, prefix) for free text. Each whitespace-separated term becomes
+    # a phrase of its tokens, so "example.com" only matches the two words in
+    # a row, and the last word is also a prefix once it has three characters.
+    phrases = [tokens for tokens in map(_search_tokens, query.split()) if tokens]
+    return phrases, bool(phrases) and len(phrases[-1][-1]) >= 3
+
+
+def search_expressions(phrases, prefix):
+    # FTS5 queries for the terms, run in order until one fills the ranking
+    # window. Prefixes longer than the prefix indexes make FTS5 merge every
+    # matching word's doclist, so those first look for the whole word and
+    # only widen when it is rare.
+    exact = " ".join('"' + " ".join(tokens) + '"' for tokens in phrases)
+    if not prefix:
+        return [exact]
+    return [exact + " *"] if len(phrases[-1][-1]) <= 4 else [exact, exact + " *"]
+
+
+def search_matcher(phrases, prefix):
+    # What the FTS5 query matches, as a test of one URL: each phrase's
+    # tokens in a row, whole tokens except for a prefix at the very end.
+    patterns = []
+    for index, tokens in enumerate(phrases):
+        pattern = r"(?<![^\W_])" + r"[\W_]+".join(map(re.escape, tokens))
+        if not (prefix and index == len(phrases) - 1):
+            pattern += r"(?![^\W_])"
+        patterns.append(re.compile(pattern))
+
+    def matches(text):
+        text = text.lower()
+        if not text.isascii():
+            text = " ".join(_search_tokens(text))
+        return all(pattern.search(text) for pattern in patterns)
+    return matches
+
+
+def _log_stamp():
+    # Orders click log appends against deletes and renames. All three are
+    # taken under the database write lock, so the order is commit order.
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class Storage:
+    # What the web layer needs from a backend. Links are dicts with the
+    # LINK_FIELDS keys (redirect_status None means the server default);
+    # links to create carry url, code, expires_at and redirect. Click events are (shortcode, ip_address, user_agent,
+    # referrer, timestamp) tuples as produced by ClickQueue.
+    name = None
+
+    def create_tables(self):
+        raise NotImplementedError
+
+    def resolve(self, code):
+        # (original_url, expires_at, redirect_status) or None; the redirect
+        # hot path.
+        raise NotImplementedError
+
+    def get_link(self, code):
+        raise NotImplementedError
+
+    def count_links(self):
+        raise NotImplementedError
+
+    def click_counts(self, codes):
+        # {shortcode: clicks} for the codes that exist.
+        raise NotImplementedError
+
+    def list_links(self, limit, cursor=None, status=None, created_after=None):
+        # Returns (links, next_cursor) where next_cursor is a (created_at, id)
+        # key to pass back in, or None on the last page.
+        raise NotImplementedError
+
+    def search_links(self, query, limit, offset=0):
+        # Links whose code starts with query, then links whose destination
+        # matches it, best first; returns (links, more). Links are shaped
+        # like list_links'.
+        raise NotImplementedError
+
+    def iter_links(self, chunk_size=1000):
+        raise NotImplementedError
+
+    def create_link(self, link, dedup=False):
+        # Returns the assigned code. Raises ShortcodeTaken for a custom code
+        # that exists and CodeUnavailable if no free code could be generated.
+        # With dedup, a link without a custom code raises DuplicateLink if a
+        # link to the same normalized URL redirects the same way for at least
+        # as long.
+        raise NotImplementedError
+
+    def create_links(self, links, dedup=False):
+        # links are (index, link) pairs; returns (assigned, failed) as
+        # [(index, link)] and [(index, code or None)]. Links reused by dedup
+        # come back in assigned with existing=True.
+        raise NotImplementedError
+
+    def update_link(self, code, new_url=None, new_code=None, redirect_status=None):
+        # False if code does not exist; ShortcodeTaken if new_code does. A
+        # rename moves the link's clicks and rollups to new_code.
+        raise NotImplementedError
+
+    def delete_link(self, code):
+        raise NotImplementedError
+
+    def expiring(self, until, limit):
+        # [(expires_at, shortcode)] of links expiring at or before until,
+        # earliest first.
+        raise NotImplementedError
+
+    def count_expiring(self, until):
+        raise NotImplementedError
+
+    def expire_links(self, codes, until, archive=False):
+        # Removes those of codes that expired at or before until, like
+        # delete_link, keeping a copy in the expired links table when archive
+        # is set. Returns the removed codes.
+        raise NotImplementedError
+
+    def record_clicks(self, batch, hooks=()):
+        # Events for codes that do not exist when the batch commits (deleted
+        # or renamed since the redirect) are dropped.
+        raise NotImplementedError
+
+    def recent_clicks(self, code, limit=100):
+        raise NotImplementedError
+
+    def iter_clicks(self, code=None, since=None, until=None, chunk_size=1000):
+        # Yields CLICK_FIELDS tuples with since <= timestamp < until.
+        raise NotImplementedError
+
+    def timeseries(self, code, granularity, since, until):
+        # Returns (series, breakdown) from the rollups.
+        raise NotImplementedError
+
+    def visitors(self, code, day):
+        # Unique visitor estimates (all-time and for day, UTC) and click
+        # counts with and without bots, from the rollup sketches.
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        # callback(changes) runs in this process after every committed link
+        # change, with a list of LinkChange.
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class SQLiteStorage(Storage):
+    # With a LinkIndex attached, resolve() answers from the index and every
+    # link change is written to it after the transaction commits.
+    name = "sqlite"
+
+    def __init__(self, database, table_urls, table_analytics, table_counters,
+                 code_generator, rollups, attempts=5, link_index=None, search=True):
+        self.database = database
+        self.table_urls = table_urls
+        self.table_analytics = table_analytics
+        self.table_counters = table_counters
+        self.code_generator = code_generator
+        self.rollups = rollups
+        self.attempts = attempts
+        self.link_index = link_index
+        self.table_orphans = f"{table_analytics}_orphans"
+        self.table_renames = f"{table_analytics}_renames"
+        self.table_expired = f"{table_urls}_expired"
+        self.table_search = f"{table_urls}_search"
+        self.search = search
+        # None until create_tables() or the first search has looked.
+        self.search_available = None
+        self._subscribers = []
+        self.dropped_clicks = 0
+
+    def create_tables(self):
+        with self.database.writer() as conn:
+            self._create_tables(conn)
+        if self.link_index is not None:
+            # Links written while the index was off never reached its delta.
+            with self.database.reader() as conn:
+                writes = self._link_writes(conn)
+            if not self.link_index.valid() or self.link_index.writes() != writes:
+                self.rebuild_index()
+
+    def rebuild_index(self):
+        with self.link_index.lock():
+            with self.database.reader() as conn:
+                conn.execute("BEGIN")
+                writes = self._link_writes(conn)
+                rows = conn.execute(f'''
+                    SELECT shortcode, original_url, expires_at, redirect_status
+                    FROM {self.table_urls}
+                ''')
+                return self.link_index.rebuild(rows, writes)
+
+    def _link_writes(self, conn):
+        return conn.execute(f"SELECT value FROM {self.table_counters} WHERE name = 'link_writes'").fetchone()[0]
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    @contextmanager
+    def _link_changes(self):
+        # Collects LinkChanges and, once the inner transaction has committed,
+        # hands them to the index and then to the subscribers. The index lock
+        # spans the transaction so the delta keeps commit order.
+        changes = []
+        if self.link_index is None:
+            yield changes
+        else:
+            with self.link_index.lock():
+                yield changes
+                if changes:
+                    with self.database.reader() as conn:
+                        writes = self._link_writes(conn)
+                    self.link_index.apply([change[:4] for change in changes], writes)
+        if changes:
+            self._publish(changes)
+
+    def _publish(self, changes):
+        for callback in self._subscribers:
+            try:
+                callback(changes)
+            except Exception:
+                logger.exception("Link change subscriber failed")
+
+    def _create_tables(self, conn):
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_urls} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                original_url TEXT NOT NULL,
+                shortcode TEXT NOT NULL UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NULL,
+                clicks INTEGER DEFAULT 0,
+                redirect_status INTEGER NULL
+            )
+        ''')
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({self.table_urls})')]
+        if 'redirect_status' not in columns:
+            cursor.execute(f'ALTER TABLE {self.table_urls} ADD COLUMN redirect_status INTEGER NULL')
+        if 'url_hash' not in columns:
+            cursor.execute(f'ALTER TABLE {self.table_urls} ADD COLUMN url_hash INTEGER NULL')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_analytics} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shortcode TEXT NOT NULL,
+                ip_address TEXT,
+                user_agent TEXT,
+                referrer TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (shortcode) REFERENCES {self.table_urls}(shortcode)
+            )
+        ''')
+
+        # The UNIQUE constraint already indexes shortcode.
+        cursor.execute('DROP INDEX IF EXISTS idx_shortcode')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_expires ON {self.table_urls}(expires_at)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_analytics_shortcode ON {self.table_analytics}(shortcode)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_created ON {self.table_urls}(created_at DESC, id DESC)')
+
+        # Hash of the normalized destination, for dedup. Rows written before
+        # the column existed, or by hand, are filled in here; the index
+        # makes finding them cheap on every start.
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_url_hash ON {self.table_urls}(url_hash)')
+        conn.create_function('url_hash', 1, url_hash, deterministic=True)
+        cursor.execute(f'''
+            UPDATE {self.table_urls} SET url_hash = url_hash(original_url)
+            WHERE url_hash IS NULL
+        ''')
+
+        # Deleted codes whose clicks retention has not removed yet.
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_orphans} (
+                shortcode TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+        ''')
+        # Renames whose archived clicks retention has not moved yet, in order.
+        # Archives remember the last id they have, so ids are never reused.
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_renames} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                old_code TEXT NOT NULL,
+                new_code TEXT NOT NULL
+            )
+        ''')
+
+        # Links removed by the expiry sweeper in archive mode. Codes can be
+        # reused, so shortcode is not unique here.
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_expired} (
+                id INTEGER PRIMARY KEY,
+                shortcode TEXT NOT NULL,
+                original_url TEXT NOT NULL,
+                created_at TIMESTAMP,
+                expires_at TIMESTAMP,
+                clicks INTEGER,
+                redirect_status INTEGER NULL,
+                expired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_counters} (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {self.table_counters} (name, value)
+            SELECT 'links', COUNT(*) FROM {self.table_urls}
+        ''')
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {self.table_counters} (name, value)
+            VALUES ('code_sequence', 0)
+        ''')
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {self.table_counters} (name, value)
+            VALUES ('link_writes', 0)
+        ''')
+
+        missing = self.rollups.create_tables(conn)
+        if missing:
+            self.rollups.backfill(conn, self.table_analytics, missing)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_urls_count_insert
+            AFTER INSERT ON {self.table_urls}
+            BEGIN
+                UPDATE {self.table_counters} SET value = value + 1 WHERE name = 'links';
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_urls_count_delete
+            AFTER DELETE ON {self.table_urls}
+            BEGIN
+                UPDATE {self.table_counters} SET value = value - 1 WHERE name = 'links';
+            END
+        ''')
+        # Every change a redirect can see, by any process, with or without
+        # the link index; the index records the value it is current with.
+        for event in ("INSERT", "DELETE", "UPDATE OF shortcode, original_url, expires_at, redirect_status"):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_urls_writes_{event.split()[0].lower()}
+                AFTER {event} ON {self.table_urls}
+                BEGIN
+                    UPDATE {self.table_counters} SET value = value + 1 WHERE name = 'link_writes';
+                END
+            ''')
+        self._create_search(conn)
+
+    def _create_search(self, conn):
+        # Destination URLs go into an external-content FTS5 index that
+        # triggers keep in step with urls, so every write path is covered
+        # without storing the URLs twice. Without the 3 and 4 character
+        # prefix indexes a prefix query merges the doclists of every word it
+        # covers before returning a row, which for "com" is most of the table.
+        # Shortcode prefixes need no index of their own: they are a range on
+        # the UNIQUE one.
+        triggers = [f"trg_urls_search_{event}" for event in ("insert", "delete", "update")]
+        if not self.search:
+            for trigger in triggers:
+                conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            conn.execute(f'DROP TABLE IF EXISTS {self.table_search}')
+            self.search_available = False
+            return
+
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (self.table_search,)).fetchone()
+        try:
+            conn.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {self.table_search}
+                USING fts5(original_url, content='{self.table_urls}', content_rowid='id', prefix='3 4')
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning("Link search needs SQLite built with FTS5 (%s); only shortcodes are searched", e)
+            self.search_available = False
+            return
+
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {triggers[0]}
+            AFTER INSERT ON {self.table_urls}
+            BEGIN
+                INSERT INTO {self.table_search} (rowid, original_url) VALUES (new.id, new.original_url);
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {triggers[1]}
+            AFTER DELETE ON {self.table_urls}
+            BEGIN
+                INSERT INTO {self.table_search} ({self.table_search}, rowid, original_url)
+                VALUES ('delete', old.id, old.original_url);
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {triggers[2]}
+            AFTER UPDATE OF original_url ON {self.table_urls}
+            BEGIN
+                INSERT INTO {self.table_search} ({self.table_search}, rowid, original_url)
+                VALUES ('delete', old.id, old.original_url);
+                INSERT INTO {self.table_search} (rowid, original_url) VALUES (new.id, new.original_url);
+            END
+        ''')
+        if not exists:
+            conn.execute(f"INSERT INTO {self.table_search} ({self.table_search}) VALUES ('rebuild')")
+        self.search_available = True
+
+    def resolve(self, code):
+        if self.link_index is not None:
+            found = self.link_index.get(code)
+            if found is not UNAVAILABLE:
+                return found
+        with self.database.reader() as conn:
+            return conn.execute(f'''
+                SELECT original_url, expires_at, redirect_status
+                FROM {self.table_urls}
+                WHERE shortcode = ?
+            ''', (code,)).fetchone()
+
+    def get_link(self, code):
+        with self.database.reader() as conn:
+            row = conn.execute(f'''
+                SELECT {", ".join(LINK_FIELDS)}
+                FROM {self.table_urls}
+                WHERE shortcode = ?
+            ''', (code,)).fetchone()
+        return dict(zip(LINK_FIELDS, row)) if row else None
+
+    def click_counts(self, codes):
+        if not codes:
+            return {}
+        with self.database.reader() as conn:
+            return dict(conn.execute(f'''
+                SELECT shortcode, clicks
+                FROM {self.table_urls}
+                WHERE shortcode IN ({", ".join("?" * len(codes))})
+            ''', list(codes)))
+
+    def count_links(self):
+        with self.database.reader() as conn:
+            row = conn.execute(f'''
+                SELECT value FROM {self.table_counters}
+                WHERE name = 'links'
+            ''').fetchone()
+        return row[0] if row else 0
+
+    def list_links(self, limit, cursor=None, status=None, created_after=None):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        clauses = []
+        params = []
+
+        if cursor:
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend(cursor)
+        if status == 'active':
+            clauses.append('(expires_at IS NULL OR expires_at >= ?)')
+            params.append(now)
+        elif status == 'expired':
+            clauses.append('expires_at < ?')
+            params.append(now)
+        if created_after:
+            clauses.append('created_at > ?')
+            params.append(created_after)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        params.append(limit + 1)
+
+        with self.database.reader() as conn:
+            rows = conn.execute(f'''
+                SELECT id, shortcode, original_url, clicks, created_at, expires_at
+                FROM {self.table_urls}
+                {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1][4], rows[-1][0])
+
+        return [self._link_summary(row, now) for row in rows], next_cursor
+
+    @staticmethod
+    def _link_summary(row, now):
+        return {
+            'shortcode': row[1],
+            'original_url': row[2],
+            'clicks': row[3],
+            'created_at': row[4],
+            'expires_at': row[5],
+            'is_expired': bool(row[5] and row[5] < now)
+        }
+
+    @staticmethod
+    def _rank(rows, terms):
+        # Every candidate contains every term, so bm25's idf weights would be
+        # the same for all of them, and bm25() would scan each term's whole
+        # doclist to compute them. What orders the candidates is where and
+        # how often the terms occur and how long the URL is: host matches
+        # first, then more occurrences, then shorter URLs, then newer links.
+        def key(row):
+            url = row[2].lower()
+            host = url.partition('//')[2].partition('/')[0]
+            in_host = in_url = 0
+            for term in terms:
+                in_host += host.count(term)
+                in_url += url.count(term)
+            return (-in_host, -in_url, len(url), -row[0])
+        return sorted(rows, key=key)
+
+    def _search_matches(self, conn, phrases, prefix):
+        # Up to SEARCH_CANDIDATES of the newest rows matching the terms.
+        columns = "u.id, u.shortcode, u.original_url, u.clicks, u.created_at, u.expires_at"
+        words = [token for tokens in phrases for token in tokens]
+        drivers = words[:-1] if prefix else words
+        if len(words) > 1 and drivers:
+            # Longer words tend to be the rarer ones. Only one is tried, which
+            # bounds what a query of common words spends before FTS5 runs it.
+            rowids = [row[0] for row in conn.execute(f'''
+                SELECT rowid FROM {self.table_search}
+                WHERE {self.table_search} MATCH ?
+                ORDER BY rowid DESC
+                LIMIT ?
+            ''', (f'"{max(drivers, key=len)}"', SEARCH_RARE_WORD))]
+            if len(rowids) < SEARCH_RARE_WORD:
+                # Each phrase's words in order somewhere in the URL is a
+                # necessary condition SQLite can test without the rows
+                # leaving C; LIKE only folds ASCII, so other URLs all pass.
+                filters = " AND ".join(["u.original_url LIKE ?"] * len(phrases))
+                patterns = ["%" + "%".join(tokens) + "%" for tokens in phrases]
+                matcher = search_matcher(phrases, prefix)
+                matches = []
+                for start in range(0, len(rowids), 500):
+                    chunk = rowids[start:start + 500]
+                    placeholders = ', '.join('?' * len(chunk))
+                    rows = conn.execute(f'''
+                        SELECT {columns} FROM {self.table_urls} u
+                        WHERE u.id IN ({placeholders})
+                          AND (length(u.original_url) != length(CAST(u.original_url AS BLOB)) OR ({filters}))
+                        ORDER BY u.id DESC
+                    ''', chunk + patterns).fetchall()
+                    matches.extend(row for row in rows if matcher(row[2]))
+                    if len(matches) >= SEARCH_CANDIDATES:
+                        break
+                return matches[:SEARCH_CANDIDATES]
+
+        matches = {}
+        for expression in search_expressions(phrases, prefix):
+            if len(matches) >= SEARCH_CANDIDATES:
+                break
+            rows = conn.execute(f'''
+                SELECT {columns}
+                FROM {self.table_search}
+                JOIN {self.table_urls} u ON u.id = {self.table_search}.rowid
+                WHERE {self.table_search} MATCH ?
+                ORDER BY {self.table_search}.rowid DESC
+                LIMIT ?
+            ''', (expression, SEARCH_CANDIDATES)).fetchall()
+            for row in rows:
+                matches.setdefault(row[0], row)
+        return list(matches.values())
+
+    def _search_ready(self, conn):
+        # Pre-forked workers share tables one process created and never run
+        # create_tables() themselves, so they look for the index once.
+        if self.search_available is None:
+            self.search_available = self.search and conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?", (self.table_search,)
+            ).fetchone() is not None
+        return self.search_available
+
+    def search_links(self, query, limit, offset=0):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        query = query.strip()
+        ids = []
+        by_id = {}
+
+        with self.database.reader() as conn:
+            if _CODE_PREFIX.match(query):
+                # The exact code, if any, sorts first.
+                end = query[:-1] + chr(ord(query[-1]) + 1)
+                rows = conn.execute(f'''
+                    SELECT id FROM {self.table_urls}
+                    WHERE shortcode >= ? AND shortcode < ?
+                    ORDER BY shortcode
+                    LIMIT ?
+                ''', (query, end, SEARCH_CANDIDATES)).fetchall()
+                ids.extend(row[0] for row in rows)
+
+            phrases, prefix = search_terms(query)
+            if phrases and self._search_ready(conn):
+                found = set(ids)
+                terms = [token for tokens in phrases for token in tokens]
+                for row in self._rank(self._search_matches(conn, phrases, prefix), terms):
+                    if row[0] not in found:
+                        ids.append(row[0])
+                        by_id[row[0]] = row
+
+            page = ids[offset:offset + limit]
+            missing = [link_id for link_id in page if link_id not in by_id]
+            if missing:
+                placeholders = ', '.join('?' * len(missing))
+                rows = conn.execute(f'''
+                    SELECT id, shortcode, original_url, clicks, created_at, expires_at
+                    FROM {self.table_urls}
+                    WHERE id IN ({placeholders})
+                ''', missing).fetchall()
+                by_id.update((row[0], row) for row in rows)
+
+        links = [self._link_summary(by_id[link_id], now) for link_id in page if link_id in by_id]
+        return links, len(ids) > offset + limit
+
+    def iter_links(self, chunk_size=1000):
+        return iter_rows(self.database, self.table_urls, LINK_FIELDS, chunk_size=chunk_size)
+
+    def _existing_codes(self, conn, codes):
+        codes = list(codes)
+        found = set()
+
+        for start in range(0, len(codes), 500):
+            chunk = codes[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = conn.execute(f'''
+                SELECT shortcode FROM {self.table_urls}
+                WHERE shortcode IN ({placeholders})
+            ''', chunk).fetchall()
+            found.update(row[0] for row in rows)
+
+        return found
+
+    def create_link(self, link, dedup=False):
+        generator = self.code_generator
+        with self._link_changes() as changes, self.database.writer() as conn:
+            if dedup and not link['code']:
+                # IMMEDIATE so no other writer adds the same page between the
+                # lookup and the insert.
+                conn.execute('BEGIN IMMEDIATE')
+                existing = self._duplicates(conn, [(0, link, *url_key(link['url']))])
+                if existing:
+                    raise DuplicateLink(existing[0])
+
+            if link['code']:
+                attempts = [link['code']]
+            else:
+                attempts = (generator.generate(conn) for _ in range(self.attempts))
+
+            for code in attempts:
+                try:
+                    conn.execute(f'''
+                        INSERT INTO {self.table_urls}
+                        (original_url, shortcode, expires_at, redirect_status, url_hash)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (link['url'], code, link['expires_at'], link.get('redirect'), url_hash(link['url'])))
+                except sqlite3.IntegrityError:
+                    if link['code']:
+                        raise ShortcodeTaken(code)
+                    generator.collisions += 1
+                    continue
+                self._claim(conn, [code])
+                changes.append(LinkChange(code, link['url'], link['expires_at'], link.get('redirect')))
+                return code
+
+        raise CodeUnavailable("Could not generate a unique short code")
+
+    def create_links(self, links, dedup=False):
+        # One IMMEDIATE transaction so the existence checks and the insert see
+        # the same table.
+        generator = self.code_generator
+        with self._link_changes() as changes, self.database.writer() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            taken = self._existing_codes(conn, [link['code'] for _, link in links if link['code']])
+            assigned = []
+            failed = []
+
+            reused = {}
+            followers = []
+            if dedup:
+                keyed = [(index, link, *url_key(link['url'])) for index, link in links if not link['code']]
+                reused = self._duplicates(conn, keyed)
+                # Links to the same page within the batch share the first
+                # one's new code.
+                leaders = {}
+                for index, link, normalized, _ in keyed:
+                    if index in reused:
+                        continue
+                    key = (normalized, link['expires_at'], link.get('redirect'))
+                    if key in leaders:
+                        followers.append((index, leaders[key]))
+                    else:
+                        leaders[key] = index
+            skipped = set(reused).union(index for index, _ in followers)
+
+            for index, link in links:
+                if not link['code']:
+                    continue
+                if link['code'] in taken:
+                    failed.append((index, link['code']))
+                    continue
+                taken.add(link['code'])
+                assigned.append((index, link))
+
+            pending = [(index, link) for index, link in links if not link['code'] and index not in skipped]
+            for _ in range(self.attempts):
+                if not pending:
+                    break
+                candidates = {}
+                for index, link in pending:
+                    code = generator.generate(conn)
+                    while code in taken or code in candidates:
+                        generator.collisions += 1
+                        code = generator.generate(conn)
+                    candidates[code] = (index, link)
+
+                collisions = self._existing_codes(conn, candidates)
+                pending = []
+                for code, (index, link) in candidates.items():
+                    if code in collisions:
+                        generator.collisions += 1
+                        taken.add(code)
+                        pending.append((index, link))
+                        continue
+                    taken.add(code)
+                    assigned.append((index, dict(link, code=code)))
+
+            for index, link in pending:
+                failed.append((index, None))
+
+            conn.executemany(f'''
+                INSERT INTO {self.table_urls}
+                (original_url, shortcode, expires_at, redirect_status, url_hash)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (link['url'], link['code'], link['expires_at'], link.get('redirect'), url_hash(link['url']))
+                for _, link in assigned
+            ])
+            self._claim(conn, [link['code'] for _, link in assigned])
+            changes.extend(
+                LinkChange(link['code'], link['url'], link['expires_at'], link.get('redirect'))
+                for _, link in assigned
+            )
+
+        created = dict(assigned)
+        for index, leader in followers:
+            if leader in created:
+                assigned.append((index, dict(created[leader], existing=True)))
+            else:
+                failed.append((index, None))
+        assigned.extend(reused.items())
+        return assigned, failed
+
+    def _duplicates(self, conn, keyed):
+        # keyed are (index, link, normalized URL, hash); returns {index:
+        # existing link} for those a stored link can stand in for. The hash
+        # only narrows the rows; the normalized URLs are compared too.
+        by_hash = {}
+        for index, link, normalized, hashed in keyed:
+            by_hash.setdefault(hashed, []).append((index, link, normalized))
+        hashes = list(by_hash)
+        found = {}
+
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = conn.execute(f'''
+                SELECT id, url_hash, shortcode, original_url, expires_at, redirect_status
+                FROM {self.table_urls}
+                WHERE url_hash IN ({placeholders})
+            ''', chunk).fetchall()
+            # Oldest first, sorted here rather than in a temp b-tree.
+            for _, hashed, code, url, expires_at, redirect_status in sorted(rows):
+                for index, link, normalized in by_hash[hashed]:
+                    if index not in found and self._reusable(link, normalized, url, expires_at, redirect_status):
+                        found[index] = dict(link, code=code, url=url, expires_at=expires_at,
+                                            redirect=redirect_status, existing=True)
+
+        return found
+
+    @staticmethod
+    def _reusable(link, normalized, url, expires_at, redirect_status):
+        # Same redirect, and the same kind of expiry: links without one only
+        # stand in for each other, and an expiring link must last at least as
+        # long as the new one would.
+        if redirect_status != link.get('redirect'):
+            return False
+        if link['expires_at'] is None:
+            if expires_at is not None:
+                return False
+        elif expires_at is None or expires_at < link['expires_at']:
+            return False
+        return normalize_url(url) == normalized
+
+    def update_link(self, code, new_url=None, new_code=None, redirect_status=None):
+        # A single UPDATE ... RETURNING: the UNIQUE constraint on shortcode
+        # settles a rename race instead of a separate existence check.
+        renamed = bool(new_code) and new_code != code
+        with self._link_changes() as changes, self.database.writer() as conn:
+            try:
+                rows = conn.execute(f'''
+                    UPDATE {self.table_urls}
+                    SET original_url = COALESCE(?, original_url),
+                        url_hash = COALESCE(?, url_hash),
+                        shortcode = COALESCE(?, shortcode),
+                        redirect_status = COALESCE(?, redirect_status)
+                    WHERE shortcode = ?
+                    RETURNING shortcode, original_url, expires_at, redirect_status
+                ''', (new_url, url_hash(new_url) if new_url else None, new_code, redirect_status, code)).fetchall()
+            except sqlite3.IntegrityError:
+                raise ShortcodeTaken(new_code)
+            if not rows:
+                return False
+
+            if renamed:
+                self._claim(conn, [new_code])
+                self._renamed(conn, code, new_code)
+                changes.append(LinkChange(code, None, None, None))
+            changes.append(LinkChange(*rows[0], renamed_from=code if renamed else None))
+
+        return True
+
+    def delete_link(self, code):
+        with self._link_changes() as changes, self.database.writer() as conn:
+            rows = conn.execute(f'''
+                DELETE FROM {self.table_urls}
+                WHERE shortcode = ?
+                RETURNING shortcode
+            ''', (code,)).fetchall()
+            self._deleted(conn, code, len(rows))
+            if rows:
+                changes.append(LinkChange(code, None, None, None))
+
+        return bool(rows)
+
+    def expiring(self, until, limit):
+        with self.database.reader() as conn:
+            return conn.execute(f'''
+                SELECT expires_at, shortcode FROM {self.table_urls}
+                WHERE expires_at <= ?
+                ORDER BY expires_at
+                LIMIT ?
+            ''', (until, limit)).fetchall()
+
+    def count_expiring(self, until):
+        with self.database.reader() as conn:
+            return conn.execute(f'''
+                SELECT COUNT(*) FROM {self.table_urls}
+                WHERE expires_at <= ?
+            ''', (until,)).fetchone()[0]
+
+    def expire_links(self, codes, until, archive=False):
+        # expires_at is checked again here, so a code that was renamed,
+        # deleted or reused since it was scheduled is left alone.
+        with self._link_changes() as changes, self.database.writer() as conn:
+            rows = conn.execute(f'''
+                DELETE FROM {self.table_urls}
+                WHERE shortcode IN ({", ".join("?" * len(codes))})
+                AND expires_at <= ?
+                RETURNING shortcode, original_url, created_at, expires_at, clicks, redirect_status
+            ''', (*codes, until)).fetchall()
+            if archive and rows:
+                conn.executemany(f'''
+                    INSERT INTO {self.table_expired}
+                    (shortcode, original_url, created_at, expires_at, clicks, redirect_status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+            for row in rows:
+                self._deleted(conn, row[0], 1)
+                changes.append(LinkChange(row[0], None, None, None))
+
+        return [row[0] for row in rows]
+
+    def _renamed(self, conn, old_code, new_code):
+        # Clicks follow the link; archived months follow on retention's next
+        # run, in whichever worker runs it.
+        conn.execute(f'''
+            UPDATE {self.table_analytics}
+            SET shortcode = ?
+            WHERE shortcode = ?
+        ''', (new_code, old_code))
+        conn.execute(f'''
+            INSERT INTO {self.table_renames} (old_code, new_code)
+            VALUES (?, ?)
+        ''', (old_code, new_code))
+        self.rollups.rename(conn, old_code, new_code)
+
+    def _deleted(self, conn, code, rows):
+        # Retention removes the clicks later; see _claim.
+        if rows:
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {self.table_orphans} (shortcode)
+                VALUES (?)
+            ''', (code,))
+
+    def _claim(self, conn, codes):
+        # A code taken by a new link or a rename may still carry a deleted
+        # link's clicks; they are dropped now rather than inherited.
+        orphans = []
+        for start in range(0, len(codes), 500):
+            chunk = codes[start:start + 500]
+            orphans.extend(row[0] for row in conn.execute(f'''
+                DELETE FROM {self.table_orphans}
+                WHERE shortcode IN ({", ".join("?" * len(chunk))})
+                RETURNING shortcode
+            ''', chunk).fetchall())
+        for code in orphans:
+            self._drop_clicks(conn, code)
+            self.rollups.delete(conn, code)
+
+    def _drop_clicks(self, conn, code):
+        conn.execute(f'''
+            DELETE FROM {self.table_analytics}
+            WHERE shortcode = ?
+        ''', (code,))
+
+    def _count_clicks(self, conn, batch, hooks):
+        counts = Counter(event[0] for event in batch)
+        conn.executemany(f'''
+            UPDATE {self.table_urls}
+            SET clicks = clicks + ?
+            WHERE shortcode = ?
+        ''', [(count, code) for code, count in counts.items()])
+        for hook in hooks:
+            hook(conn, batch)
+
+    def _live_clicks(self, conn, batch):
+        # Takes the write lock first so no rename or delete can commit
+        # between the check and the insert.
+        conn.execute('BEGIN IMMEDIATE')
+        live = self._existing_codes(conn, {event[0] for event in batch})
+        kept = [event for event in batch if event[0] in live]
+        self.dropped_clicks += len(batch) - len(kept)
+        return kept
+
+    def record_clicks(self, batch, hooks=()):
+        with self.database.writer() as conn:
+            batch = self._live_clicks(conn, batch)
+            conn.executemany(f'''
+                INSERT INTO {self.table_analytics}
+                (shortcode, ip_address, user_agent, referrer, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            ''', batch)
+            self._count_clicks(conn, batch, hooks)
+
+    def recent_clicks(self, code, limit=100):
+        with self.database.reader() as conn:
+            rows = conn.execute(f'''
+                SELECT timestamp, ip_address, user_agent, referrer
+                FROM {self.table_analytics}
+                WHERE shortcode = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (code, limit)).fetchall()
+
+        return [
+            {"timestamp": row[0], "ip_address": row[1], "user_agent": row[2], "referrer": row[3]}
+            for row in rows
+        ]
+
+    def iter_clicks(self, code=None, since=None, until=None, chunk_size=1000):
+        where = []
+        params = []
+        if code:
+            where.append('shortcode = ?')
+            params.append(code)
+        if since:
+            where.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            where.append('timestamp < ?')
+            params.append(until)
+        return iter_rows(self.database, self.table_analytics, CLICK_FIELDS, where, params, chunk_size=chunk_size)
+
+    def timeseries(self, code, granularity, since, until):
+        with self.database.reader() as conn:
+            series = self.rollups.series(conn, code, granularity, since, until)
+            breakdown = self.rollups.breakdown(conn, code, since, until)
+        return series, breakdown
+
+    def visitors(self, code, day):
+        with self.database.reader() as conn:
+            return self.rollups.visitors(conn, code, day)
+
+    def stats(self):
+        return {"backend": self.name, "dropped_clicks": self.dropped_clicks,
+                "sketch_writes": self.rollups.sketch_writes, "search": self.search_available}
+
+
+class LogStorage(SQLiteStorage):
+    # Links and click aggregates (counts, rollups) stay in SQLite; the raw
+    # click events, which are write-heavy and read rarely, go to append-only
+    # monthly segment files instead of an indexed table. Each line is a JSON
+    # array led by the shortcode, so readers can skip lines with a prefix
+    # check before parsing, and ends with the time it was appended. Deletes
+    # and renames are kept as a history of (code, at, new_code) rows: events
+    # for code appended before `at` belong to new_code, or to nobody when it
+    # is NULL. Old segments are dropped whole. Each batch also records, per
+    # code, the byte span its lines cover, so one code's recent clicks are
+    # read without scanning the segments.
+    name = "log"
+
+    def __init__(self, database, table_urls, table_analytics, table_counters,
+                 code_generator, rollups, attempts=5, link_index=None,
+                 search=True, log_dir="click_log", fsync=False):
+        super().__init__(database, table_urls, table_analytics, table_counters,
+                         code_generator, rollups, attempts, link_index, search)
+        self.log_dir = log_dir
+        self.fsync = fsync
+        self.table_history = f"{table_analytics}_history"
+        self.table_spans = f"{table_analytics}_spans"
+        self.appended = 0
+        self.bytes_appended = 0
+
+    def _create_tables(self, conn):
+        super()._create_tables(conn)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_history} (
+                shortcode TEXT NOT NULL,
+                at TEXT NOT NULL,
+                new_code TEXT NULL,
+                PRIMARY KEY (shortcode, at)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_history_new_code ON {self.table_history}(new_code) WHERE new_code IS NOT NULL')
+        spans_exist = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                   (self.table_spans,)).fetchone()
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_spans} (
+                shortcode TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (shortcode, segment, position)
+            ) WITHOUT ROWID
+        ''')
+        if not spans_exist:
+            self._index_segments(conn)
+        # Earlier versions kept only the last delete per code.
+        tombstones = f"{self.table_analytics}_tombstones"
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tombstones,)).fetchone():
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {self.table_history} (shortcode, at, new_code)
+                SELECT shortcode, deleted_at, NULL FROM {tombstones}
+            ''')
+            conn.execute(f"DROP TABLE {tombstones}")
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def _deleted(self, conn, code, rows):
+        super()._deleted(conn, code, rows)
+        if rows:
+            self._add_history(conn, (code, _log_stamp(), None))
+
+    def _drop_clicks(self, conn, code):
+        # The delete's history entry already hides the events.
+        pass
+
+    def _renamed(self, conn, old_code, new_code):
+        # The events stay in the segments under old_code; readers follow the
+        # rename instead.
+        self.rollups.rename(conn, old_code, new_code)
+        self._add_history(conn, (old_code, _log_stamp(), new_code))
+
+    def _add_history(self, conn, *entries):
+        conn.executemany(f'''
+            INSERT INTO {self.table_history} (shortcode, at, new_code)
+            VALUES (?, ?, ?)
+            ON CONFLICT (shortcode, at) DO UPDATE SET new_code = excluded.new_code
+        ''', entries)
+
+    def _history(self, code=None):
+        # {code: [(at, new_code)]}, oldest first. Given a code, only the
+        # entries of codes that were renamed into it, which is all _owner()
+        # needs to tell whether an event ends up there.
+        with self.database.reader() as conn:
+            if code is None:
+                rows = conn.execute(f'SELECT shortcode, at, new_code FROM {self.table_history} ORDER BY shortcode, at')
+            else:
+                rows = conn.execute(f'''
+                    WITH RECURSIVE sources(code) AS (
+                        SELECT ?
+                        UNION
+                        SELECT h.shortcode FROM {self.table_history} h JOIN sources s ON h.new_code = s.code
+                    )
+                    SELECT shortcode, at, new_code FROM {self.table_history}
+                    WHERE shortcode IN sources
+                    ORDER BY shortcode, at
+                ''', (code,))
+            history = {}
+            for code, at, new_code in rows:
+                history.setdefault(code, []).append((at, new_code))
+        return history
+
+    @staticmethod
+    def _owner(history, code, appended_at):
+        # The code an event appended under code belongs to now, or None if it
+        # was deleted. After a rename only later entries of the new code
+        # apply, which also keeps A -> B -> A finite.
+        inclusive = True
+        while True:
+            for at, new_code in history.get(code, ()):
+                if at > appended_at or (inclusive and at == appended_at):
+                    break
+            else:
+                return code
+            if new_code is None:
+                return None
+            code, appended_at, inclusive = new_code, at, False
+
+    @staticmethod
+    def _sources(history, code):
+        # code plus every code whose events may have been renamed into it.
+        renamed_into = {}
+        for source, entries in history.items():
+            for _, new_code in entries:
+                if new_code is not None:
+                    renamed_into.setdefault(new_code, set()).add(source)
+        sources = {code}
+        pending = [code]
+        while pending:
+            for source in renamed_into.get(pending.pop(), ()):
+                if source not in sources:
+                    sources.add(source)
+                    pending.append(source)
+        return sources
+
+    @staticmethod
+    def _prefix(code):
+        return json.dumps([code])[:-1].encode("utf-8") + b","
+
+    def segment_path(self, year, month):
+        return os.path.join(self.log_dir, f"clicks-{year:04d}-{month:02d}.log")
+
+    def segments(self):
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            match = _SEGMENT_NAME.match(name)
+            if match:
+                found.append((int(match.group(1)), int(match.group(2)), os.path.join(self.log_dir, name)))
+        return sorted(found)
+
+    def _append(self, path, data):
+        # O_APPEND plus an exclusive lock keeps batches from different worker
+        # processes whole and in order. Returns the offset data landed at.
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            offset = os.fstat(fd).st_size
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        return offset
+
+    @staticmethod
+    def _spans(lines, offset=0):
+        # {code: (start, end)} covering each code's lines among
+        # (code, encoded line) pairs, newline included.
+        spans = {}
+        position = offset
+        for code, line in lines:
+            end = position + len(line) + 1
+            start = spans[code][0] if code in spans else position
+            spans[code] = (start, end)
+            position = end
+        return spans
+
+    def _add_spans(self, conn, segment, spans):
+        conn.executemany(f'''
+            INSERT OR IGNORE INTO {self.table_spans} (shortcode, segment, position, length)
+            VALUES (?, ?, ?, ?)
+        ''', [(code, segment, start, end - start) for code, (start, end) in spans.items()])
+
+    def _index_segments(self, conn, block_lines=1000):
+        # Spans for segments written before they were recorded, in blocks of
+        # lines standing in for the original batches.
+        for year, month, path in self.segments():
+            segment = f"{year:04d}-{month:02d}"
+            position = 0
+            block = []
+            for line in self._read_lines(path):
+                event = self._decode(line)
+                block.append((event[0] if event else None, line.rstrip(b"\n")))
+                if len(block) >= block_lines:
+                    self._add_spans(conn, segment, self._live_spans(block, position))
+                    position += sum(len(line) + 1 for _, line in block)
+                    block = []
+            self._add_spans(conn, segment, self._live_spans(block, position))
+
+    def _live_spans(self, block, position):
+        spans = self._spans(block, position)
+        spans.pop(None, None)
+        return spans
+
+    def record_clicks(self, batch, hooks=()):
+        # The events are appended inside the transaction that counts them, so
+        # a rename or delete lands wholly before or after the batch. A failed
+        # commit leaves events without counts rather than the reverse.
+        with self.database.writer() as conn:
+            batch = self._live_clicks(conn, batch)
+            appended_at = _log_stamp()
+            by_segment = {}
+            for shortcode, ip_address, user_agent, referrer, timestamp in batch:
+                line = json.dumps([shortcode, timestamp, ip_address, user_agent, referrer, appended_at],
+                                  separators=(",", ":")).encode("utf-8")
+                by_segment.setdefault(timestamp[:7], []).append((shortcode, line))
+
+            for month, lines in by_segment.items():
+                data = b"".join(line + b"\n" for _, line in lines)
+                offset = self._append(self.segment_path(int(month[:4]), int(month[5:7])), data)
+                self._add_spans(conn, month, self._spans(lines, offset))
+                self.appended += len(lines)
+                self.bytes_appended += len(data)
+
+            self._count_clicks(conn, batch, hooks)
+
+    def _read_lines(self, path):
+        try:
+            with open(path, "rb") as f:
+                yield from f
+        except FileNotFoundError:
+            return
+
+    def _decode(self, line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # A batch still being appended by another process.
+            return None
+        if not isinstance(event, list) or len(event) not in (5, 6):
+            return None
+        # Lines written before appends were stamped order by click time.
+        return event if len(event) == 6 else event + event[1:2]
+
+    def recent_clicks(self, code, limit=100):
+        history = self._history(code)
+        sources = self._sources(history, code)
+        prefixes = tuple(self._prefix(source) for source in sources)
+        with self.database.reader() as conn:
+            spans = conn.execute(f'''
+                SELECT DISTINCT segment, position, length FROM {self.table_spans}
+                WHERE shortcode IN ({", ".join("?" * len(sources))})
+                ORDER BY segment DESC, position DESC
+            ''', tuple(sources)).fetchall()
+        clicks = []
+        seen = set()
+        files = {}
+        try:
+            for segment, position, length in spans:
+                if segment not in files:
+                    try:
+                        files[segment] = open(self.segment_path(int(segment[:4]), int(segment[5:7])), "rb")
+                    except FileNotFoundError:
+                        files[segment] = None
+                f = files[segment]
+                if f is None:
+                    continue
+                f.seek(position)
+                lines = f.read(length).split(b"\n")[:-1]
+                # Spans of different sources can overlap within a batch.
+                starts = [position]
+                for line in lines[:-1]:
+                    starts.append(starts[-1] + len(line) + 1)
+                for start, line in zip(reversed(starts), reversed(lines)):
+                    if not line.startswith(prefixes) or (segment, start) in seen:
+                        continue
+                    seen.add((segment, start))
+                    event = self._decode(line)
+                    if event is None or self._owner(history, event[0], event[5]) != code:
+                        continue
+                    clicks.append({
+                        "timestamp": event[1],
+                        "ip_address": event[2],
+                        "user_agent": event[3],
+                        "referrer": event[4]
+                    })
+                # Spans are in arrival order, which is close to but not
+                # exactly timestamp order across workers.
+                if len(clicks) >= limit:
+                    break
+        finally:
+            for f in files.values():
+                if f is not None:
+                    f.close()
+        clicks.sort(key=lambda click: click["timestamp"], reverse=True)
+        return clicks[:limit]
+
+    def iter_clicks(self, code=None, since=None, until=None, chunk_size=1000):
+        # Events are reported under the code they belong to now.
+        history = self._history(code)
+        prefixes = tuple(self._prefix(source) for source in self._sources(history, code)) if code else None
+        for year, month, path in self.segments():
+            segment = f"{year:04d}-{month:02d}"
+            if (since and segment < since[:7]) or (until and segment > until[:7]):
+                continue
+            for line in self._read_lines(path):
+                if prefixes and not line.startswith(prefixes):
+                    continue
+                event = self._decode(line)
+                if event is None:
+                    continue
+                timestamp = event[1]
+                if (since and timestamp < since) or (until and timestamp >= until):
+                    continue
+                owner = self._owner(history, event[0], event[5])
+                if owner is None or (code and owner != code):
+                    continue
+                yield (owner, *event[1:5])
+
+    def purge_before(self, year, month):
+        # Drops whole segments older than (year, month) and the history that
+        # only covered them.
+        purged = 0
+        for segment_year, segment_month, path in self.segments():
+            if (segment_year, segment_month) >= (year, month):
+                continue
+            os.remove(path)
+            purged += 1
+        with self.database.writer() as conn:
+            conn.execute(f'''
+                DELETE FROM {self.table_history}
+                WHERE at < ?
+            ''', (f"{year:04d}-{month:02d}-01 00:00:00",))
+            conn.execute(f'''
+                DELETE FROM {self.table_spans}
+                WHERE segment < ?
+            ''', (f"{year:04d}-{month:02d}",))
+        return purged
+
+    def stats(self):
+        segments = self.segments()
+        size = 0
+        for _, _, path in segments:
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return {
+            "backend": self.name,
+            "segments": len(segments),
+            "bytes": size,
+            "appended": self.appended,
+            "bytes_appended": self.bytes_appended,
+            "dropped_clicks": self.dropped_clicks,
+            "sketch_writes": self.rollups.sketch_writes,
+            "search": self.search_available
+        }
+
+
+STORAGE_BACKENDS = {
+    SQLiteStorage.name: SQLiteStorage,
+    LogStorage.name: LogStorage
+}
+
+
+def create_storage(backend, database, table_urls, table_analytics, table_counters,
+                   code_generator, rollups, **options):
+    try:
+        storage = STORAGE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return storage(database, table_urls, table_analytics, table_counters,
+                   code_generator, rollups, **options)